@@ -1,17 +1,38 @@
 from flask import Flask, jsonify, request, render_template, send_file
+import click
 from io import BytesIO
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.utils import ImageReader
 from PyPDF2 import PdfReader, PdfWriter
 from PyPDF2._page import PageObject
-from PyPDF2.generic import NameObject, BooleanObject
-from datetime import datetime, date
+from PyPDF2.generic import ArrayObject, BooleanObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+from datetime import datetime, date, timedelta
 from copy import deepcopy
+from decimal import Decimal, ROUND_HALF_UP
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func, inspect, text
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.dialects import postgresql as pg_dialect, sqlite as sqlite_dialect
+from sqlalchemy import Date, case, func, insert, inspect, null, or_, select, text, tuple_
+from sqlalchemy import event as sqla_event
+from array import array
+from collections import namedtuple
+import base64
+import csv
+import gzip
+import hashlib
+import json
+import multiprocessing
 import os
+import re
+import shutil
+import tempfile
+import threading
+import unicodedata
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import chain
+from types import SimpleNamespace
 
 # ...
 app = Flask(__name__)
@@ -32,44 +53,13 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 db = SQLAlchemy(app)
 
-with app.app_context():
-    try:
-        db.create_all()
-
-        with db.engine.begin() as conn:
-            inspector = inspect(conn)
-            if 'students' in inspector.get_table_names():
-                student_columns = {col['name'] for col in inspector.get_columns('students')}
-                student_column_defs = {
-                    'notes': 'TEXT',
-                    'status': "TEXT DEFAULT 'activo'",
-                    'tutor_type': "TEXT DEFAULT 'padre'",
-                    'father_birthdate': 'DATE',
-                    'mother_birthdate': 'DATE',
-                }
-                for column_name, column_def in student_column_defs.items():
-                    if column_name not in student_columns:
-                        conn.execute(text(f"ALTER TABLE students ADD COLUMN {column_name} {column_def}"))
-    except Exception:
-        # Si falla (por ejemplo en SQLite viejo), se ignora y se asume que la tabla se recreará en limpio.
-        pass
 
-    # Asegurar columnas nuevas en fee_payments (migración liviana, idempotente)
+def _env_int(name: str, default: int):
     try:
-        with db.engine.begin() as conn:
-            inspector = inspect(conn)
-            if 'fee_payments' in inspector.get_table_names():
-                payment_columns = {col['name'] for col in inspector.get_columns('fee_payments')}
-                payment_column_defs = {
-                    'method': "TEXT DEFAULT 'cash'",
-                    'reference': 'TEXT',
-                    'notes': 'TEXT',
-                }
-                for column_name, column_def in payment_column_defs.items():
-                    if column_name not in payment_columns:
-                        conn.execute(text(f"ALTER TABLE fee_payments ADD COLUMN {column_name} {column_def}"))
-    except Exception:
-        pass
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
 
 class Student(db.Model):
     __tablename__ = "students"
@@ -100,19 +90,35 @@ class Student(db.Model):
     notes = db.Column(db.Text)
     status = db.Column(db.String(10), default='activo')
     tutor_type = db.Column(db.String(20), default='padre')  # 'padre' | 'madre'
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Secuencia de sincronización: toda escritura la deja en NULL y el commit la numera (ver _stamp_sync_rows)
+    sync_seq = db.Column(db.BigInteger, onupdate=null())
+
+    __table_args__ = (
+        db.Index('ix_students_updated_at', 'updated_at'),
+        db.Index('ix_students_sync_seq', 'sync_seq'),
+    )
 
 
 class Event(db.Model):
     __tablename__ = "events"
 
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.String(10), nullable=False)  # YYYY-MM-DD
-    time = db.Column(db.String(8))  # HH:MM
+    date = db.Column(db.Date, nullable=False)
+    time = db.Column(db.Time)
     title = db.Column(db.String(200))
     type = db.Column(db.String(20), nullable=False, default="general")  # 'general' | 'exam'
     level = db.Column(db.String(80))
     place = db.Column(db.String(160))
     notes = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sync_seq = db.Column(db.BigInteger, onupdate=null())
+
+    __table_args__ = (
+        db.Index('ix_events_date', 'date'),
+        db.Index('ix_events_updated_at', 'updated_at'),
+        db.Index('ix_events_sync_seq', 'sync_seq'),
+    )
 
 
 class ExamInscription(db.Model):
@@ -122,6 +128,10 @@ class ExamInscription(db.Model):
     event_id = db.Column(db.Integer, db.ForeignKey("events.id"), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey("students.id"), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_exam_inscriptions_event_student', 'event_id', 'student_id'),
+    )
+
 
 class FeePayment(db.Model):
     __tablename__ = "fee_payments"
@@ -134,6 +144,14 @@ class FeePayment(db.Model):
     reference = db.Column(db.String(120))
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sync_seq = db.Column(db.BigInteger, onupdate=null())
+
+    __table_args__ = (
+        db.Index('ix_fee_payments_student_date', 'student_id', 'payment_date'),
+        db.Index('ix_fee_payments_updated_at', 'updated_at'),
+        db.Index('ix_fee_payments_sync_seq', 'sync_seq'),
+    )
 
 
 class FeeConfig(db.Model):
@@ -144,6 +162,8 @@ class FeeConfig(db.Model):
     due_day = db.Column(db.Integer, nullable=False, default=10)
     proration_mode = db.Column(db.String(20), nullable=False, default='days')  # 'days' | 'percent'
     proration_percent_default = db.Column(db.Numeric(5, 2), nullable=False, default=100)
+    # Se incrementa en cada cambio; los procesos lo comparan para invalidar su copia en memoria
+    version = db.Column(db.Integer, nullable=False, default=1)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
@@ -169,9 +189,18 @@ class FeeCharge(db.Model):
     proration_start_date = db.Column(db.Date)
     final_amount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Valores materializados por el ledger de saldos (ver _refresh_fee_balances)
+    paid_amount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    applied_credit = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    balance = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sync_seq = db.Column(db.BigInteger, onupdate=null())
 
     __table_args__ = (
         db.UniqueConstraint('student_id', 'period', name='uq_fee_charges_student_period'),
+        db.Index('ix_fee_charges_period', 'period'),
+        db.Index('ix_fee_charges_updated_at', 'updated_at'),
+        db.Index('ix_fee_charges_sync_seq', 'sync_seq'),
     )
 
 
@@ -184,64 +213,1116 @@ class FeeAllocation(db.Model):
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_fee_allocations_charge_id', 'charge_id'),
+        db.Index('ix_fee_allocations_payment_id', 'payment_id'),
+    )
+
+
+class StudentFeeBalance(db.Model):
+    __tablename__ = "student_fee_balances"
+
+    student_id = db.Column(db.Integer, db.ForeignKey("students.id"), primary_key=True)
+    balance_total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    credit_total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    has_partial = db.Column(db.Boolean, nullable=False, default=False)
+    charges_count = db.Column(db.Integer, nullable=False, default=0)
+    positive_charges_count = db.Column(db.Integer, nullable=False, default=0)
+    last_payment = db.Column(db.String(10))  # YYYY-MM-DD
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sync_seq = db.Column(db.BigInteger, onupdate=null())
+
+    __table_args__ = (
+        db.Index('ix_student_fee_balances_sync_seq', 'sync_seq'),
+    )
+
+
+class Job(db.Model):
+    __tablename__ = "jobs"
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    kind = db.Column(db.String(40), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued' | 'running' | 'done' | 'error'
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 0..100
+    message = db.Column(db.Text)
+    params = db.Column(db.Text)  # JSON
+    result_json = db.Column(db.Text)
+    result_path = db.Column(db.String(500))
+    result_filename = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime)
+
+
+class SyncTombstone(db.Model):
+    """Borrados de las tablas sincronizables, para que ?since= informe los ids eliminados."""
+    __tablename__ = "sync_tombstones"
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(40), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    student_id = db.Column(db.Integer)  # alumno de la cuota o pago borrado (para el resumen de cuotas)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sync_seq = db.Column(db.BigInteger)
+
+    __table_args__ = (
+        db.Index('ix_sync_tombstones_table_deleted', 'table_name', 'deleted_at'),
+        db.Index('ix_sync_tombstones_sync_seq', 'sync_seq'),
+    )
+
+
+class TableVersion(db.Model):
+    """Contador de cambios por tabla; cada commit que escribe en la tabla lo incrementa (ETag de los GET).
+
+    También guarda la secuencia de sincronización (SYNC_SEQUENCE_KEY) y el piso de tombstones depurados.
+    """
+    __tablename__ = "table_versions"
+
+    table_name = db.Column(db.String(60), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SchemaVersion(db.Model):
+    __tablename__ = "schema_version"
+
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# --- Migraciones de esquema ---
+# Cada paso es idempotente y se aplica una sola vez (al arrancar o con `flask db-upgrade`).
+# El request path nunca ejecuta DDL ni reflexión del esquema.
+
+def _add_missing_columns(conn, table_name: str, column_defs: dict):
+    inspector = inspect(conn)
+    if table_name not in inspector.get_table_names():
+        return
+    existing = {col['name'] for col in inspector.get_columns(table_name)}
+    for column_name, column_def in column_defs.items():
+        if column_name not in existing:
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_def}"))
+
+
+def _migration_base_tables(conn):
+    db.metadata.create_all(bind=conn)
+
+
+def _migration_students_columns(conn):
+    _add_missing_columns(conn, 'students', {
+        'notes': 'TEXT',
+        'status': "TEXT DEFAULT 'activo'",
+        'tutor_type': "TEXT DEFAULT 'padre'",
+        'father_birthdate': 'DATE',
+        'mother_birthdate': 'DATE',
+    })
+
+
+def _migration_fee_payments_columns(conn):
+    _add_missing_columns(conn, 'fee_payments', {
+        'method': "TEXT DEFAULT 'cash'",
+        'reference': 'TEXT',
+        'notes': 'TEXT',
+    })
+
+
+
+# Columnas indexadas para la búsqueda de alumnos (/api/students/search)
+STUDENT_SEARCH_COLUMNS = [
+    'full_name', 'last_name', 'first_name', 'dni', 'belt',
+    'father_name', 'mother_name', 'parent_email',
+]
+
+
+def _migration_students_search_index(conn):
+    cols = ', '.join(STUDENT_SEARCH_COLUMNS)
+    if conn.dialect.name == 'sqlite':
+        # FTS5 con contenido externo (la tabla students) sincronizado por triggers
+        new_cols = ', '.join(f'new.{c}' for c in STUDENT_SEARCH_COLUMNS)
+        old_cols = ', '.join(f'old.{c}' for c in STUDENT_SEARCH_COLUMNS)
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5({cols}, "
+            "content='students', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN "
+            f"INSERT INTO students_fts(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN "
+            f"INSERT INTO students_fts(students_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE ON students BEGIN "
+            f"INSERT INTO students_fts(students_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+            f"INSERT INTO students_fts(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+        ))
+        conn.execute(text("INSERT INTO students_fts(students_fts) VALUES ('rebuild')"))
+    elif conn.dialect.name == 'postgresql':
+        # En un Postgres administrado el rol puede no tener permiso para crear extensiones: se omite el
+        # índice (la búsqueda queda con LIKE) sin bloquear las migraciones siguientes
+        savepoint = conn.begin_nested()
+        try:
+            # unaccent() no es IMMUTABLE; lo envolvemos para poder usarlo en un índice de expresión
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+            conn.execute(text(
+                "CREATE OR REPLACE FUNCTION students_search_unaccent(text) RETURNS text "
+                "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+                "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$"
+            ))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_students_search ON students USING GIN ({_PG_STUDENT_SEARCH_VECTOR})"
+            ))
+        except DBAPIError as exc:
+            savepoint.rollback()
+            app.logger.warning(
+                'No se pudo crear el índice de búsqueda de alumnos (extensión unaccent): %s. '
+                'La búsqueda usa LIKE hasta que un administrador cree la extensión y el índice ix_students_search.',
+                exc.orig,
+            )
+        else:
+            savepoint.commit()
+
+
+
+def _migration_fee_charges_unique_period(conn):
+    # Bases creadas antes de declarar la restricción no la tienen; el upsert masivo la necesita
+    inspector = inspect(conn)
+    if 'fee_charges' not in inspector.get_table_names():
+        return
+    wanted = ['student_id', 'period']
+    for uc in inspector.get_unique_constraints('fee_charges'):
+        if list(uc.get('column_names') or []) == wanted:
+            return
+    for ix in inspector.get_indexes('fee_charges'):
+        if ix.get('unique') and list(ix.get('column_names') or []) == wanted:
+            return
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_fee_charges_student_period ON fee_charges (student_id, period)"
+    ))
+
+
+def _migration_fee_balances_ledger(conn):
+    _add_missing_columns(conn, 'fee_charges', {
+        'paid_amount': 'NUMERIC(10, 2) NOT NULL DEFAULT 0',
+        'applied_credit': 'NUMERIC(10, 2) NOT NULL DEFAULT 0',
+        'balance': 'NUMERIC(10, 2) NOT NULL DEFAULT 0',
+    })
+    # Tablas congeladas tal como eran en esta versión: los modelos actuales tienen columnas
+    # que agregan migraciones posteriores (y onupdate que las escriben)
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS student_fee_balances ("
+        "student_id INTEGER NOT NULL PRIMARY KEY REFERENCES students (id), "
+        "balance_total NUMERIC(12, 2) NOT NULL DEFAULT 0, "
+        "credit_total NUMERIC(12, 2) NOT NULL DEFAULT 0, "
+        "has_partial BOOLEAN NOT NULL DEFAULT FALSE, "
+        "charges_count INTEGER NOT NULL DEFAULT 0, "
+        "positive_charges_count INTEGER NOT NULL DEFAULT 0, "
+        "last_payment VARCHAR(10), "
+        "updated_at TIMESTAMP)"
+    ))
+    charges = db.table(
+        'fee_charges', db.column('id'), db.column('student_id'), db.column('period'),
+        db.column('due_date', Date), db.column('final_amount', db.Numeric(10, 2)),
+        db.column('paid_amount', db.Numeric(10, 2)), db.column('applied_credit', db.Numeric(10, 2)),
+        db.column('balance', db.Numeric(10, 2)),
+    )
+    payments = db.table(
+        'fee_payments', db.column('id'), db.column('student_id'), db.column('amount', db.Numeric(10, 2)),
+        db.column('payment_date'),
+    )
+    allocations = db.table(
+        'fee_allocations', db.column('payment_id'), db.column('charge_id'), db.column('amount', db.Numeric(10, 2)),
+    )
+    balances = db.table(
+        'student_fee_balances', db.column('student_id'), db.column('balance_total', db.Numeric(12, 2)),
+        db.column('credit_total', db.Numeric(12, 2)), db.column('has_partial', db.Boolean),
+        db.column('charges_count'), db.column('positive_charges_count'), db.column('last_payment'),
+        db.column('updated_at', db.DateTime),
+    )
+
+    rows = conn.execute(select(
+        charges.c.id, charges.c.student_id, charges.c.period, charges.c.due_date, charges.c.final_amount,
+    )).all()
+    paid_cents = {
+        cid: _to_cents(total)
+        for cid, total in conn.execute(
+            select(allocations.c.charge_id, func.sum(allocations.c.amount)).group_by(allocations.c.charge_id)
+        ).all()
+    }
+    allocated_by_payment = {
+        pid: _to_cents(total)
+        for pid, total in conn.execute(
+            select(allocations.c.payment_id, func.sum(allocations.c.amount)).group_by(allocations.c.payment_id)
+        ).all()
+    }
+    credit_cents = {}
+    last_payment = {}
+    for pid, sid, amount, payment_date in conn.execute(
+        select(payments.c.id, payments.c.student_id, payments.c.amount, payments.c.payment_date)
+    ).all():
+        credit_cents[sid] = credit_cents.get(sid, 0) + _to_cents(amount) - allocated_by_payment.get(pid, 0)
+        if payment_date and (last_payment.get(sid) or '') < payment_date:
+            last_payment[sid] = payment_date
+
+    ledger = _run_fee_engine(rows, paid_cents, credit_cents)
+    if ledger['rows']:
+        conn.execute(
+            charges.update()
+            .where(charges.c.id == db.bindparam('_id'))
+            .values(paid_amount=db.bindparam('_paid'), applied_credit=db.bindparam('_credit'),
+                    balance=db.bindparam('_balance')),
+            [
+                {'_id': c.id, '_paid': _from_cents(paid), '_credit': _from_cents(credit), '_balance': _from_cents(bal)}
+                for c, paid, credit, bal in zip(ledger['rows'], ledger['paid'], ledger['applied_credit'], ledger['balance'])
+            ],
+        )
+    conn.execute(balances.delete())
+    now = datetime.utcnow()
+    balance_rows = [
+        {
+            'student_id': sid,
+            'balance_total': _from_cents(st['balance_total']),
+            'credit_total': _from_cents(st['credit_total']),
+            'has_partial': st['has_partial'],
+            'charges_count': st['charges_count'],
+            'positive_charges_count': st['positive_charges_count'],
+            'last_payment': last_payment.get(sid),
+            'updated_at': now,
+        }
+        for sid, st in ledger['students'].items()
+    ]
+    if balance_rows:
+        conn.execute(balances.insert(), balance_rows)
+
+
+def _migration_jobs_table(conn):
+    Job.__table__.create(bind=conn, checkfirst=True)
+
+
+# Índices secundarios declarados en los modelos (ver también db-explain-check)
+SECONDARY_INDEX_MODELS = (FeeCharge, FeeAllocation, FeePayment, ExamInscription)
+SECONDARY_INDEX_NAMES = (
+    'ix_fee_charges_period', 'ix_fee_allocations_charge_id', 'ix_fee_allocations_payment_id',
+    'ix_fee_payments_student_date', 'ix_exam_inscriptions_event_student',
+)
+
+
+def _create_model_indexes(conn, model, names):
+    # Solo los índices indicados: los que se declaren después pueden depender de columnas aún no migradas
+    for index in model.__table__.indexes:
+        if index.name in names:
+            index.create(bind=conn, checkfirst=True)
+
+
+def _migration_secondary_indexes(conn):
+    for model in SECONDARY_INDEX_MODELS:
+        _create_model_indexes(conn, model, SECONDARY_INDEX_NAMES)
+
+
+def _migration_fee_config_version(conn):
+    _add_missing_columns(conn, 'fee_config', {'version': 'INTEGER NOT NULL DEFAULT 1'})
+    table = FeeConfig.__table__
+    first_id = conn.execute(select(func.min(table.c.id))).scalar()
+    if first_id is None:
+        conn.execute(table.insert().values(
+            monthly_amount=0, due_day=1, proration_mode='percent', proration_percent_default=100,
+            version=1, updated_at=datetime.utcnow(),
+        ))
+        return
+    # Vencimiento y prorrateo son fijos; se normalizan acá y no en cada lectura
+    conn.execute(table.update().where(table.c.id == first_id).values(
+        due_day=1, proration_mode='percent', proration_percent_default=100,
+        version=func.coalesce(table.c.version, 0) + 1,
+    ))
+
+def _migration_events_date_columns(conn):
+    inspector = inspect(conn)
+    if 'events' not in inspector.get_table_names():
+        return
+    rows = conn.execute(text("SELECT id, date, time FROM events")).all()
+    updates = []
+    dropped_times = []
+    for row in rows:
+        event_date = _parse_event_date(row.date)
+        if event_date is None:
+            raise RuntimeError(f"Evento {row.id}: fecha inválida {row.date!r}; corregila antes de migrar")
+        event_time = _parse_event_time(row.time)
+        if event_time is None and str(row.time or '').strip():
+            dropped_times.append(f'{row.id}={row.time!r}')
+        # Texto que Postgres convierte con ::date/::time y que Date/Time de SQLAlchemy leen en SQLite
+        updates.append({
+            'i': row.id,
+            'd': event_date.isoformat(),
+            't': event_time.strftime('%H:%M:%S.%f') if event_time else None,
+        })
+
+    # SQL literal: el modelo actual puede tener columnas que esta migración todavía no conoce
+    update_stmt = text("UPDATE events SET date = :d, time = :t WHERE id = :i")
+    if conn.dialect.name == 'postgresql':
+        columns = {col['name']: col['type'] for col in inspector.get_columns('events')}
+        if not isinstance(columns['date'], Date):
+            if updates:
+                conn.execute(update_stmt, updates)
+            conn.execute(text(
+                "ALTER TABLE events ALTER COLUMN date TYPE DATE USING date::date, "
+                "ALTER COLUMN time TYPE TIME USING time::time"
+            ))
+    elif updates:
+        # SQLite no tiene tipos de fecha: alcanza con reescribir el texto en el formato de SQLAlchemy
+        conn.execute(update_stmt, updates)
+    if dropped_times:
+        # La hora es opcional: no se frena la migración, pero queda registro del valor original
+        app.logger.warning(
+            'Eventos con hora ilegible guardados sin hora (id=valor original): %s', ', '.join(dropped_times),
+        )
+    _create_model_indexes(conn, Event, ('ix_events_date',))
+
+
+# Tablas con updated_at y tombstones para la sincronización incremental (?since=)
+SYNC_MODELS = (Student, Event, FeeCharge, FeePayment)
+
+
+def _migration_sync_updated_at(conn):
+    now = datetime.utcnow()
+    for model in SYNC_MODELS:
+        name = model.__tablename__
+        _add_missing_columns(conn, name, {'updated_at': 'TIMESTAMP'})
+        # SQL literal: el UPDATE del modelo actual escribiría columnas (onupdate) de migraciones posteriores
+        conn.execute(
+            text(f"UPDATE {name} SET updated_at = :now WHERE updated_at IS NULL")
+            .bindparams(db.bindparam('now', now, type_=db.DateTime))
+        )
+        _create_model_indexes(conn, model, (f'ix_{name}_updated_at',))
+    SyncTombstone.__table__.create(bind=conn, checkfirst=True)
+
+
+# Tablas con contador en table_versions. Una tabla nueva necesita su fila (migración) para invalidar ETags.
+VERSIONED_TABLES = (
+    'students', 'events', 'exam_inscriptions', 'fee_charges', 'fee_payments',
+    'fee_allocations', 'student_fee_balances', 'student_fee_settings', 'fee_config',
+)
+
+
+def _bump_table_versions(executor, table_names):
+    table = TableVersion.__table__
+    executor.execute(
+        table.update()
+        .where(table.c.table_name.in_(sorted(table_names)))
+        .values(version=table.c.version + 1, updated_at=datetime.utcnow())
+    )
+
+
+def _migration_table_versions(conn):
+    TableVersion.__table__.create(bind=conn, checkfirst=True)
+    table = TableVersion.__table__
+    existing = set(conn.execute(select(table.c.table_name)).scalars())
+    now = datetime.utcnow()
+    rows = [{'table_name': name, 'version': 1, 'updated_at': now} for name in VERSIONED_TABLES if name not in existing]
+    if rows:
+        conn.execute(table.insert(), rows)
+
+
+# Tablas numeradas con sync_seq en cada commit que las escribe: las de SYNC_MODELS, los saldos y los tombstones
+SYNC_SEQ_MODELS = SYNC_MODELS + (StudentFeeBalance, SyncTombstone)
+SYNC_SEQ_TABLES = tuple(model.__tablename__ for model in SYNC_SEQ_MODELS)
+# Filas de table_versions que no son tablas: la secuencia y el mayor sync_seq de tombstones depurados
+SYNC_SEQUENCE_KEY = 'sync_sequence'
+SYNC_PRUNED_KEY = 'sync_tombstones_pruned'
+
+
+def _stamp_sync_rows(conn, table_names):
+    """Numera con el próximo valor de la secuencia las filas escritas (sync_seq NULL) de table_names.
+
+    El UPDATE de la secuencia bloquea su fila hasta el fin de la transacción: los números quedan
+    en el orden de los commits, así que un cursor nunca deja atrás una fila que confirma después.
+    """
+    versions = TableVersion.__table__
+    conn.execute(
+        versions.update()
+        .where(versions.c.table_name == SYNC_SEQUENCE_KEY)
+        .values(version=versions.c.version + 1, updated_at=datetime.utcnow())
+    )
+    seq = conn.execute(select(versions.c.version).where(versions.c.table_name == SYNC_SEQUENCE_KEY)).scalar_one()
+    # SQL literal: no dispara onupdate ni los eventos de sesión, y sirve desde las migraciones
+    for name in sorted(table_names):
+        conn.execute(text(f"UPDATE {name} SET sync_seq = :seq WHERE sync_seq IS NULL"), {'seq': seq})
+
+
+def _migration_sync_sequence(conn):
+    for model in SYNC_SEQ_MODELS:
+        name = model.__tablename__
+        _add_missing_columns(conn, name, {'sync_seq': 'BIGINT'})
+        conn.execute(text(f"UPDATE {name} SET sync_seq = 0 WHERE sync_seq IS NULL"))
+        _create_model_indexes(conn, model, (f'ix_{name}_sync_seq',))
+    table = TableVersion.__table__
+    existing = set(conn.execute(select(table.c.table_name)).scalars())
+    now = datetime.utcnow()
+    rows = [
+        {'table_name': key, 'version': 0, 'updated_at': now}
+        for key in (SYNC_SEQUENCE_KEY, SYNC_PRUNED_KEY) if key not in existing
+    ]
+    if rows:
+        conn.execute(table.insert(), rows)
+
+
+# Documento de búsqueda en Postgres; debe coincidir textualmente con el índice ix_students_search
+_PG_STUDENT_SEARCH_VECTOR = (
+    "to_tsvector('simple'::regconfig, students_search_unaccent("
+    + " || ' ' || ".join(f"coalesce({c}, '')" for c in STUDENT_SEARCH_COLUMNS)
+    + "))"
+)
+
+# Lista ordenada: (versión, nombre, función). Nunca reordenar ni renumerar, solo agregar al final.
+MIGRATIONS = [
+    (1, 'base_tables', _migration_base_tables),
+    (2, 'students_columns', _migration_students_columns),
+    (3, 'fee_payments_columns', _migration_fee_payments_columns),
+    (4, 'students_search_index', _migration_students_search_index),
+    (5, 'fee_charges_unique_period', _migration_fee_charges_unique_period),
+    (6, 'fee_balances_ledger', _migration_fee_balances_ledger),
+    (7, 'jobs_table', _migration_jobs_table),
+    (8, 'secondary_indexes', _migration_secondary_indexes),
+    (9, 'fee_config_version', _migration_fee_config_version),
+    (10, 'events_date_columns', _migration_events_date_columns),
+    (11, 'sync_updated_at', _migration_sync_updated_at),
+    (12, 'table_versions', _migration_table_versions),
+    (13, 'sync_sequence', _migration_sync_sequence),
+]
+
+# Clave arbitraria para serializar migraciones entre workers en Postgres
+_MIGRATION_LOCK_KEY = 7400111
+
+
+def _get_schema_version(conn):
+    if 'schema_version' not in inspect(conn).get_table_names():
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar() or 0
+
+
+def _apply_migrations():
+    """Aplica en orden las migraciones pendientes y devuelve las versiones aplicadas."""
+    engine = db.engine
+    SchemaVersion.__table__.create(bind=engine, checkfirst=True)
+
+    applied = []
+    for version, name, step in MIGRATIONS:
+        with engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': _MIGRATION_LOCK_KEY})
+            # Releer dentro de la transacción por si otro proceso ya la aplicó
+            if _get_schema_version(conn) >= version:
+                continue
+            step(conn)
+            conn.execute(
+                SchemaVersion.__table__.insert().values(version=version, name=name, applied_at=datetime.utcnow())
+            )
+            applied.append(version)
+    if applied and 'table_versions' in inspect(engine).get_table_names():
+        # Las migraciones escriben por fuera de la sesión: invalidar todos los ETag y numerar lo escrito
+        with engine.begin() as conn:
+            _bump_table_versions(conn, VERSIONED_TABLES)
+            if _get_schema_version(conn) >= 13:
+                _stamp_sync_rows(conn, SYNC_SEQ_TABLES)
+    return applied
+
+
+@app.cli.command('db-upgrade')
+def cli_db_upgrade():
+    """Aplica las migraciones de esquema pendientes."""
+    applied = _apply_migrations()
+    if applied:
+        print(f"Migraciones aplicadas: {', '.join(str(v) for v in applied)}")
+    else:
+        print('El esquema ya está actualizado.')
+    with db.engine.connect() as conn:
+        print(f"Versión actual: {_get_schema_version(conn)}")
+
+
+def _hot_queries():
+    """Consultas frecuentes y los índices que cada una debe usar (se aceptan prefijos de nombre).
+
+    Las consultas se arman con las mismas funciones que usan los endpoints, con ids de ejemplo.
+    """
+    today = date.today()
+    period_stmt = _fees_overview_period_stmt(_parse_period('2026-01'), today)
+    return [
+        (
+            '_serialize_student_fees: cuotas del alumno',
+            _student_charges_stmt(1),
+            # En SQLite la restricción única de bases nuevas es un índice automático
+            ('uq_fee_charges_student_period', 'sqlite_autoindex_fee_charges'),
+        ),
+        (
+            '_serialize_student_fees: pagos del alumno',
+            _student_payments_stmt(1),
+            ('ix_fee_payments_student_date',),
+        ),
+        (
+            '_serialize_student_fees: imputaciones de los pagos',
+            _payment_allocations_stmt([1, 2, 3]),
+            ('ix_fee_allocations_payment_id',),
+        ),
+        (
+            'api_fees_overview: vencido por alumno (ledger)',
+            _fees_overview_ledger_stmt(today),
+            ('uq_fee_charges_student_period', 'sqlite_autoindex_fee_charges'),
+        ),
+        (
+            'api_fees_overview?period: cuotas del período',
+            period_stmt,
+            ('ix_fee_charges_period',),
+        ),
+        (
+            'api_fees_overview?period: imputaciones por cuota',
+            period_stmt,
+            ('ix_fee_allocations_charge_id',),
+        ),
+        (
+            'api_exam_students: inscriptos del examen',
+            _exam_inscription_ids_stmt(1),
+            ('ix_exam_inscriptions_event_student',),
+        ),
+        (
+            'api_calendar_month: eventos del mes',
+            _events_ordered(_calendar_events_stmt(date(2026, 1, 1), date(2026, 2, 1))),
+            ('ix_events_date',),
+        ),
+    ]
+
+
+def _plan_index_names(conn, stmt):
+    """Nombres de los índices que usa el plan de stmt (EXPLAIN en SQLite o Postgres)."""
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'postgresql':
+        # Con tablas chicas Postgres siempre elige seq scan; se verifica que el índice sea utilizable
+        conn.execute(text('SET LOCAL enable_seqscan = off'))
+        plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + sql).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        names = []
+        nodes = [entry['Plan'] for entry in plan]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Index Name'):
+                names.append(node['Index Name'])
+            nodes.extend(node.get('Plans') or [])
+        return names
+    details = [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).all()]
+    # Los índices automáticos de subconsultas aparecen como "AUTOMATIC ... INDEX (col=?)": sin nombre
+    return list(dict.fromkeys(re.findall(r'INDEX ([A-Za-z_]\w*)', '\n'.join(details))))
+
+
+@app.cli.command('db-explain-check')
+def cli_db_explain_check():
+    """Verifica con EXPLAIN que las consultas frecuentes usen los índices previstos."""
+    failures = 0
+    with db.engine.connect() as conn:
+        for label, stmt, expected in _hot_queries():
+            trans = conn.begin()
+            try:
+                names = _plan_index_names(conn, stmt)
+            finally:
+                trans.rollback()
+            if any(name.startswith(prefix) for name in names for prefix in expected):
+                print(f"OK     {label}: {', '.join(names)}")
+            else:
+                failures += 1
+                print(f"FALTA  {label}: se esperaba {' o '.join(expected)}, el plan usa {', '.join(names) or 'ningún índice'}")
+    if failures:
+        print(f'{failures} consultas sin el índice previsto. Ejecutá `flask db-upgrade`.')
+        raise SystemExit(1)
+
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 
+# --- Sincronización incremental (?since=) ---
+# Cada commit que escribe en una tabla sincronizable numera sus filas con el próximo valor de una
+# secuencia global (sync_seq, ver _stamp_sync_rows). El cursor es el último valor confirmado, leído
+# antes de las consultas: lo que confirma después recibe un número mayor y entra en el próximo pedido,
+# sin importar cuánto haya durado la transacción que lo escribió.
+# Un cursor con alcance (cursor~alcance) solo vale para ese alcance (p. ej. el día del resumen de cuotas).
+
+# Los tombstones más viejos se borran con `flask sync-cleanup`; un cursor anterior recibe la colección completa
+SYNC_TOMBSTONE_RETENTION_DAYS = max(1, _env_int('SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+
+
+def _sync_sequence_value(key: str) -> int:
+    table = TableVersion.__table__
+    return db.session.execute(select(table.c.version).where(table.c.table_name == key)).scalar() or 0
+
+
+def _new_sync_cursor(scope=None):
+    value = str(_sync_sequence_value(SYNC_SEQUENCE_KEY))
+    return f'{value}~{scope}' if scope else value
+
+
+def _parse_sync_since(raw, scope=None):
+    """Devuelve (desde, error). desde=None pide la colección completa.
+
+    Se resincroniza todo con since=0, con un cursor de otro alcance, con uno anterior a los tombstones
+    depurados o con uno de fecha (el formato anterior a la secuencia).
+    """
+    value = (raw or '').strip()
+    if value in ('', '0'):
+        return None, None
+    seq, _sep, cursor_scope = value.partition('~')
+    try:
+        since = int(seq)
+    except ValueError:
+        try:
+            datetime.fromisoformat(seq)
+        except ValueError:
+            return None, 'Cursor since inválido'
+        return None, None
+    if since < 0:
+        return None, 'Cursor since inválido'
+    if (cursor_scope or None) != scope or since < _sync_sequence_value(SYNC_PRUNED_KEY):
+        return None, None
+    return since, None
+
+
+def _synced_after(column, since):
+    # NULL: fila escrita por fuera de la sesión que todavía no recibió número
+    return or_(column > since, column.is_(None))
+
+
+def _record_tombstones(table_name: str, rows):
+    """Anota los borrados de una tabla sincronizable; rows son pares (id, student_id). No hace commit."""
+    now = datetime.utcnow()
+    values = [
+        {'table_name': table_name, 'row_id': row_id, 'student_id': student_id, 'deleted_at': now}
+        for row_id, student_id in rows
+    ]
+    if values:
+        db.session.execute(SyncTombstone.__table__.insert(), values)
+
+
+def _sync_changed_ids(model, since):
+    return set(db.session.execute(select(model.id).where(_synced_after(model.sync_seq, since))).scalars())
+
+
+def _sync_deleted_ids(table_name: str, since, changed_ids=(), item_ids=()):
+    """Ids que el cliente debe quitar: borrados desde since y filas cambiadas que ya no entran en el filtro."""
+    deleted = set(db.session.execute(
+        select(SyncTombstone.row_id)
+        .where(SyncTombstone.table_name == table_name, _synced_after(SyncTombstone.sync_seq, since))
+    ).scalars())
+    deleted.update(changed_ids)
+    return sorted(deleted - set(item_ids))
+
+
+def _prune_sync_tombstones(now=None):
+    """Borra los tombstones más viejos que la retención y devuelve cuántos borró. Hace commit.
+
+    Guarda el mayor sync_seq borrado: los cursores anteriores ya no pueden saber qué se eliminó.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS)
+    tombstones = SyncTombstone.__table__
+    expired = tombstones.c.deleted_at < cutoff
+    floor = db.session.execute(select(func.max(tombstones.c.sync_seq)).where(expired)).scalar()
+    removed = db.session.execute(tombstones.delete().where(expired)).rowcount
+    if floor is not None:
+        versions = TableVersion.__table__
+        db.session.execute(
+            versions.update()
+            .where(versions.c.table_name == SYNC_PRUNED_KEY, versions.c.version < floor)
+            .values(version=floor, updated_at=datetime.utcnow())
+        )
+    db.session.commit()
+    return removed
+
+
+# --- GET condicionales (ETag por versión de tabla) ---
+# Los eventos de sesión anotan qué tablas se escribieron (flush del ORM o DML ejecutado con
+# db.session) y antes del commit incrementan sus contadores en table_versions, en la misma
+# transacción. Las escrituras con db.engine o SQL textual no se registran.
+
+def _mark_tables_changed(session, table_names):
+    changed = {name for name in table_names if name in VERSIONED_TABLES}
+    if changed:
+        session.info.setdefault('changed_tables', set()).update(changed)
+    synced = {name for name in table_names if name in SYNC_SEQ_TABLES}
+    if synced:
+        session.info.setdefault('sync_tables', set()).update(synced)
+
+
+@sqla_event.listens_for(db.session, 'after_flush')
+def _track_flushed_tables(session, _flush_context):
+    _mark_tables_changed(session, {
+        obj.__table__.name for obj in chain(session.new, session.dirty, session.deleted)
+    })
+
+
+@sqla_event.listens_for(db.session, 'do_orm_execute')
+def _track_executed_tables(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _mark_tables_changed(orm_execute_state.session, {table.name})
+
+
+@sqla_event.listens_for(db.session, 'before_commit')
+def _bump_changed_table_versions(session):
+    # Flush explícito: los objetos pendientes se escriben recién después de before_commit
+    session.flush()
+    changed = session.info.pop('changed_tables', None)
+    if changed:
+        _bump_table_versions(session, changed)
+    synced = session.info.pop('sync_tables', None)
+    if synced:
+        # Por la conexión: estos UPDATE no deben volver a marcar tablas en los eventos de sesión
+        _stamp_sync_rows(session.connection(), synced)
+
+
+@sqla_event.listens_for(db.session, 'after_rollback')
+def _forget_changed_tables(session):
+    session.info.pop('changed_tables', None)
+    session.info.pop('sync_tables', None)
+
+
+def _versioned_get(table_names, build, *extra):
+    """GET condicional: ETag con las versiones de table_names, la ruta, la query string y extra.
+
+    Con If-None-Match coincidente responde 304 sin ejecutar build(). Last-Modified es informativo:
+    no se evalúa If-Modified-Since porque la resolución de un segundo (y extra) no alcanza.
+    """
+    table = TableVersion.__table__
+    versions = db.session.execute(
+        select(table.c.table_name, table.c.version, table.c.updated_at)
+        .where(table.c.table_name.in_(table_names))
+        .order_by(table.c.table_name)
+    ).all()
+    seed = json.dumps([
+        request.path,
+        sorted(request.args.items(multi=True)),
+        # La representación gzip (formato columnar) necesita su propio ETag fuerte
+        'gzip' in request.accept_encodings,
+        [[row.table_name, row.version] for row in versions],
+        [str(value) for value in extra],
+    ])
+    etag = hashlib.sha256(seed.encode('utf-8')).hexdigest()[:32]
+    last_modified = max((row.updated_at for row in versions if row.updated_at), default=None)
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(build())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# --- Formato columnar (?format=columnar) ---
+# {columns: [...], rows: [[...], ...]} armado directo de las filas de Core: los nombres de campo
+# van una sola vez y no se crean dicts por fila. Con Accept-Encoding: gzip el cuerpo va comprimido.
+
+RESPONSE_FORMATS = ('json', 'columnar')
+COLUMNAR_GZIP_MIN_BYTES = 1024
+
+
+def _response_format():
+    """Valor de ?format= (json por defecto), o None si no es válido."""
+    value = (request.args.get('format') or 'json').strip().lower()
+    return value if value in RESPONSE_FORMATS else None
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'No serializable: {type(value).__name__}')
+
+
+def _columnar_response(columns, rows):
+    body = json.dumps(
+        {'columns': columns, 'rows': rows},
+        default=_json_default, separators=(',', ':'), ensure_ascii=False,
+    ).encode('utf-8')
+    response = app.response_class(body, mimetype='application/json')
+    if len(body) >= COLUMNAR_GZIP_MIN_BYTES and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _sync_response(items, deleted, since, cursor: str):
+    """Cuerpo de ?since=: full indica que items es la colección completa y el cliente debe reemplazarla.
+
+    El cursor se toma antes de leer (ver _new_sync_cursor).
+    """
+    return jsonify({
+        'items': items,
+        'deleted': deleted,
+        'full': since is None,
+        'cursor': cursor,
+    })
+
+
+# --- Serializadores de filas de Core ---
+# Cada serializador precompila las columnas a seleccionar y el conversor de cada campo. Se aplica
+# sobre filas de session.execute(select(...)) (o text()) por posición, sin hidratar objetos ORM ni
+# pasar por el identity map. Las columnas extra al final del select (orden, cursores, claves de
+# agrupación) quedan fuera del dict.
+
+RowSerializer = namedtuple('RowSerializer', ['names', 'columns', 'plan'])
+
+
+def _iso_or_none(value):
+    return value.isoformat() if value is not None else None
+
+
+def _float_or_zero(value):
+    return float(value or 0)
+
+
+def _round_money(value):
+    return round(float(value or 0), 2)
+
+
+def _row_serializer(model, fields, converters=None):
+    converters = converters or {}
+    names = tuple(fields)
+    return RowSerializer(
+        names=names,
+        columns=tuple(getattr(model, name) for name in names),
+        plan=tuple((name, converters.get(name)) for name in names),
+    )
+
+
+def _serializer_select(serializer, *extra):
+    return select(*serializer.columns, *extra)
+
+
+def _serialize_row(serializer, row):
+    out = {}
+    for (name, convert), value in zip(serializer.plan, row):
+        out[name] = convert(value) if convert else value
+    return out
+
+
+def _serialize_rows(serializer, rows):
+    return [_serialize_row(serializer, row) for row in rows]
+
+
+@app.cli.command('serializer-bench')
+@click.option('--repeat', type=int, default=5, help='Repeticiones por modelo (se informa la mejor).')
+def cli_serializer_bench(repeat):
+    """Mide la serialización por filas de Core contra la hidratación de objetos ORM."""
+    import time
+
+    def best_ms(fn):
+        best = None
+        for _ in range(max(1, repeat)):
+            db.session.expunge_all()
+            start = time.perf_counter()
+            fn()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    for model, serializer in (
+        (Student, STUDENT_SERIALIZER),
+        (Event, EVENT_SERIALIZER),
+        (FeeCharge, FEE_CHARGE_SERIALIZER),
+        (FeePayment, FEE_PAYMENT_SERIALIZER),
+    ):
+        def orm():
+            out = []
+            for obj in db.session.execute(select(model)).scalars():
+                item = {}
+                for name, convert in serializer.plan:
+                    value = getattr(obj, name)
+                    item[name] = convert(value) if convert else value
+                out.append(item)
+            return out
+
+        def core():
+            return _serialize_rows(serializer, db.session.execute(_serializer_select(serializer)))
+
+        rows = len(core())
+        orm_ms, core_ms = best_ms(orm), best_ms(core)
+        ratio = orm_ms / core_ms if core_ms else 0.0
+        print(f'{model.__tablename__:<14} {rows:>7} filas  ORM {orm_ms:8.1f} ms  Core {core_ms:8.1f} ms  x{ratio:.1f}')
+    db.session.rollback()
+
+
 # --- Students CRUD ---
+
+# Columnas públicas de un alumno, en el orden en que se serializan
+STUDENT_FIELDS = [
+    'id', 'full_name', 'last_name', 'first_name', 'dni', 'gender', 'birthdate',
+    'blood', 'nationality', 'province', 'country', 'city', 'address', 'zip',
+    'school', 'belt', 'father_name', 'mother_name', 'father_birthdate',
+    'mother_birthdate', 'father_phone', 'mother_phone', 'parent_email', 'notes',
+    'status', 'tutor_type',
+]
+STUDENT_DATE_FIELDS = {'birthdate', 'father_birthdate', 'mother_birthdate'}
+STUDENT_CONVERTERS = {name: _iso_or_none for name in STUDENT_DATE_FIELDS}
+STUDENT_SERIALIZER = _row_serializer(Student, STUDENT_FIELDS, STUDENT_CONVERTERS)
+# Versión corta de un alumno embebida en otras respuestas (inscriptos a examen)
+STUDENT_BRIEF_SERIALIZER = _row_serializer(Student, ['id', 'full_name', 'last_name', 'first_name', 'belt'])
+STUDENTS_PAGE_MAX = 500
+
+
+def _student_sort_columns():
+    """Claves del orden de la lista de alumnos: (sin apellido, apellido, nombre, id).
+
+    Se usan COALESCE para que el cursor compare igual en SQLite y Postgres
+    (cada motor ordena los NULL de forma distinta).
+    """
+    return [
+        case((Student.last_name.is_(None), 1), else_=0).label('_k_null'),
+        func.coalesce(Student.last_name, '').label('_k_last'),
+        func.coalesce(Student.first_name, '').label('_k_first'),
+        Student.id.label('_k_id'),
+    ]
+
+
+def _encode_students_cursor(row):
+    raw = json.dumps([row._k_null, row._k_last, row._k_first, row._k_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_students_cursor(cursor_raw: str):
+    try:
+        padded = cursor_raw + '=' * (-len(cursor_raw) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        k_null, k_last, k_first, k_id = values
+        return int(k_null), str(k_last), str(k_first), int(k_id)
+    except Exception:
+        return None
+
+
+def _parse_student_fields(fields_raw):
+    """Normaliza el parámetro ?fields=a,b,c. Devuelve None si hay un campo desconocido."""
+    if not fields_raw:
+        return list(STUDENT_FIELDS)
+    fields = []
+    for name in fields_raw.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in STUDENT_FIELDS:
+            return None
+        if name not in fields:
+            fields.append(name)
+    return fields or list(STUDENT_FIELDS)
+
+
+def _student_serializer(fields):
+    """Serializador para la proyección pedida en ?fields= (reutiliza el completo si no hay proyección)."""
+    if list(fields) == STUDENT_FIELDS:
+        return STUDENT_SERIALIZER
+    return _row_serializer(Student, fields, STUDENT_CONVERTERS)
+
+
+def _list_students():
+    """GET /api/students con paginación por cursor (keyset) y proyección de columnas.
+
+    Parámetros opcionales:
+      - fields: columnas a devolver separadas por coma (por defecto todas).
+      - limit: tamaño de página (máximo STUDENTS_PAGE_MAX). Sin limit se devuelve la lista completa.
+      - cursor: valor de X-Next-Cursor de la página anterior.
+
+    El cuerpo sigue siendo una lista (o {columns, rows} con format=columnar); el total va en
+    X-Total-Count y el cursor siguiente en X-Next-Cursor.
+    Con since se devuelven solo los cambios (ver _list_students_since).
+    """
+    fields = _parse_student_fields(request.args.get('fields'))
+    if fields is None:
+        return jsonify({'error': 'Campo inválido en fields'}), 400
+    response_format = _response_format()
+    if response_format is None:
+        return jsonify({'error': 'format inválido (json o columnar)'}), 400
+
+    if request.args.get('since') is not None:
+        if request.args.get('limit') or request.args.get('cursor'):
+            return jsonify({'error': 'since no se puede combinar con limit ni cursor'}), 400
+        if response_format == 'columnar':
+            return jsonify({'error': 'since no se puede combinar con format=columnar'}), 400
+        return _list_students_since(request.args.get('since'), fields)
+
+    limit = None
+    limit_raw = request.args.get('limit')
+    if limit_raw:
+        try:
+            limit = int(limit_raw)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit inválido'}), 400
+        limit = max(1, min(limit, STUDENTS_PAGE_MAX))
+
+    serializer = _student_serializer(fields)
+    sort_cols = _student_sort_columns()
+    stmt = _serializer_select(serializer, *sort_cols)
+
+    cursor_raw = request.args.get('cursor')
+    if cursor_raw:
+        cursor = _decode_students_cursor(cursor_raw)
+        if cursor is None:
+            return jsonify({'error': 'Cursor inválido'}), 400
+        stmt = stmt.where(tuple_(*[col.element for col in sort_cols]) > tuple_(*cursor))
+
+    stmt = stmt.order_by(*[col.element.asc() for col in sort_cols])
+    if limit is not None:
+        # Pedimos una fila de más para saber si hay otra página
+        stmt = stmt.limit(limit + 1)
+
+    rows = db.session.execute(stmt).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_students_cursor(rows[-1])
+
+    total = db.session.execute(select(func.count(Student.id))).scalar() or 0
+
+    if response_format == 'columnar':
+        # Las columnas de orden van al final del select: se cortan con el slice
+        width = len(fields)
+        response = _columnar_response(fields, [row[:width] for row in rows])
+    else:
+        response = jsonify(_serialize_rows(serializer, rows))
+    response.headers['X-Total-Count'] = str(total)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def _list_students_since(since_raw, fields):
+    """GET /api/students?since=<cursor>: alumnos cambiados desde el cursor e ids borrados."""
+    since, error = _parse_sync_since(since_raw)
+    if error:
+        return jsonify({'error': error}), 400
+    if 'id' not in fields:
+        fields = ['id'] + fields
+    cursor = _new_sync_cursor()
+
+    serializer = _student_serializer(fields)
+    sort_cols = _student_sort_columns()
+    stmt = _serializer_select(serializer, *sort_cols)
+    if since is not None:
+        stmt = stmt.where(_synced_after(Student.sync_seq, since))
+    rows = db.session.execute(stmt.order_by(*[col.element.asc() for col in sort_cols])).all()
+    items = _serialize_rows(serializer, rows)
+    deleted = _sync_deleted_ids('students', since, item_ids=[row.id for row in rows]) if since is not None else []
+    return _sync_response(items, deleted, since, cursor)
+
+
 @app.route('/api/students', methods=['GET', 'POST'])
 def api_students():
     if request.method == 'GET':
-        # Asegurar que la columna tutor_type exista en entornos como Railway (Postgres).
-        # Si ya existe o la BD no soporta IF NOT EXISTS, se ignora cualquier error.
-        try:
-            with db.engine.connect() as conn:
-                conn.execute(text(
-                    "ALTER TABLE IF EXISTS students "
-                    "ADD COLUMN IF NOT EXISTS tutor_type TEXT DEFAULT 'padre'"
-                ))
-                conn.commit()
-        except Exception:
-            pass
-
-        students_q = Student.query.order_by(
-            (Student.last_name.is_(None)).asc(),
-            Student.last_name.asc(),
-            Student.first_name.asc(),
-        ).all()
-        result = []
-        for s in students_q:
-            result.append({
-                'id': s.id,
-                'full_name': s.full_name,
-                'last_name': s.last_name,
-                'first_name': s.first_name,
-                'dni': s.dni,
-                'gender': s.gender,
-                'birthdate': s.birthdate.isoformat() if s.birthdate else None,
-                'blood': s.blood,
-                'nationality': s.nationality,
-                'province': s.province,
-                'country': s.country,
-                'city': s.city,
-                'address': s.address,
-                'zip': s.zip,
-                'school': s.school,
-                'belt': s.belt,
-                'father_name': s.father_name,
-                'mother_name': s.mother_name,
-                'father_birthdate': s.father_birthdate.isoformat() if s.father_birthdate else None,
-                'mother_birthdate': s.mother_birthdate.isoformat() if s.mother_birthdate else None,
-                'father_phone': s.father_phone,
-                'mother_phone': s.mother_phone,
-                'parent_email': s.parent_email,
-                'notes': s.notes,
-                'status': s.status,
-                'tutor_type': s.tutor_type,
-            })
-        return jsonify(result)
+        return _versioned_get(('students',), _list_students)
 
     data = request.json or {}
     birthdate_val = data.get('birthdate')
@@ -301,42 +1382,127 @@ def api_students():
     return jsonify({'id': student.id, 'full_name': student.full_name}), 201
 
 
+STUDENT_SEARCH_FIELDS = ['id', 'full_name', 'last_name', 'first_name', 'dni', 'belt', 'status']
+STUDENT_SEARCH_SERIALIZER = _row_serializer(Student, STUDENT_SEARCH_FIELDS)
+STUDENT_SEARCH_LIMIT_DEFAULT = 20
+STUDENT_SEARCH_LIMIT_MAX = 50
+
+# Backend de búsqueda detectado una sola vez por proceso: 'fts5' | 'postgres' | 'like'
+_student_search_backend = None
+
+
+def _get_student_search_backend():
+    global _student_search_backend
+    if _student_search_backend is None:
+        backend = 'like'
+        try:
+            dialect = db.engine.dialect.name
+            with db.engine.connect() as conn:
+                if dialect == 'sqlite':
+                    found = conn.execute(text(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students_fts'"
+                    )).first()
+                    if found:
+                        backend = 'fts5'
+                elif dialect == 'postgresql':
+                    found = conn.execute(text(
+                        "SELECT to_regclass('ix_students_search') IS NOT NULL"
+                    )).scalar()
+                    if found:
+                        backend = 'postgres'
+        except Exception:
+            # No se cachea: se vuelve a intentar en la próxima búsqueda
+            return 'like'
+        _student_search_backend = backend
+    return _student_search_backend
+
+
+def _search_tokens(query_raw: str):
+    """Separa la consulta en tokens alfanuméricos, sin acentos y en minúsculas."""
+    normalized = unicodedata.normalize('NFKD', query_raw or '')
+    normalized = ''.join(ch for ch in normalized if not unicodedata.combining(ch)).lower()
+    return [tok for tok in re.split(r'[^0-9a-zñ]+', normalized) if tok][:8]
+
+
+def _search_students(tokens, limit: int):
+    fields_sql = ', '.join(f's.{name}' for name in STUDENT_SEARCH_FIELDS)
+    backend = _get_student_search_backend()
+
+    if backend == 'fts5':
+        # Prefijo por token, todos obligatorios (AND implícito); bm25 pondera nombre sobre datos de padres
+        match = ' '.join(f'"{tok}"*' for tok in tokens)
+        stmt = text(
+            f"SELECT {fields_sql}, bm25(students_fts, 4.0, 4.0, 4.0, 3.0, 1.0, 1.0, 1.0, 1.0) AS rank "
+            "FROM students_fts JOIN students s ON s.id = students_fts.rowid "
+            "WHERE students_fts MATCH :match ORDER BY rank, s.id LIMIT :limit"
+        )
+        return db.session.execute(stmt, {'match': match, 'limit': limit}).all()
+
+    if backend == 'postgres':
+        tsquery = ' & '.join(f'{tok}:*' for tok in tokens)
+        vector = _PG_STUDENT_SEARCH_VECTOR.replace('coalesce(', 'coalesce(s.')
+        stmt = text(
+            f"SELECT {fields_sql}, ts_rank({vector}, q) AS rank "
+            "FROM students s, to_tsquery('simple'::regconfig, :tsquery) q "
+            f"WHERE {vector} @@ q ORDER BY rank DESC, s.id LIMIT :limit"
+        )
+        return db.session.execute(stmt, {'tsquery': tsquery, 'limit': limit}).all()
+
+    # Sin índice disponible: prefijo con LIKE (sin insensibilidad a acentos)
+    conditions = []
+    params = {'limit': limit}
+    for i, tok in enumerate(tokens):
+        params[f't{i}'] = f'{tok}%'
+        params[f'w{i}'] = f'% {tok}%'
+        per_column = []
+        for col in STUDENT_SEARCH_COLUMNS:
+            per_column.append(f"lower(s.{col}) LIKE :t{i}")
+            per_column.append(f"lower(s.{col}) LIKE :w{i}")
+        conditions.append('(' + ' OR '.join(per_column) + ')')
+    stmt = text(
+        f"SELECT {fields_sql}, 0 AS rank FROM students s WHERE {' AND '.join(conditions)} "
+        "ORDER BY s.last_name, s.first_name, s.id LIMIT :limit"
+    )
+    return db.session.execute(stmt, params).all()
+
+
+@app.route('/api/students/search', methods=['GET'])
+def api_students_search():
+    """Busca alumnos por prefijo en nombre, DNI, cinturón y datos de los padres.
+
+    GET /api/students/search?q=texto&limit=20 devuelve los resultados ordenados por relevancia.
+    """
+    tokens = _search_tokens(request.args.get('q'))
+    if not tokens:
+        return jsonify([])
+
+    limit = STUDENT_SEARCH_LIMIT_DEFAULT
+    limit_raw = request.args.get('limit')
+    if limit_raw:
+        try:
+            limit = int(limit_raw)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit inválido'}), 400
+    limit = max(1, min(limit, STUDENT_SEARCH_LIMIT_MAX))
+
+    rows = _search_students(tokens, limit)
+    return jsonify(_serialize_rows(STUDENT_SEARCH_SERIALIZER, rows))
+
+
 @app.route('/api/students/<int:student_id>', methods=['GET', 'PUT', 'DELETE'])
 def api_student_detail(student_id: int):
+    if request.method == 'GET':
+        row = db.session.execute(
+            _serializer_select(STUDENT_SERIALIZER).where(Student.id == student_id)
+        ).first()
+        if not row:
+            return jsonify({'error': 'Alumno no encontrado'}), 404
+        return jsonify(_serialize_row(STUDENT_SERIALIZER, row))
+
     student = Student.query.get(student_id)
     if not student:
         return jsonify({'error': 'Alumno no encontrado'}), 404
 
-    if request.method == 'GET':
-        return jsonify({
-            'id': student.id,
-            'full_name': student.full_name,
-            'last_name': student.last_name,
-            'first_name': student.first_name,
-            'dni': student.dni,
-            'gender': student.gender,
-            'birthdate': student.birthdate.isoformat() if student.birthdate else None,
-            'blood': student.blood,
-            'nationality': student.nationality,
-            'province': student.province,
-            'country': student.country,
-            'city': student.city,
-            'address': student.address,
-            'zip': student.zip,
-            'school': student.school,
-            'belt': student.belt,
-            'father_name': student.father_name,
-            'mother_name': student.mother_name,
-            'father_birthdate': student.father_birthdate.isoformat() if student.father_birthdate else None,
-            'mother_birthdate': student.mother_birthdate.isoformat() if student.mother_birthdate else None,
-            'father_phone': student.father_phone,
-            'mother_phone': student.mother_phone,
-            'parent_email': student.parent_email,
-            'notes': student.notes,
-            'status': student.status,
-            'tutor_type': student.tutor_type,
-        })
-
     if request.method == 'PUT':
         data = request.json or {}
         for field in [
@@ -372,11 +1538,10 @@ def api_student_detail(student_id: int):
     if request.method == 'DELETE':
         # Borramos primero todas las cuotas asociadas a este alumno
         try:
-            _ensure_fees_tables()
-        except Exception:
-            pass
-
-        try:
+            for model, table_name in ((FeePayment, 'fee_payments'), (FeeCharge, 'fee_charges')):
+                _record_tombstones(table_name, db.session.execute(
+                    select(model.id, model.student_id).where(model.student_id == student.id)
+                ).all())
             FeeAllocation.query.filter(
                 FeeAllocation.payment_id.in_(
                     db.session.query(FeePayment.id).filter_by(student_id=student.id)
@@ -385,11 +1550,13 @@ def api_student_detail(student_id: int):
             FeePayment.query.filter_by(student_id=student.id).delete()
             FeeCharge.query.filter_by(student_id=student.id).delete()
             StudentFeeSettings.query.filter_by(student_id=student.id).delete()
+            StudentFeeBalance.query.filter_by(student_id=student.id).delete()
         except Exception:
             # Si las tablas no existen aún o hay algún problema, seguimos con el borrado del alumno.
             db.session.rollback()
 
         # Luego borramos el alumno en sí
+        _record_tombstones('students', [(student.id, None)])
         db.session.delete(student)
         db.session.commit()
 
@@ -397,28 +1564,104 @@ def api_student_detail(student_id: int):
 
 
 # --- Calendar & Exams ---
+
+def _parse_event_date(raw):
+    """Fecha de evento: AAAA-MM-DD (también acepta DD/MM/AAAA de datos viejos)."""
+    if isinstance(raw, date):
+        return raw
+    value = str(raw or '').strip()
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_event_time(raw):
+    """Hora de evento HH:MM (o HH:MM:SS); None si viene vacía o no se puede leer."""
+    if raw is None or hasattr(raw, 'hour'):
+        return raw
+    value = str(raw).strip()
+    for fmt in ('%H:%M', '%H:%M:%S', '%H:%M:%S.%f'):
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    return None
+
+
+def _format_event_date(value):
+    return value.isoformat() if value else None
+
+
+def _format_event_time(value):
+    # Sin hora se responde '' como cuando la columna era texto (contrato de la API)
+    return value.strftime('%H:%M') if value is not None else ''
+
+
+EVENT_SERIALIZER = _row_serializer(
+    Event, ['id', 'date', 'time', 'title', 'type', 'level', 'place', 'notes'],
+    {'date': _format_event_date, 'time': _format_event_time},
+)
+
+
+def _events_ordered(stmt):
+    # Los eventos sin hora van primero en el día (como '' al ordenar el texto), igual en SQLite y Postgres
+    return stmt.order_by(
+        Event.date.asc(), case((Event.time.is_(None), 0), else_=1), Event.time.asc(), Event.id.asc(),
+    )
+
+
+def _select_events(stmt):
+    return _serialize_rows(EVENT_SERIALIZER, db.session.execute(_events_ordered(stmt)))
+
+
+def _list_events():
+    """GET /api/events con filtros opcionales from/to (AAAA-MM-DD) y type; con since, solo los cambios."""
+    query = _serializer_select(EVENT_SERIALIZER)
+    for arg, op in (('from', '__ge__'), ('to', '__le__')):
+        raw = request.args.get(arg)
+        if raw:
+            bound = _parse_event_date(raw)
+            if bound is None:
+                return jsonify({'error': f"Parámetro '{arg}' inválido (usar AAAA-MM-DD)"}), 400
+            query = query.where(getattr(Event.date, op)(bound))
+    event_type = (request.args.get('type') or '').strip()
+    if event_type:
+        query = query.where(Event.type == event_type)
+    if request.args.get('since') is None:
+        return jsonify(_select_events(query))
+
+    since, error = _parse_sync_since(request.args.get('since'))
+    if error:
+        return jsonify({'error': error}), 400
+    cursor = _new_sync_cursor()
+    if since is None:
+        return _sync_response(_select_events(query), [], since, cursor)
+    changed_ids = _sync_changed_ids(Event, since)
+    events = _select_events(query.where(_synced_after(Event.sync_seq, since)))
+    deleted = _sync_deleted_ids('events', since, changed_ids, [e['id'] for e in events])
+    return _sync_response(events, deleted, since, cursor)
+
+
 @app.route('/api/events', methods=['GET', 'POST'])
 def api_events():
     if request.method == 'GET':
-        events = Event.query.all()
-        result = []
-        for e in events:
-            result.append({
-                'id': e.id,
-                'date': e.date,
-                'time': e.time,
-                'title': e.title,
-                'type': e.type,
-                'level': e.level,
-                'place': e.place,
-                'notes': e.notes,
-            })
-        return jsonify(result)
+        return _versioned_get(('events',), _list_events)
 
     data = request.json or {}
+    event_date = _parse_event_date(data.get('date'))
+    if event_date is None:
+        return jsonify({'error': 'Fecha inválida (usar AAAA-MM-DD)'}), 400
+    event_time = None
+    if data.get('time'):
+        event_time = _parse_event_time(data.get('time'))
+        if event_time is None:
+            return jsonify({'error': 'Hora inválida (usar HH:MM)'}), 400
     event = Event(
-        date=data.get('date'),
-        time=data.get('time'),
+        date=event_date,
+        time=event_time,
         title=data.get('title'),
         type=data.get('type') or 'general',
         level=data.get('level'),
@@ -432,32 +1675,75 @@ def api_events():
 
 @app.route('/api/events/<int:event_id>', methods=['GET', 'DELETE'])
 def api_event_detail(event_id: int):
+    if request.method == 'GET':
+        row = db.session.execute(_serializer_select(EVENT_SERIALIZER).where(Event.id == event_id)).first()
+        if not row:
+            return jsonify({'error': 'Evento no encontrado'}), 404
+        return jsonify(_serialize_row(EVENT_SERIALIZER, row))
+
     event = Event.query.get(event_id)
     if not event:
         return jsonify({'error': 'Evento no encontrado'}), 404
 
-    if request.method == 'GET':
-        return jsonify({
-            'id': event.id,
-            'date': event.date,
-            'time': event.time,
-            'title': event.title,
-            'type': event.type,
-            'level': event.level,
-            'place': event.place,
-            'notes': event.notes,
-        })
-
     # DELETE
     # Borrar primero todas las inscripciones vinculadas a este evento (examen)
     ExamInscription.query.filter_by(event_id=event.id).delete()
 
     # Luego borrar el evento en sí
+    _record_tombstones('events', [(event.id, None)])
     db.session.delete(event)
     db.session.commit()
     return '', 204
 
 
+@app.route('/api/calendar/<month>', methods=['GET'])
+def api_calendar_month(month: str):
+    """Eventos de un mes (AAAA-MM) agrupados por día: {'month': ..., 'days': {'AAAA-MM-DD': [...]}}."""
+    return _versioned_get(('events',), lambda: _calendar_month(month))
+
+
+def _calendar_events_stmt(first_day, next_month):
+    return _serializer_select(EVENT_SERIALIZER).where(Event.date >= first_day, Event.date < next_month)
+
+
+def _calendar_month(month: str):
+    period = _parse_period(month)
+    if not period:
+        return jsonify({'error': 'Mes inválido (usar AAAA-MM)'}), 400
+    first_day = date(period['year'], period['month'], 1)
+    next_month = date(period['year'] + period['month'] // 12, period['month'] % 12 + 1, 1)
+
+    events = _select_events(_calendar_events_stmt(first_day, next_month))
+    days = {}
+    for e in events:
+        days.setdefault(e['date'], []).append(e)
+    return jsonify({'month': period['period'], 'days': days})
+
+
+# Tablas que determinan la respuesta de GET /api/exams/<id>/students (ver _versioned_get)
+EXAM_STUDENTS_TABLES = ('events', 'exam_inscriptions', 'students')
+
+
+def _exam_inscription_ids_stmt(event_id: int):
+    return select(ExamInscription.student_id).where(ExamInscription.event_id == event_id)
+
+
+def _list_exam_students(event_id: int):
+    event_type = db.session.execute(select(Event.type).where(Event.id == event_id)).scalar()
+    if event_type != 'exam':
+        return jsonify({'error': 'Examen no encontrado'}), 404
+
+    student_ids = db.session.execute(_exam_inscription_ids_stmt(event_id)).scalars().all()
+
+    if not student_ids:
+        return jsonify([])
+
+    rows = db.session.execute(
+        _serializer_select(STUDENT_BRIEF_SERIALIZER).where(Student.id.in_(student_ids))
+    )
+    return jsonify(_serialize_rows(STUDENT_BRIEF_SERIALIZER, rows))
+
+
 @app.route('/api/exams/<int:event_id>/students', methods=['GET', 'PUT'])
 def api_exam_students(event_id: int):
     """Gestiona la lista de alumnos inscriptos a un examen.
@@ -466,29 +1752,13 @@ def api_exam_students(event_id: int):
     PUT: reemplaza la lista de inscriptos con los IDs enviados en JSON: { "student_ids": [1,2,3] }.
     """
 
+    if request.method == 'GET':
+        return _versioned_get(EXAM_STUDENTS_TABLES, lambda: _list_exam_students(event_id))
+
     event = Event.query.get(event_id)
     if not event or event.type != 'exam':
         return jsonify({'error': 'Examen no encontrado'}), 404
 
-    if request.method == 'GET':
-        inscriptions = ExamInscription.query.filter_by(event_id=event_id).all()
-        student_ids = [ins.student_id for ins in inscriptions]
-
-        if not student_ids:
-            return jsonify([])
-
-        students = Student.query.filter(Student.id.in_(student_ids)).all()
-        result = []
-        for s in students:
-            result.append({
-                'id': s.id,
-                'full_name': s.full_name,
-                'last_name': s.last_name,
-                'first_name': s.first_name,
-                'belt': s.belt,
-            })
-        return jsonify(result)
-
     # PUT
     data = request.json or {}
     ids = data.get('student_ids') or []
@@ -519,35 +1789,71 @@ def api_exam_students(event_id: int):
 
 # --- Fees ---
 
-def _ensure_fees_tables():
-    try:
-        db.create_all()
-    except Exception:
-        pass
+# Copia inmutable de fee_config; los cálculos de cuotas solo leen estos campos
+FeeConfigSnapshot = namedtuple(
+    'FeeConfigSnapshot',
+    ['version', 'monthly_amount', 'due_day', 'proration_mode', 'proration_percent_default'],
+)
+
+_DEFAULT_FEE_CONFIG = FeeConfigSnapshot(0, Decimal('0'), 1, 'percent', Decimal('100'))
+
+_fee_config_cache = {'snapshot': None}
+_fee_config_lock = threading.Lock()
 
 
 def _get_fee_config():
-    _ensure_fees_tables()
-    cfg = FeeConfig.query.order_by(FeeConfig.id.asc()).first()
-    if not cfg:
-        cfg = FeeConfig(monthly_amount=0, due_day=1, proration_mode='percent', proration_percent_default=100)
-        db.session.add(cfg)
-        db.session.commit()
-    if int(cfg.due_day or 1) != 1 or (cfg.proration_mode or 'percent') != 'percent' or float(cfg.proration_percent_default or 100) != 100:
-        cfg.due_day = 1
-        cfg.proration_mode = 'percent'
-        cfg.proration_percent_default = 100
-        db.session.commit()
-    return cfg
+    """Configuración de cuotas vigente, sin escribir en la base.
+
+    Cada llamada solo lee fee_config.version; la fila completa se recarga cuando
+    cambió (por un PUT en este u otro proceso).
+    """
+    version = db.session.execute(
+        select(FeeConfig.version).order_by(FeeConfig.id.asc()).limit(1)
+    ).scalar()
+    if version is None:
+        return _DEFAULT_FEE_CONFIG
+    cached = _fee_config_cache['snapshot']
+    if cached is not None and cached.version == version:
+        return cached
+    row = db.session.execute(
+        select(
+            FeeConfig.version, FeeConfig.monthly_amount, FeeConfig.due_day,
+            FeeConfig.proration_mode, FeeConfig.proration_percent_default,
+        ).order_by(FeeConfig.id.asc()).limit(1)
+    ).one()
+    snapshot = FeeConfigSnapshot(
+        version=row.version,
+        monthly_amount=Decimal(str(row.monthly_amount or 0)),
+        due_day=int(row.due_day or 1),
+        proration_mode=row.proration_mode or 'percent',
+        proration_percent_default=Decimal(str(row.proration_percent_default or 100)),
+    )
+    with _fee_config_lock:
+        current = _fee_config_cache['snapshot']
+        if current is None or current.version <= snapshot.version:
+            _fee_config_cache['snapshot'] = snapshot
+    return snapshot
+
+
+def _invalidate_fee_config():
+    with _fee_config_lock:
+        _fee_config_cache['snapshot'] = None
 
 
 def _get_student_fee_settings(student_id: int):
-    _ensure_fees_tables()
+    """Configuración de cuota del alumno para lectura; sin fila devuelve los valores por defecto."""
+    return _get_fee_settings_map([student_id])[student_id]
+
+
+def _get_student_fee_settings_for_update(student_id: int):
+    """Configuración persistente del alumno; crea la fila (sin commit) si todavía no existe.
+
+    Requiere haber tomado _lock_student_fees para que dos cambios simultáneos no inserten la misma fila.
+    """
     settings = StudentFeeSettings.query.filter_by(student_id=student_id).first()
     if not settings:
         settings = StudentFeeSettings(student_id=student_id, discount_type=None, discount_value=0)
         db.session.add(settings)
-        db.session.commit()
     return settings
 
 
@@ -599,45 +1905,103 @@ def _list_periods_from_range(start_raw, end_raw):
     return periods
 
 
-def _create_fee_charge(student_id: int, cfg: FeeConfig, settings: StudentFeeSettings, period_info, body):
-    existing = FeeCharge.query.filter_by(student_id=student_id, period=period_info['period']).first()
+# Filas por sentencia INSERT multi-fila: como máximo FEE_CHARGES_UPSERT_CHUNK y sin pasar el límite de
+# parámetros del motor (999 en SQLite anterior a 3.32, 65535 en el protocolo de Postgres)
+FEE_CHARGES_UPSERT_CHUNK = 500
+UPSERT_MAX_BOUND_PARAMS = {'sqlite': 999, 'postgresql': 65535}
+
+
+def _get_fee_settings_map(student_ids):
+    """Devuelve {student_id: StudentFeeSettings} en una sola consulta.
+
+    Los alumnos sin fila reciben una instancia transitoria sin descuento (no se inserta nada).
+    """
+    settings_map = {}
+    if student_ids:
+        rows = StudentFeeSettings.query.filter(StudentFeeSettings.student_id.in_(student_ids)).all()
+        settings_map = {s.student_id: s for s in rows}
+    for sid in student_ids:
+        if sid not in settings_map:
+            settings_map[sid] = StudentFeeSettings(student_id=sid, discount_type=None, discount_value=0)
+    return settings_map
+
+
+def _generate_fee_charges(student_ids, cfg: FeeConfigSnapshot, periods):
+    """Genera (o actualiza) las cuotas de varios alumnos y períodos con un upsert multi-fila.
+
+    Todas las cuotas se calculan en memoria; la escritura usa la restricción única
+    (student_id, period). Devuelve {'created': n, 'updated': m}. No hace commit.
+    """
     base_amount = float(cfg.monthly_amount or 0)
-    if base_amount <= 0:
-        return False
-    discount_amount = _compute_discount_amount(base_amount, settings)
+    if base_amount <= 0 or not student_ids or not periods:
+        return {'created': 0, 'updated': 0}
 
-    net = base_amount - discount_amount
-    if net < 0:
-        net = 0
-    final_amount = round(net, 2)
+    settings_map = _get_fee_settings_map(student_ids)
+    period_values = [p['period'] for p in periods]
 
-    year = period_info['year']
-    month = period_info['month']
-    due_date = date(year, month, 1)
-
-    if existing:
-        existing.due_date = due_date
-        existing.base_amount = round(base_amount, 2)
-        existing.discount_amount = round(discount_amount, 2)
-        existing.proration_mode = 'percent'
-        existing.proration_percent = 100
-        existing.proration_start_date = None
-        existing.final_amount = final_amount
-        return True
-
-    charge = FeeCharge(
-        student_id=student_id,
-        period=period_info['period'],
-        due_date=due_date,
-        base_amount=round(base_amount, 2),
-        discount_amount=round(discount_amount, 2),
-        proration_mode='percent',
-        proration_percent=100,
-        proration_start_date=None,
-        final_amount=final_amount,
+    existing = set(
+        db.session.query(FeeCharge.student_id, FeeCharge.period)
+        .filter(FeeCharge.student_id.in_(student_ids), FeeCharge.period.in_(period_values))
+        .all()
     )
-    db.session.add(charge)
-    return True
+
+    now = datetime.utcnow()
+    rows = []
+    for sid in student_ids:
+        discount_amount = _compute_discount_amount(base_amount, settings_map[sid])
+        final_amount = round(max(base_amount - discount_amount, 0), 2)
+        for period_info in periods:
+            rows.append({
+                'student_id': sid,
+                'period': period_info['period'],
+                'due_date': date(period_info['year'], period_info['month'], 1),
+                'base_amount': round(base_amount, 2),
+                'discount_amount': round(discount_amount, 2),
+                'proration_mode': 'percent',
+                'proration_percent': 100,
+                'proration_start_date': None,
+                'final_amount': final_amount,
+                'created_at': now,
+                'updated_at': now,
+            })
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        insert_fn = pg_dialect.insert
+    elif dialect == 'sqlite':
+        insert_fn = sqlite_dialect.insert
+    else:
+        insert_fn = None
+
+    table = FeeCharge.__table__
+    if insert_fn is not None:
+        update_cols = ['due_date', 'base_amount', 'discount_amount', 'proration_mode',
+                       'proration_percent', 'proration_start_date', 'final_amount', 'updated_at']
+        # Cada fila liga hasta un parámetro por columna de la tabla (las que no vienen usan el default del modelo)
+        chunk_size = max(1, min(FEE_CHARGES_UPSERT_CHUNK, UPSERT_MAX_BOUND_PARAMS[dialect] // len(table.columns)))
+        for i in range(0, len(rows), chunk_size):
+            stmt = insert_fn(table).values(rows[i:i + chunk_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['student_id', 'period'],
+                # ON CONFLICT no aplica onupdate: sync_seq se vacía a mano para que el commit la numere
+                set_={**{col: stmt.excluded[col] for col in update_cols}, 'sync_seq': null()},
+            )
+            db.session.execute(stmt)
+    else:
+        # Motores sin upsert: actualizar existentes e insertar el resto
+        for row in rows:
+            if (row['student_id'], row['period']) in existing:
+                values = {k: v for k, v in row.items() if k not in ('student_id', 'period', 'created_at')}
+                db.session.execute(
+                    table.update()
+                    .where(table.c.student_id == row['student_id'], table.c.period == row['period'])
+                    .values(**values)
+                )
+            else:
+                db.session.execute(table.insert().values(**row))
+
+    updated = sum(1 for row in rows if (row['student_id'], row['period']) in existing)
+    return {'created': len(rows) - updated, 'updated': updated}
 
 
 def _days_in_month(year: int, month: int):
@@ -671,7 +2035,7 @@ def _compute_discount_amount(base_amount: float, settings: StudentFeeSettings):
     return round(discount, 2)
 
 
-def _refresh_student_fee_charges(student_id: int, cfg: FeeConfig, settings: StudentFeeSettings):
+def _refresh_student_fee_charges(student_id: int, cfg: FeeConfigSnapshot, settings: StudentFeeSettings):
     charges = FeeCharge.query.filter_by(student_id=student_id).all()
     base_amount = float(cfg.monthly_amount or 0)
     if base_amount <= 0:
@@ -693,7 +2057,7 @@ def _refresh_student_fee_charges(student_id: int, cfg: FeeConfig, settings: Stud
         charge.final_amount = final_amount
 
 
-def _compute_proration_percent(cfg: FeeConfig, period_info, proration_mode: str, start_date_raw: str, proration_percent_raw):
+def _compute_proration_percent(cfg: FeeConfigSnapshot, period_info, proration_mode: str, start_date_raw: str, proration_percent_raw):
     mode = (proration_mode or cfg.proration_mode or 'days').strip().lower()
     if mode not in ('days', 'percent'):
         mode = 'days'
@@ -749,152 +2113,503 @@ def _compute_proration_percent(cfg: FeeConfig, period_info, proration_mode: str,
     return {'mode': 'days', 'percent': round(pct, 2), 'start_date': start_date}
 
 
-def _get_charge_allocated_amounts(charge_ids):
-    if not charge_ids:
-        return {}
-    allocations = FeeAllocation.query.filter(FeeAllocation.charge_id.in_(charge_ids)).all()
-    out = {}
-    for a in allocations:
-        out[a.charge_id] = out.get(a.charge_id, 0.0) + float(a.amount)
-    return out
+# --- Motor de cuotas en centavos ---
+# Reescritura exacta del cálculo original en floats: todos los importes se llevan a centavos
+# enteros (Numeric(10, 2) se convierte sin pasar por float) y las sumas/restas son exactas, así
+# que el resultado no depende del orden de redondeo. Es un recorrido en Python cuota por cuota,
+# no un cálculo vectorizado. scripts/fee_engine_check.py lo compara contra el cálculo en floats.
 
+FEE_CHARGE_STATUSES = ('pending', 'partial', 'paid')
+_CENT = Decimal('0.01')
 
-def _build_charge_financials(charges, allocated_map, student_credit=0.0, today_value=None):
-    today_value = today_value or date.today()
-    remaining_credit = round(float(student_credit or 0), 2)
-    charge_meta = {}
 
-    ordered = sorted(
-        charges,
-        key=lambda c: (
-            c.due_date or date.max,
-            c.period or '',
-            c.id or 0,
-        )
-    )
+def _to_cents(value) -> int:
+    """Convierte un importe (Decimal, float, str o None) a centavos enteros, redondeando half-up."""
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        # str() da la representación decimal más corta del float (0.1 -> '0.1')
+        value = Decimal(str(value))
+    return int(value.quantize(_CENT, rounding=ROUND_HALF_UP).scaleb(2))
 
-    for c in ordered:
-        paid = round(float(allocated_map.get(c.id, 0.0)), 2)
-        total = round(float(c.final_amount or 0), 2)
-        raw_balance = round(total - paid, 2)
-        applied_credit = 0.0
-        if raw_balance > 0 and remaining_credit > 0:
-            applied_credit = min(raw_balance, remaining_credit)
-            remaining_credit = round(remaining_credit - applied_credit, 2)
-
-        effective_balance = round(raw_balance - applied_credit, 2)
-        outstanding_balance = effective_balance if effective_balance > 0 else 0.0
-        credit_amount = abs(effective_balance) if effective_balance < 0 else 0.0
-
-        if outstanding_balance <= 0 and total > 0:
-            status = 'paid'
-        elif paid > 0:
-            status = 'partial'
+
+def _from_cents(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2).quantize(_CENT)
+
+
+def _run_fee_engine(charges, paid_cents, credit_cents, today=None):
+    """Calcula en centavos, recorriendo una vez las cuotas ordenadas, la situación de cuotas y alumnos.
+
+    charges: filas con id, student_id, period, due_date y final_amount (de uno o varios alumnos).
+    paid_cents: {charge_id: centavos imputados}. credit_cents: {student_id: centavos de pagos sin imputar}.
+
+    El crédito de cada alumno se aplica a sus cuotas por vencimiento, período e id. Devuelve
+    {'rows', 'paid', 'applied_credit', 'balance', 'status', 'overdue', 'students'}: las
+    listas/arrays (array('q') solo como almacenamiento compacto) están alineadas con 'rows'
+    y 'students' tiene los totales por alumno en centavos.
+    """
+    today = today or date.today()
+    rows = sorted(charges, key=lambda c: (c.student_id, c.due_date or date.max, c.period or '', c.id or 0))
+    n = len(rows)
+    total = array('q', (_to_cents(c.final_amount) for c in rows))
+    paid = array('q', (paid_cents.get(c.id, 0) for c in rows))
+    applied = array('q', bytes(8 * n))
+    balance = array('q', bytes(8 * n))
+    status = array('b', bytes(n))  # índice en FEE_CHARGE_STATUSES
+    overdue = array('b', bytes(n))
+
+    students = {}
+    st = None
+    current_sid = None
+    for i in range(n):
+        row = rows[i]
+        if row.student_id != current_sid:
+            current_sid = row.student_id
+            st = students[current_sid] = _fee_engine_student(credit_cents.get(current_sid, 0))
+
+        raw = total[i] - paid[i]
+        remaining = st['remaining_credit']
+        credit_used = min(raw, remaining) if raw > 0 and remaining > 0 else 0
+        st['remaining_credit'] = remaining - credit_used
+        effective = raw - credit_used
+        outstanding = effective if effective > 0 else 0
+
+        if outstanding <= 0 and total[i] > 0:
+            status_idx = 2
+        elif paid[i] > 0:
+            status_idx = 1
         else:
-            status = 'pending'
-
-        is_overdue = (c.due_date is not None) and (today_value > c.due_date) and (status != 'paid')
-        charge_meta[c.id] = {
-            'paid': paid,
-            'total': total,
-            'applied_credit': round(applied_credit, 2),
-            'balance': round(effective_balance, 2),
-            'outstanding_balance': round(outstanding_balance, 2),
-            'credit_amount': round(credit_amount, 2),
-            'status': status,
-            'overdue': is_overdue,
-        }
+            status_idx = 0
+        is_overdue = row.due_date is not None and today > row.due_date and status_idx != 2
+
+        applied[i] = credit_used
+        balance[i] = effective
+        status[i] = status_idx
+        overdue[i] = is_overdue
+
+        st['charges_count'] += 1
+        if total[i] > 0:
+            st['positive_charges_count'] += 1
+        st['balance_total'] += effective
+        if effective < 0:
+            st['credit_total'] -= effective
+        if is_overdue:
+            st['overdue_total'] += outstanding
+        if status_idx == 1 and outstanding > 0:
+            st['has_partial'] = True
+
+    for sid, credit in credit_cents.items():
+        if sid not in students:
+            students[sid] = _fee_engine_student(credit)
+    for st in students.values():
+        # El crédito que sobró resta del saldo y suma al crédito a favor
+        st['balance_total'] -= st['remaining_credit']
+        st['credit_total'] += st['remaining_credit']
 
-    overdue_total = 0.0
-    credit_total = round(remaining_credit, 2)
-    has_partial = False
-    balance_total = 0.0
-    positive_charges_count = 0
-    for c in charges:
-        meta = charge_meta.get(c.id, {})
-        total = float(meta.get('total', 0.0))
-        if total > 0:
-            positive_charges_count += 1
-        balance_total += float(meta.get('balance', 0.0))
-        if meta.get('overdue') and float(meta.get('outstanding_balance', 0.0)) > 0:
-            overdue_total += float(meta.get('outstanding_balance', 0.0))
-        credit_total += float(meta.get('credit_amount', 0.0))
-        if meta.get('status') == 'partial' and float(meta.get('outstanding_balance', 0.0)) > 0:
-            has_partial = True
+    return {
+        'rows': rows,
+        'paid': paid,
+        'applied_credit': applied,
+        'balance': balance,
+        'status': [FEE_CHARGE_STATUSES[s] for s in status],
+        'overdue': overdue,
+        'students': students,
+    }
 
+
+def _fee_engine_student(credit: int):
     return {
-        'by_charge_id': charge_meta,
-        'overdue_total': round(overdue_total, 2),
-        'credit_total': round(credit_total, 2),
-        'has_partial': has_partial,
-        'balance_total': round(balance_total - remaining_credit, 2),
-        'positive_charges_count': positive_charges_count,
-        'remaining_credit': round(remaining_credit, 2),
+        'remaining_credit': credit,
+        'balance_total': 0,
+        'credit_total': 0,
+        'overdue_total': 0,
+        'has_partial': False,
+        'charges_count': 0,
+        'positive_charges_count': 0,
     }
 
 
+def _fee_status(financials, has_charges: bool):
+    return _fee_status_values(
+        has_charges, financials['positive_charges_count'], financials['overdue_total'],
+        financials['has_partial'], financials['balance_total'],
+    )
+
+
+def _fee_status_values(has_charges: bool, positive_charges_count, overdue_total, has_partial, balance_total):
+    if not has_charges or positive_charges_count == 0:
+        return 'sin_registro'
+    if overdue_total > 0:
+        return 'vencida'
+    if has_partial:
+        return 'parcial'
+    if balance_total > 0:
+        return 'pendiente'
+    return 'al_dia'
+
+
+# --- Ledger de saldos ---
+# Cada escritura sobre cuotas/pagos/imputaciones recalcula, dentro de la misma transacción,
+# los valores por cuota (paid_amount, applied_credit, balance) y la fila de student_fee_balances
+# de los alumnos afectados. Las lecturas solo leen esos valores; el vencimiento (que depende
+# de la fecha) se resuelve al leer con due_date < hoy.
+
+def _load_fee_engine_inputs(student_ids=None, executor=None):
+    """Lee cuotas, imputaciones y pagos de los alumnos indicados (None = todos), en centavos.
+
+    Devuelve (charges, paid_cents, credit_cents, last_payment_by_student).
+    """
+    executor = executor if executor is not None else db.session
+
+    charge_stmt = select(
+        FeeCharge.id, FeeCharge.student_id, FeeCharge.period, FeeCharge.due_date, FeeCharge.final_amount,
+        FeeCharge.paid_amount, FeeCharge.applied_credit, FeeCharge.balance,
+    )
+    alloc_by_charge_stmt = (
+        select(FeeAllocation.charge_id, func.sum(FeeAllocation.amount))
+        .join(FeeCharge, FeeCharge.id == FeeAllocation.charge_id)
+        .group_by(FeeAllocation.charge_id)
+    )
+    payment_stmt = select(FeePayment.id, FeePayment.student_id, FeePayment.amount, FeePayment.payment_date)
+    alloc_by_payment_stmt = (
+        select(FeeAllocation.payment_id, func.sum(FeeAllocation.amount))
+        .join(FeePayment, FeePayment.id == FeeAllocation.payment_id)
+        .group_by(FeeAllocation.payment_id)
+    )
+    if student_ids is not None:
+        student_ids = list(student_ids)
+        if not student_ids:
+            return [], {}, {}, {}
+        charge_stmt = charge_stmt.where(FeeCharge.student_id.in_(student_ids))
+        alloc_by_charge_stmt = alloc_by_charge_stmt.where(FeeCharge.student_id.in_(student_ids))
+        payment_stmt = payment_stmt.where(FeePayment.student_id.in_(student_ids))
+        alloc_by_payment_stmt = alloc_by_payment_stmt.where(FeePayment.student_id.in_(student_ids))
+
+    charges = executor.execute(charge_stmt).all()
+    paid_cents = {cid: _to_cents(total) for cid, total in executor.execute(alloc_by_charge_stmt).all()}
+    allocated_by_payment = {pid: _to_cents(total) for pid, total in executor.execute(alloc_by_payment_stmt).all()}
+
+    credit_cents = {}
+    last_payment_by_student = {}
+    for p in executor.execute(payment_stmt).all():
+        credit_cents[p.student_id] = (
+            credit_cents.get(p.student_id, 0) + _to_cents(p.amount) - allocated_by_payment.get(p.id, 0)
+        )
+        if p.payment_date and (last_payment_by_student.get(p.student_id) or '') < p.payment_date:
+            last_payment_by_student[p.student_id] = p.payment_date
+    return charges, paid_cents, credit_cents, last_payment_by_student
+
+
+def _compute_fee_ledger(student_ids=None, executor=None):
+    """Recalcula desde cero el ledger de los alumnos indicados (None = todos).
+
+    Devuelve el resultado de _run_fee_engine; 'rows' son las filas actuales de cuotas (con los
+    valores guardados) y cada alumno de 'students' trae además 'last_payment'.
+    """
+    charges, paid_cents, credit_cents, last_payment_by_student = _load_fee_engine_inputs(student_ids, executor)
+    ledger = _run_fee_engine(charges, paid_cents, credit_cents)
+    for sid, st in ledger['students'].items():
+        st['last_payment'] = last_payment_by_student.get(sid)
+    return ledger
+
+
+def _lock_student_fees(student_ids):
+    """Serializa las escrituras de cuotas/pagos de los alumnos hasta el fin de la transacción.
+
+    En Postgres toma el lock de las filas de los alumnos (SELECT ... FOR UPDATE, en orden de id);
+    en SQLite un UPDATE que no cambia nada toma el lock de escritura de la base, así que las
+    lecturas siguientes ya ven todo lo confirmado por otros pedidos.
+    """
+    student_ids = sorted(set(student_ids))
+    if not student_ids:
+        return
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(
+            select(Student.id).where(Student.id.in_(student_ids)).order_by(Student.id).with_for_update()
+        )
+    else:
+        balances = StudentFeeBalance.__table__
+        db.session.execute(
+            balances.update().where(balances.c.student_id == student_ids[0])
+            .values(updated_at=balances.c.updated_at, sync_seq=balances.c.sync_seq)
+        )
+
+
+def _load_open_charges(student_ids, charge_ids=None):
+    """Cuotas con saldo pendiente de los alumnos, en orden de imputación. Requiere _lock_student_fees.
+
+    Devuelve {student_id: [[charge_id, centavos_pendientes], ...]} por vencimiento e id. Las cuotas
+    quedan bloqueadas (FOR UPDATE en Postgres) y el saldo sale de una sola consulta agregada.
+    """
+    student_ids = list(student_ids)
+    if not student_ids:
+        return {}
+    allocated = (
+        select(FeeAllocation.charge_id, func.sum(FeeAllocation.amount).label('allocated'))
+        .join(FeeCharge, FeeCharge.id == FeeAllocation.charge_id)
+        .where(FeeCharge.student_id.in_(student_ids))
+        .group_by(FeeAllocation.charge_id)
+        .subquery()
+    )
+    candidates = select(FeeCharge.id).where(FeeCharge.student_id.in_(student_ids))
+    if charge_ids:
+        candidates = candidates.where(FeeCharge.id.in_(charge_ids))
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(candidates.order_by(FeeCharge.id).with_for_update())
+
+    rows = db.session.execute(
+        select(FeeCharge.id, FeeCharge.student_id, FeeCharge.final_amount, func.coalesce(allocated.c.allocated, 0))
+        .outerjoin(allocated, allocated.c.charge_id == FeeCharge.id)
+        .where(FeeCharge.id.in_(candidates))
+        .order_by(FeeCharge.student_id.asc(), FeeCharge.due_date.asc(), FeeCharge.id.asc())
+    ).all()
+
+    open_by_student = {}
+    for charge_id, student_id, final_amount, already in rows:
+        open_cents = _to_cents(final_amount) - _to_cents(already)
+        if open_cents > 0:
+            open_by_student.setdefault(student_id, []).append([charge_id, open_cents])
+    return open_by_student
+
+
+def _fifo_allocate(open_charges, amount_cents: int):
+    """Reparte amount_cents sobre open_charges (en orden) y descuenta lo imputado de cada una.
+
+    Devuelve ([(charge_id, centavos)], centavos_sin_imputar).
+    """
+    allocations = []
+    remaining = amount_cents
+    for entry in open_charges:
+        if remaining <= 0:
+            break
+        if entry[1] <= 0:
+            continue
+        applied = min(entry[1], remaining)
+        entry[1] -= applied
+        remaining -= applied
+        allocations.append((entry[0], applied))
+    return allocations, remaining
+
+
+def _allocate_payment(payment_id: int, student_id: int, amount_cents: int, charge_ids=None):
+    """Imputa un pago a las cuotas abiertas del alumno y devuelve los centavos sin imputar (crédito)."""
+    open_charges = _load_open_charges([student_id], charge_ids).get(student_id, [])
+    allocations, remaining = _fifo_allocate(open_charges, amount_cents)
+    if allocations:
+        db.session.execute(FeeAllocation.__table__.insert(), [
+            {'payment_id': payment_id, 'charge_id': charge_id, 'amount': _from_cents(cents)}
+            for charge_id, cents in allocations
+        ])
+    return remaining
+
+
+def _refresh_fee_balances(student_ids, executor=None):
+    """Actualiza el ledger de los alumnos indicados (None = reconstrucción completa). No hace commit."""
+    executor = executor if executor is not None else db.session
+    if executor is db.session:
+        db.session.flush()
+    if student_ids is not None:
+        student_ids = list(student_ids)
+        if not student_ids:
+            return
+    ledger = _compute_fee_ledger(student_ids, executor=executor)
+
+    charge_updates = []
+    for c, values in zip(ledger['rows'], zip(ledger['paid'], ledger['applied_credit'], ledger['balance'])):
+        current = (_to_cents(c.paid_amount), _to_cents(c.applied_credit), _to_cents(c.balance))
+        if values != current:
+            charge_updates.append({
+                '_id': c.id,
+                '_paid': _from_cents(values[0]),
+                '_credit': _from_cents(values[1]),
+                '_balance': _from_cents(values[2]),
+            })
+
+    charges_table = FeeCharge.__table__
+    if charge_updates:
+        executor.execute(
+            charges_table.update()
+            .where(charges_table.c.id == db.bindparam('_id'))
+            .values(paid_amount=db.bindparam('_paid'), applied_credit=db.bindparam('_credit'), balance=db.bindparam('_balance')),
+            charge_updates,
+        )
+
+    balances_table = StudentFeeBalance.__table__
+    if student_ids is None:
+        executor.execute(balances_table.delete())
+    else:
+        executor.execute(balances_table.delete().where(balances_table.c.student_id.in_(student_ids)))
+    now = datetime.utcnow()
+    rows = []
+    for sid, st in ledger['students'].items():
+        rows.append({
+            'student_id': sid,
+            'balance_total': _from_cents(st['balance_total']),
+            'credit_total': _from_cents(st['credit_total']),
+            'has_partial': st['has_partial'],
+            'charges_count': st['charges_count'],
+            'positive_charges_count': st['positive_charges_count'],
+            'last_payment': st['last_payment'],
+            'updated_at': now,
+        })
+    if rows:
+        executor.execute(balances_table.insert(), rows)
+
+
+def _verify_fee_balances():
+    """Compara el ledger guardado contra un recálculo completo y devuelve la lista de diferencias."""
+    ledger = _compute_fee_ledger(None)
+    problems = []
+    for c, expected in zip(ledger['rows'], zip(ledger['paid'], ledger['applied_credit'], ledger['balance'])):
+        stored = (_to_cents(c.paid_amount), _to_cents(c.applied_credit), _to_cents(c.balance))
+        if expected != stored:
+            problems.append(
+                f'cuota {c.id} (alumno {c.student_id}): guardado {tuple(map(_from_cents, stored))}, '
+                f'esperado {tuple(map(_from_cents, expected))}'
+            )
+
+    stored_rows = {row.student_id: row for row in StudentFeeBalance.query.all()}
+    for sid, st in ledger['students'].items():
+        expected = (
+            _from_cents(st['balance_total']), _from_cents(st['credit_total']), st['has_partial'],
+            st['charges_count'], st['positive_charges_count'], st['last_payment'],
+        )
+        row = stored_rows.pop(sid, None)
+        if row is None:
+            problems.append(f'alumno {sid}: falta la fila de saldo, esperado {expected}')
+            continue
+        stored = (
+            _from_cents(_to_cents(row.balance_total)), _from_cents(_to_cents(row.credit_total)), bool(row.has_partial),
+            row.charges_count, row.positive_charges_count, row.last_payment,
+        )
+        if expected != stored:
+            problems.append(f'alumno {sid}: guardado {stored}, esperado {expected}')
+    for sid in stored_rows:
+        problems.append(f'alumno {sid}: fila de saldo sin cuotas ni pagos')
+    return problems
+
+
+@app.cli.command('fees-rebuild-ledger')
+def cli_fees_rebuild_ledger():
+    """Reconstruye desde cero el ledger de saldos de cuotas."""
+    _refresh_fee_balances(None)
+    db.session.commit()
+    print('Ledger de saldos reconstruido.')
+
+
+@app.cli.command('fees-verify-ledger')
+def cli_fees_verify_ledger():
+    """Verifica que el ledger de saldos coincida con el historial de cuotas y pagos."""
+    problems = _verify_fee_balances()
+    for line in problems:
+        print(line)
+    if problems:
+        print(f'{len(problems)} diferencias encontradas. Ejecutá `flask fees-rebuild-ledger`.')
+        raise SystemExit(1)
+    print('Ledger de saldos consistente.')
+
+
+FEE_CHARGE_SERIALIZER = _row_serializer(
+    FeeCharge,
+    ['id', 'period', 'due_date', 'base_amount', 'discount_amount', 'proration_mode', 'proration_percent',
+     'proration_start_date', 'final_amount', 'paid_amount', 'applied_credit', 'balance'],
+    {
+        'due_date': _iso_or_none,
+        'base_amount': _float_or_zero,
+        'discount_amount': _float_or_zero,
+        'proration_percent': _float_or_zero,
+        'proration_start_date': _iso_or_none,
+        'final_amount': _round_money,
+        'paid_amount': _round_money,
+        'applied_credit': _round_money,
+        'balance': _round_money,
+    },
+)
+FEE_PAYMENT_SERIALIZER = _row_serializer(
+    FeePayment, ['id', 'payment_date', 'amount', 'method', 'reference', 'notes'], {'amount': _float_or_zero},
+)
+FEE_ALLOCATION_SERIALIZER = _row_serializer(
+    FeeAllocation, ['id', 'charge_id', 'amount'], {'amount': _float_or_zero},
+)
+# Alumno embebido en GET /api/fees/student/<id>
+STUDENT_FEES_SERIALIZER = _row_serializer(Student, ['id', 'full_name', 'last_name', 'first_name', 'status', 'belt'])
+
+
+# Consultas de _serialize_student_fees (db-explain-check verifica sus planes)
+
+def _student_charges_stmt(student_id: int):
+    return (
+        _serializer_select(FEE_CHARGE_SERIALIZER)
+        .where(FeeCharge.student_id == student_id)
+        .order_by(FeeCharge.period.desc())
+    )
+
+
+def _student_payments_stmt(student_id: int):
+    return (
+        _serializer_select(FEE_PAYMENT_SERIALIZER)
+        .where(FeePayment.student_id == student_id)
+        .order_by(FeePayment.payment_date.desc(), FeePayment.id.desc())
+    )
+
+
+def _payment_allocations_stmt(payment_ids):
+    return (
+        _serializer_select(FEE_ALLOCATION_SERIALIZER, FeeAllocation.payment_id)
+        .where(FeeAllocation.payment_id.in_(payment_ids))
+    )
+
+
 def _serialize_student_fees(student_id: int):
-    _ensure_fees_tables()
     cfg = _get_fee_config()
     settings = _get_student_fee_settings(student_id)
     today = date.today()
 
-    charges = FeeCharge.query.filter_by(student_id=student_id).order_by(FeeCharge.period.desc()).all()
-    payments = FeePayment.query.filter_by(student_id=student_id).order_by(FeePayment.payment_date.desc(), FeePayment.id.desc()).all()
-    charge_ids = [c.id for c in charges]
-    allocated_map = _get_charge_allocated_amounts(charge_ids)
+    charges = db.session.execute(_student_charges_stmt(student_id)).all()
+    payments = db.session.execute(_student_payments_stmt(student_id)).all()
     payment_ids = [p.id for p in payments]
-    allocations = []
-    if payment_ids:
-        allocations = FeeAllocation.query.filter(FeeAllocation.payment_id.in_(payment_ids)).all()
-    allocated_by_payment = {}
     alloc_by_payment = {}
-    for a in allocations:
-        allocated_by_payment[a.payment_id] = allocated_by_payment.get(a.payment_id, 0.0) + float(a.amount)
-        alloc_by_payment.setdefault(a.payment_id, []).append({
-            'id': a.id,
-            'charge_id': a.charge_id,
-            'amount': float(a.amount),
-        })
-    student_credit = 0.0
-    for p in payments:
-        student_credit += round(float(p.amount or 0) - float(allocated_by_payment.get(p.id, 0.0)), 2)
-    financials = _build_charge_financials(charges, allocated_map, student_credit=student_credit, today_value=today)
+    if payment_ids:
+        allocations = db.session.execute(_payment_allocations_stmt(payment_ids))
+        for a in allocations:
+            alloc_by_payment.setdefault(a.payment_id, []).append(_serialize_row(FEE_ALLOCATION_SERIALIZER, a))
+    ledger = db.session.execute(
+        select(
+            StudentFeeBalance.balance_total, StudentFeeBalance.credit_total,
+            StudentFeeBalance.has_partial, StudentFeeBalance.positive_charges_count,
+        ).where(StudentFeeBalance.student_id == student_id)
+    ).first()
 
     charges_out = []
+    overdue_total = 0.0
     for c in charges:
-        meta = financials['by_charge_id'].get(c.id, {})
-
-        charges_out.append({
-            'id': c.id,
-            'period': c.period,
-            'due_date': c.due_date.isoformat() if c.due_date else None,
-            'base_amount': float(c.base_amount or 0),
-            'discount_amount': float(c.discount_amount or 0),
-            'proration_mode': c.proration_mode,
-            'proration_percent': float(c.proration_percent or 0),
-            'proration_start_date': c.proration_start_date.isoformat() if c.proration_start_date else None,
-            'final_amount': float(meta.get('total', 0.0)),
-            'paid_amount': round(float(meta.get('paid', 0.0)), 2),
-            'applied_credit': round(float(meta.get('applied_credit', 0.0)), 2),
-            'balance': round(float(meta.get('balance', 0.0)), 2),
-            'outstanding_balance': round(float(meta.get('outstanding_balance', 0.0)), 2),
-            'credit_amount': round(float(meta.get('credit_amount', 0.0)), 2),
-            'status': meta.get('status', 'pending'),
-            'overdue': bool(meta.get('overdue')),
-        })
+        # El estado se calcula con los valores crudos; el serializador solo redondea la salida
+        item = _serialize_row(FEE_CHARGE_SERIALIZER, c)
+        paid = float(c.paid_amount or 0)
+        balance = float(c.balance or 0)
+        outstanding_balance = balance if balance > 0 else 0.0
+        credit_amount = abs(balance) if balance < 0 else 0.0
+        if outstanding_balance <= 0 and item['final_amount'] > 0:
+            charge_status = 'paid'
+        elif paid > 0:
+            charge_status = 'partial'
+        else:
+            charge_status = 'pending'
+        is_overdue = (c.due_date is not None) and (today > c.due_date) and (charge_status != 'paid')
+        if is_overdue and outstanding_balance > 0:
+            overdue_total += outstanding_balance
+
+        item['outstanding_balance'] = round(outstanding_balance, 2)
+        item['credit_amount'] = round(credit_amount, 2)
+        item['status'] = charge_status
+        item['overdue'] = bool(is_overdue)
+        charges_out.append(item)
 
     payments_out = []
     for p in payments:
-        payments_out.append({
-            'id': p.id,
-            'payment_date': p.payment_date,
-            'amount': float(p.amount),
-            'method': getattr(p, 'method', None),
-            'reference': getattr(p, 'reference', None),
-            'notes': getattr(p, 'notes', None),
-            'allocations': alloc_by_payment.get(p.id, []),
-        })
+        item = _serialize_row(FEE_PAYMENT_SERIALIZER, p)
+        item['allocations'] = alloc_by_payment.get(p.id, [])
+        payments_out.append(item)
 
     history_out = [
         {
@@ -910,16 +2625,14 @@ def _serialize_student_fees(student_id: int):
 
     last_payment = payments[0].payment_date if payments else None
 
-    if not charges_out or financials['positive_charges_count'] == 0:
-        status = 'sin_registro'
-    elif financials['overdue_total'] > 0:
-        status = 'vencida'
-    elif financials['has_partial']:
-        status = 'parcial'
-    elif financials['balance_total'] > 0:
-        status = 'pendiente'
-    else:
-        status = 'al_dia'
+    financials = {
+        'overdue_total': round(overdue_total, 2),
+        'balance_total': float(ledger.balance_total or 0) if ledger else 0.0,
+        'credit_total': float(ledger.credit_total or 0) if ledger else 0.0,
+        'has_partial': bool(ledger.has_partial) if ledger else False,
+        'positive_charges_count': ledger.positive_charges_count if ledger else 0,
+    }
+    status = _fee_status(financials, bool(charges_out))
 
     return {
         'student_id': student_id,
@@ -949,13 +2662,8 @@ def _serialize_student_fees(student_id: int):
 
 @app.route('/api/fees/config', methods=['GET', 'PUT'])
 def api_fees_config():
-    cfg = _get_fee_config()
-    if not cfg:
-        cfg = FeeConfig(monthly_amount=0, due_day=1, proration_mode='percent', proration_percent_default=100)
-        db.session.add(cfg)
-        db.session.commit()
-
     if request.method == 'GET':
+        cfg = _get_fee_config()
         return jsonify({
             'monthly_amount': float(cfg.monthly_amount or 0),
             'due_day': 1,
@@ -963,6 +2671,11 @@ def api_fees_config():
             'proration_percent_default': float(cfg.proration_percent_default or 100),
         })
 
+    cfg = FeeConfig.query.order_by(FeeConfig.id.asc()).with_for_update().first()
+    if not cfg:
+        cfg = FeeConfig(monthly_amount=0, due_day=1, proration_mode='percent', proration_percent_default=100)
+        db.session.add(cfg)
+
     data = request.json or {}
     if 'monthly_amount' in data:
         try:
@@ -973,25 +2686,22 @@ def api_fees_config():
     cfg.due_day = 1
     cfg.proration_mode = 'percent'
     cfg.proration_percent_default = 100
+    cfg.version = FeeConfig.version + 1 if cfg.id else 1
 
     db.session.commit()
+    _invalidate_fee_config()
     return jsonify({'status': 'ok'})
 
 
 @app.route('/api/fees/student/<int:student_id>', methods=['GET'])
 def api_fees_student(student_id: int):
-    student = Student.query.get(student_id)
+    student = db.session.execute(
+        _serializer_select(STUDENT_FEES_SERIALIZER).where(Student.id == student_id)
+    ).first()
     if not student:
         return jsonify({'error': 'Alumno no encontrado'}), 404
     data = _serialize_student_fees(student_id)
-    data['student'] = {
-        'id': student.id,
-        'full_name': student.full_name,
-        'last_name': student.last_name,
-        'first_name': student.first_name,
-        'status': student.status,
-        'belt': student.belt,
-    }
+    data['student'] = _serialize_row(STUDENT_FEES_SERIALIZER, student)
     return jsonify(data)
 
 
@@ -1001,7 +2711,8 @@ def api_fees_student_settings(student_id: int):
     if not student:
         return jsonify({'error': 'Alumno no encontrado'}), 404
 
-    settings = _get_student_fee_settings(student_id)
+    _lock_student_fees([student_id])
+    settings = _get_student_fee_settings_for_update(student_id)
     cfg = _get_fee_config()
     data = request.json or {}
     fixed_fee_enabled = bool(data.get('fixed_fee_enabled'))
@@ -1015,6 +2726,7 @@ def api_fees_student_settings(student_id: int):
             fixed_amount = 0
         settings.discount_value = fixed_amount
         _refresh_student_fee_charges(student_id, cfg, settings)
+        _refresh_fee_balances([student_id])
         db.session.commit()
         return jsonify({'status': 'ok'})
 
@@ -1033,6 +2745,7 @@ def api_fees_student_settings(student_id: int):
             settings.discount_value = 0
 
     _refresh_student_fee_charges(student_id, cfg, settings)
+    _refresh_fee_balances([student_id])
     db.session.commit()
     return jsonify({'status': 'ok'})
 
@@ -1046,7 +2759,6 @@ def api_fees_generate_charge(student_id: int):
     cfg = _get_fee_config()
     if float(cfg.monthly_amount or 0) <= 0:
         return jsonify({'error': 'Configurá una tarifa mensual mayor a 0 antes de generar cuotas.'}), 400
-    settings = _get_student_fee_settings(student_id)
     body = request.json or {}
 
     periods = _list_periods_from_range(body.get('period_start'), body.get('period_end'))
@@ -1060,9 +2772,8 @@ def api_fees_generate_charge(student_id: int):
             return jsonify({'error': 'Período inválido'}), 400
         periods = [period_info]
 
-    for period_info in periods:
-        _create_fee_charge(student_id, cfg, settings, period_info, body)
-
+    _generate_fee_charges([student_id], cfg, periods)
+    _refresh_fee_balances([student_id])
     db.session.commit()
 
     return jsonify(_serialize_student_fees(student_id))
@@ -1070,6 +2781,7 @@ def api_fees_generate_charge(student_id: int):
 
 @app.route('/api/fees/generate-month', methods=['POST'])
 def api_fees_generate_month_all():
+    """Genera las cuotas de los alumnos activos; con ?async=1 corre como trabajo en segundo plano."""
     cfg = _get_fee_config()
     if float(cfg.monthly_amount or 0) <= 0:
         return jsonify({'error': 'Configurá una tarifa mensual mayor a 0 antes de generar cuotas.'}), 400
@@ -1086,25 +2798,32 @@ def api_fees_generate_month_all():
             return jsonify({'error': 'Período inválido'}), 400
         periods = [period_info]
 
-    created = 0
-    students = Student.query.order_by(Student.id.asc()).all()
-    for s in students:
-        st_status = (s.status or 'activo').strip().lower()
-        if st_status == 'inactivo':
-            continue
-
-        settings = _get_student_fee_settings(s.id)
-        for period_info in periods:
-            if _create_fee_charge(s.id, cfg, settings, period_info, body):
-                created += 1
+    if _wants_async():
+        params = {'periods': [p['period'] for p in periods]}
+        return _submit_job('fees_generate_month', params, lambda job_id: _job_generate_month(periods))
 
     try:
-        db.session.commit()
+        counts = _generate_month_for_active_students(periods)
     except Exception:
         db.session.rollback()
         return jsonify({'error': 'No se pudieron generar cuotas'}), 400
 
-    return jsonify({'created': created})
+    return jsonify(counts)
+
+
+def _generate_month_for_active_students(periods):
+    """Genera (o actualiza) las cuotas de los períodos para todos los alumnos activos y confirma."""
+    cfg = _get_fee_config()
+    student_ids = [
+        sid for (sid,) in db.session.query(Student.id)
+        .filter(func.lower(func.trim(func.coalesce(Student.status, 'activo'))) != 'inactivo')
+        .order_by(Student.id.asc())
+        .all()
+    ]
+    counts = _generate_fee_charges(student_ids, cfg, periods)
+    _refresh_fee_balances(student_ids)
+    db.session.commit()
+    return counts
 
 
 @app.route('/api/fees/charge/<int:charge_id>', methods=['DELETE'])
@@ -1113,126 +2832,298 @@ def api_fees_delete_charge(charge_id: int):
     if not charge:
         return '', 204
 
+    # Con el lock tomado, un pago en curso no puede imputar a esta cuota mientras se borra
+    _lock_student_fees([charge.student_id])
     allocations_count = FeeAllocation.query.filter_by(charge_id=charge.id).count()
     if allocations_count > 0:
         return jsonify({'error': 'No se puede borrar la cuota porque ya tiene pagos aplicados.'}), 400
 
+    student_id = charge.student_id
+    _record_tombstones('fee_charges', [(charge.id, student_id)])
     db.session.delete(charge)
+    _refresh_fee_balances([student_id])
     db.session.commit()
     return '', 204
 
 
-@app.route('/api/fees/overview', methods=['GET'])
-def api_fees_overview():
-    _ensure_fees_tables()
-    today = date.today()
-    period_filter = _parse_period(request.args.get('period'))
+FEES_OVERVIEW_COLUMNS = [
+    'student_id', 'full_name', 'last_name', 'first_name', 'belt', 'status',
+    'overdue_total', 'balance_total', 'credit_total', 'period_generated_credit', 'last_payment',
+]
 
-    students = Student.query.order_by(
-        (Student.last_name.is_(None)).asc(),
-        Student.last_name.asc(),
-        Student.first_name.asc(),
-    ).all()
 
-    active_students = []
-    active_ids = []
-    for s in students:
-        st_status = (s.status or 'activo').strip().lower()
-        if st_status == 'inactivo':
-            continue
-        active_students.append(s)
-        active_ids.append(s.id)
+def _fees_overview_from_ledger(today, student_ids=None):
+    """Resumen de cuotas de los alumnos activos leyendo el ledger (una sola consulta).
 
-    charges = []
-    if active_ids:
-        charges = FeeCharge.query.filter(FeeCharge.student_id.in_(active_ids)).all()
-    if period_filter:
-        charges = [c for c in charges if c.period == period_filter['period']]
+    student_ids limita el resumen a esos alumnos (para ?since=).
+    """
+    return [dict(zip(FEES_OVERVIEW_COLUMNS, row)) for row in _fees_overview_rows(today, student_ids)]
 
-    charges_by_student = {}
-    charge_ids = []
-    for c in charges:
-        charges_by_student.setdefault(c.student_id, []).append(c)
-        charge_ids.append(c.id)
 
-    allocations = []
-    if charge_ids:
-        allocations = FeeAllocation.query.filter(FeeAllocation.charge_id.in_(charge_ids)).all()
-    paid_by_charge = {}
-    for a in allocations:
-        paid_by_charge[a.charge_id] = paid_by_charge.get(a.charge_id, 0.0) + float(a.amount)
-
-    last_payments_rows = []
-    if active_ids:
-        last_payments_rows = (
-            db.session.query(FeePayment.student_id, func.max(FeePayment.payment_date))
-            .filter(FeePayment.student_id.in_(active_ids))
-            .group_by(FeePayment.student_id)
-            .all()
+def _fees_overview_ledger_stmt(today, student_ids=None):
+    """Consulta del resumen leído del ledger (ver _fees_overview_rows)."""
+    overdue = (
+        select(FeeCharge.student_id, func.sum(FeeCharge.balance).label('overdue_total'))
+        .where(FeeCharge.due_date < today, FeeCharge.balance > 0)
+        .group_by(FeeCharge.student_id)
+        .subquery()
+    )
+    stmt = (
+        select(
+            Student.id, Student.full_name, Student.last_name, Student.first_name, Student.belt,
+            StudentFeeBalance.balance_total, StudentFeeBalance.credit_total, StudentFeeBalance.has_partial,
+            StudentFeeBalance.charges_count, StudentFeeBalance.positive_charges_count,
+            StudentFeeBalance.last_payment, overdue.c.overdue_total,
         )
-    last_payment_map = {sid: pdate for (sid, pdate) in last_payments_rows}
+        .outerjoin(StudentFeeBalance, StudentFeeBalance.student_id == Student.id)
+        .outerjoin(overdue, overdue.c.student_id == Student.id)
+        .where(func.lower(func.trim(func.coalesce(Student.status, 'activo'))) != 'inactivo')
+        .order_by(
+            (Student.last_name.is_(None)).asc(),
+            Student.last_name.asc(),
+            Student.first_name.asc(),
+        )
+    )
 
-    payments = []
-    if active_ids:
-        payments = FeePayment.query.filter(FeePayment.student_id.in_(active_ids)).all()
-    payment_ids = [p.id for p in payments]
-    payment_allocations = []
-    if payment_ids:
-        payment_allocations = FeeAllocation.query.filter(FeeAllocation.payment_id.in_(payment_ids)).all()
-    allocated_by_payment = {}
-    for a in payment_allocations:
-        allocated_by_payment[a.payment_id] = allocated_by_payment.get(a.payment_id, 0.0) + float(a.amount)
-    student_credit_map = {}
-    for p in payments:
-        student_credit_map[p.student_id] = student_credit_map.get(p.student_id, 0.0) + round(float(p.amount or 0) - float(allocated_by_payment.get(p.id, 0.0)), 2)
+    if student_ids is not None:
+        stmt = stmt.where(Student.id.in_(student_ids))
+    return stmt
 
-    period_payment_total_map = {}
-    if period_filter:
-        selected_period = period_filter['period']
-        for p in payments:
-            payment_period = str(p.payment_date or '')[:7]
-            if payment_period != selected_period:
-                continue
-            period_payment_total_map[p.student_id] = period_payment_total_map.get(p.student_id, 0.0) + float(p.amount or 0)
 
+def _fees_overview_rows(today, student_ids=None):
+    """Filas del resumen como listas en el orden de FEES_OVERVIEW_COLUMNS (sin dicts intermedios)."""
     out = []
-    for s in active_students:
-        st_charges = charges_by_student.get(s.id, [])
-        financials = _build_charge_financials(st_charges, paid_by_charge, student_credit=student_credit_map.get(s.id, 0.0), today_value=today)
-        period_charge_total = 0.0
-        if period_filter:
-            for c in st_charges:
-                period_charge_total += float(c.final_amount or 0)
-        period_generated_credit = 0.0
-        if period_filter:
-            period_generated_credit = round(max(period_payment_total_map.get(s.id, 0.0) - period_charge_total, 0.0), 2)
-
-        if not st_charges or financials['positive_charges_count'] == 0:
-            status = 'sin_registro'
-        elif financials['overdue_total'] > 0:
-            status = 'vencida'
-        elif financials['has_partial']:
-            status = 'parcial'
-        elif financials['balance_total'] > 0:
-            status = 'pendiente'
-        else:
-            status = 'al_dia'
+    for (
+        student_id, full_name, last_name, first_name, belt, balance_total, credit_total,
+        has_partial, charges_count, positive_charges_count, last_payment, overdue_total,
+    ) in db.session.execute(_fees_overview_ledger_stmt(today, student_ids)):
+        overdue_total = round(float(overdue_total or 0), 2)
+        balance_total = float(balance_total or 0)
+        status = _fee_status_values(
+            bool(charges_count), positive_charges_count or 0, overdue_total, bool(has_partial), balance_total,
+        )
+        out.append([
+            student_id, full_name, last_name, first_name, belt, status, overdue_total,
+            round(balance_total, 2), round(float(credit_total or 0), 2), 0.0, last_payment,
+        ])
+    return out
+
+
+def _next_period(period_info):
+    year = period_info['year']
+    month = period_info['month'] + 1
+    if month > 12:
+        month = 1
+        year += 1
+    return f'{year:04d}-{month:02d}'
+
+
+def _fees_overview_period_stmt(period_info, today):
+    """Consulta del resumen de un período (una fila por alumno activo, ver _fees_overview_for_period)."""
+    period = period_info['period']
+    active = func.lower(func.trim(func.coalesce(Student.status, 'activo'))) != 'inactivo'
+    in_period = (FeePayment.payment_date >= period) & (FeePayment.payment_date < _next_period(period_info))
+
+    payments_sq = (
+        select(
+            FeePayment.student_id.label('student_id'),
+            func.sum(FeePayment.amount).label('paid_in'),
+            func.sum(case((in_period, FeePayment.amount), else_=0)).label('period_paid'),
+            func.max(FeePayment.payment_date).label('last_payment'),
+        )
+        .join(Student, Student.id == FeePayment.student_id)
+        .where(active)
+        .group_by(FeePayment.student_id)
+        .subquery('payments_sq')
+    )
+    allocated_sq = (
+        select(FeePayment.student_id.label('student_id'), func.sum(FeeAllocation.amount).label('allocated'))
+        .join(FeePayment, FeePayment.id == FeeAllocation.payment_id)
+        .join(Student, Student.id == FeePayment.student_id)
+        .where(active)
+        .group_by(FeePayment.student_id)
+        .subquery('allocated_sq')
+    )
+    paid_by_charge_sq = (
+        select(FeeAllocation.charge_id.label('charge_id'), func.sum(FeeAllocation.amount).label('paid'))
+        .join(FeeCharge, FeeCharge.id == FeeAllocation.charge_id)
+        .where(FeeCharge.period == period)
+        .group_by(FeeAllocation.charge_id)
+        .subquery('paid_by_charge_sq')
+    )
+
+    # Cuotas del período con pagado, saldo bruto y crédito disponible del alumno
+    # Se redondea a centavos en cada paso (como el cálculo en Python): en SQLite los NUMERIC son REAL
+    paid = func.round(func.coalesce(paid_by_charge_sq.c.paid, 0), 2)
+    raw = func.round(FeeCharge.final_amount - paid, 2)
+    credit = func.round(func.coalesce(payments_sq.c.paid_in, 0) - func.coalesce(allocated_sq.c.allocated, 0), 2)
+    charges_sq = (
+        select(
+            FeeCharge.id.label('id'),
+            FeeCharge.student_id.label('student_id'),
+            FeeCharge.due_date.label('due_date'),
+            FeeCharge.period.label('period'),
+            FeeCharge.final_amount.label('total'),
+            paid.label('paid'),
+            raw.label('raw'),
+            case((raw > 0, raw), else_=0).label('pos_raw'),
+            credit.label('credit'),
+        )
+        .join(Student, Student.id == FeeCharge.student_id)
+        .outerjoin(paid_by_charge_sq, paid_by_charge_sq.c.charge_id == FeeCharge.id)
+        .outerjoin(payments_sq, payments_sq.c.student_id == FeeCharge.student_id)
+        .outerjoin(allocated_sq, allocated_sq.c.student_id == FeeCharge.student_id)
+        .where(FeeCharge.period == period, active)
+        .subquery('charges_sq')
+    )
+
+    # Crédito aplicado: lo que queda del crédito tras cubrir las cuotas anteriores, tope en el saldo bruto
+    owed_before = func.sum(charges_sq.c.pos_raw).over(
+        partition_by=charges_sq.c.student_id,
+        order_by=(charges_sq.c.due_date, charges_sq.c.period, charges_sq.c.id),
+        rows=(None, 0),
+    ) - charges_sq.c.pos_raw
+    available = func.round(charges_sq.c.credit - owed_before, 2)
+    applied = case(
+        (
+            (charges_sq.c.raw > 0) & (available > 0),
+            case((available < charges_sq.c.raw, available), else_=charges_sq.c.raw),
+        ),
+        else_=0,
+    )
+    applied_sq = select(charges_sq, applied.label('applied')).subquery('applied_sq')
+
+    effective = func.round(applied_sq.c.raw - applied_sq.c.applied, 2)
+    totals_sq = (
+        select(
+            applied_sq.c.student_id.label('student_id'),
+            func.count().label('charges_count'),
+            func.sum(case((applied_sq.c.total > 0, 1), else_=0)).label('positive_charges_count'),
+            func.sum(applied_sq.c.total).label('charge_total'),
+            func.sum(applied_sq.c.applied).label('applied_total'),
+            func.sum(effective).label('effective_total'),
+            func.sum(case(((applied_sq.c.due_date < today) & (effective > 0), effective), else_=0)).label('overdue_total'),
+            func.sum(case((effective < 0, -effective), else_=0)).label('charge_credit_total'),
+            func.max(case(((applied_sq.c.paid > 0) & (effective > 0), 1), else_=0)).label('has_partial'),
+        )
+        .group_by(applied_sq.c.student_id)
+        .subquery('totals_sq')
+    )
+
+    stmt = (
+        select(
+            Student.id, Student.full_name, Student.last_name, Student.first_name, Student.belt,
+            totals_sq.c.charges_count, totals_sq.c.positive_charges_count, totals_sq.c.charge_total,
+            totals_sq.c.applied_total, totals_sq.c.effective_total, totals_sq.c.overdue_total,
+            totals_sq.c.charge_credit_total, totals_sq.c.has_partial,
+            payments_sq.c.paid_in, payments_sq.c.period_paid, payments_sq.c.last_payment,
+            allocated_sq.c.allocated,
+        )
+        .outerjoin(totals_sq, totals_sq.c.student_id == Student.id)
+        .outerjoin(payments_sq, payments_sq.c.student_id == Student.id)
+        .outerjoin(allocated_sq, allocated_sq.c.student_id == Student.id)
+        .where(active)
+        .order_by(
+            (Student.last_name.is_(None)).asc(),
+            Student.last_name.asc(),
+            Student.first_name.asc(),
+        )
+    )
+    return stmt
+
+
+def _fees_overview_for_period(period_info, today):
+    """Resumen de cuotas de un período calculado en la base (GROUP BY + funciones de ventana).
 
+    Mismas reglas que _run_fee_engine: el crédito del alumno (pagos sin imputar) se aplica a las
+    cuotas del período en orden de vencimiento; los saldos por alumno se agregan en SQL.
+    """
+    out = []
+    for row in db.session.execute(_fees_overview_period_stmt(period_info, today)).all():
+        student_credit = round(float(row.paid_in or 0) - float(row.allocated or 0), 2)
+        remaining_credit = round(student_credit - float(row.applied_total or 0), 2)
+        financials = {
+            'overdue_total': round(float(row.overdue_total or 0), 2),
+            'balance_total': round(float(row.effective_total or 0) - remaining_credit, 2),
+            'credit_total': round(remaining_credit + float(row.charge_credit_total or 0), 2),
+            'has_partial': bool(row.has_partial),
+            'positive_charges_count': int(row.positive_charges_count or 0),
+        }
+        period_generated_credit = round(max(float(row.period_paid or 0) - float(row.charge_total or 0), 0.0), 2)
         out.append({
-            'student_id': s.id,
-            'full_name': s.full_name,
-            'last_name': s.last_name,
-            'first_name': s.first_name,
-            'belt': s.belt,
-            'status': status,
-            'overdue_total': round(financials['overdue_total'], 2),
-            'balance_total': round(financials['balance_total'], 2),
-            'credit_total': round(financials['credit_total'], 2),
-            'period_generated_credit': round(period_generated_credit, 2),
-            'last_payment': last_payment_map.get(s.id),
+            'student_id': row.id,
+            'full_name': row.full_name,
+            'last_name': row.last_name,
+            'first_name': row.first_name,
+            'belt': row.belt,
+            'status': _fee_status(financials, bool(row.charges_count)),
+            'overdue_total': financials['overdue_total'],
+            'balance_total': financials['balance_total'],
+            'credit_total': financials['credit_total'],
+            'period_generated_credit': period_generated_credit,
+            'last_payment': row.last_payment,
         })
+    return out
+
+
+# Tablas que determinan el resumen de cuotas (ver _versioned_get); el vencimiento depende además del día
+FEES_OVERVIEW_TABLES = ('students', 'fee_charges', 'fee_payments', 'fee_allocations', 'student_fee_balances')
+
+
+@app.route('/api/fees/overview', methods=['GET'])
+def api_fees_overview():
+    return _versioned_get(FEES_OVERVIEW_TABLES, _fees_overview, date.today())
+
+
+def _fees_overview():
+    today = date.today()
+    period_filter = _parse_period(request.args.get('period'))
+    response_format = _response_format()
+    if response_format is None:
+        return jsonify({'error': 'format inválido (json o columnar)'}), 400
+    if request.args.get('since') is not None:
+        if period_filter:
+            return jsonify({'error': 'since no se puede combinar con period'}), 400
+        if response_format == 'columnar':
+            return jsonify({'error': 'since no se puede combinar con format=columnar'}), 400
+        return _fees_overview_since(request.args.get('since'), today)
+    if period_filter:
+        items = _fees_overview_for_period(period_filter, today)
+        if response_format == 'columnar':
+            return _columnar_response(FEES_OVERVIEW_COLUMNS, [[item[c] for c in FEES_OVERVIEW_COLUMNS] for item in items])
+        return jsonify(items)
+    if response_format == 'columnar':
+        return _columnar_response(FEES_OVERVIEW_COLUMNS, _fees_overview_rows(today))
+    return jsonify(_fees_overview_from_ledger(today))
 
-    return jsonify(out)
+
+def _fees_overview_since(since_raw, today):
+    """GET /api/fees/overview?since=<cursor>: filas de los alumnos cuyo alumno, cuotas, pagos o saldo cambiaron.
+
+    El vencimiento depende del día, así que el cursor vale solo para el día en que se emitió.
+    """
+    scope = today.isoformat()
+    since, error = _parse_sync_since(since_raw, scope)
+    if error:
+        return jsonify({'error': error}), 400
+    cursor = _new_sync_cursor(scope)
+    if since is None:
+        return _sync_response(_fees_overview_from_ledger(today), [], since, cursor)
+
+    changed = _sync_changed_ids(Student, since)
+    for stmt in (
+        select(StudentFeeBalance.student_id).where(_synced_after(StudentFeeBalance.sync_seq, since)),
+        select(FeeCharge.student_id).where(_synced_after(FeeCharge.sync_seq, since)),
+        select(FeePayment.student_id).where(_synced_after(FeePayment.sync_seq, since)),
+        select(SyncTombstone.student_id).where(
+            SyncTombstone.table_name.in_(['fee_charges', 'fee_payments']),
+            _synced_after(SyncTombstone.sync_seq, since),
+        ),
+    ):
+        changed.update(sid for sid in db.session.execute(stmt.distinct()).scalars() if sid is not None)
+    items = _fees_overview_from_ledger(today, changed) if changed else []
+    deleted = _sync_deleted_ids('students', since, changed, [row['student_id'] for row in items])
+    return _sync_response(items, deleted, since, cursor)
 
 
 @app.route('/api/fees/student/<int:student_id>/payments', methods=['POST'])
@@ -1245,11 +3136,11 @@ def api_fees_register_payment(student_id: int):
     payment_date = body.get('payment_date') or datetime.now().strftime('%Y-%m-%d')
     amount_raw = body.get('amount', 0)
     try:
-        amount = float(amount_raw or 0)
+        amount_cents = _to_cents(amount_raw or 0)
     except Exception:
-        amount = 0
-    if amount < 0:
-        amount = 0
+        amount_cents = 0
+    if amount_cents < 0:
+        amount_cents = 0
 
     method = body.get('method') or 'cash'
     if method not in ('cash', 'transfer'):
@@ -1257,10 +3148,20 @@ def api_fees_register_payment(student_id: int):
     reference = body.get('reference')
     notes = body.get('notes')
 
+    charge_ids = body.get('apply_to_charge_ids')
+    normalized = []
+    if isinstance(charge_ids, list):
+        for raw in charge_ids:
+            try:
+                normalized.append(int(raw))
+            except Exception:
+                continue
+
+    _lock_student_fees([student_id])
     payment = FeePayment(
         student_id=student_id,
         payment_date=payment_date,
-        amount=round(amount, 2),
+        amount=_from_cents(amount_cents),
         method=method,
         reference=reference,
         notes=notes,
@@ -1268,38 +3169,8 @@ def api_fees_register_payment(student_id: int):
     db.session.add(payment)
     db.session.flush()
 
-    charge_ids = body.get('apply_to_charge_ids')
-    charges_q = FeeCharge.query.filter_by(student_id=student_id)
-    if isinstance(charge_ids, list) and charge_ids:
-        normalized = []
-        for raw in charge_ids:
-            try:
-                normalized.append(int(raw))
-            except Exception:
-                continue
-        if normalized:
-            charges_q = charges_q.filter(FeeCharge.id.in_(normalized))
-    charges = charges_q.order_by(FeeCharge.due_date.asc()).all()
-
-    allocated_map = _get_charge_allocated_amounts([c.id for c in charges])
-    remaining_payment = round(amount, 2)
-
-    for c in charges:
-        if remaining_payment <= 0:
-            break
-        total = float(c.final_amount or 0)
-        already = allocated_map.get(c.id, 0.0)
-        remaining_charge = round(total - already, 2)
-        if remaining_charge <= 0:
-            continue
-
-        applied = remaining_charge if remaining_charge < remaining_payment else remaining_payment
-        if applied <= 0:
-            continue
-
-        db.session.add(FeeAllocation(payment_id=payment.id, charge_id=c.id, amount=round(applied, 2)))
-        remaining_payment = round(remaining_payment - applied, 2)
-
+    _allocate_payment(payment.id, student_id, amount_cents, normalized)
+    _refresh_fee_balances([student_id])
     db.session.commit()
     return jsonify(_serialize_student_fees(student_id))
 
@@ -1318,24 +3189,779 @@ def api_fees(student_id: int):
 def api_fee_payment_delete(payment_id: int):
     payment = FeePayment.query.get(payment_id)
     if payment:
+        student_id = payment.student_id
+        _lock_student_fees([student_id])
         FeeAllocation.query.filter_by(payment_id=payment.id).delete()
+        _record_tombstones('fee_payments', [(payment.id, student_id)])
         db.session.delete(payment)
+        _refresh_fee_balances([student_id])
         db.session.commit()
     return '', 204
 
 
+# --- Importación masiva de pagos ---
+# CSV (con encabezado, separado por coma o punto y coma) o NDJSON (un objeto JSON por línea).
+# Columnas: student_id | dni | reference (para identificar al alumno, en ese orden de prioridad),
+# amount, payment_date (YYYY-MM-DD o DD/MM/AAAA), method, notes.
+
+PAYMENT_IMPORT_MAX_ROWS = _env_int('PAYMENT_IMPORT_MAX_ROWS', 20000)
+# Filas que se validan juntas (una consulta de alumnos por lote) mientras se lee el archivo
+PAYMENT_IMPORT_BATCH_ROWS = max(1, _env_int('PAYMENT_IMPORT_BATCH_ROWS', 1000))
+PAYMENT_IMPORT_COLUMN_ALIASES = {
+    'alumno_id': 'student_id',
+    'id_alumno': 'student_id',
+    'documento': 'dni',
+    'referencia': 'reference',
+    'monto': 'amount',
+    'importe': 'amount',
+    'fecha': 'payment_date',
+    'date': 'payment_date',
+    'metodo': 'method',
+    'método': 'method',
+    'notas': 'notes',
+}
+
+
+def _normalize_dni(value) -> str:
+    return re.sub(r'\D', '', str(value or ''))
+
+
+def _parse_amount_cents(raw):
+    """Importe de una fila a centavos; acepta 1234.56, 1234,56 y 1.234,56. None si no es válido."""
+    if raw is None or isinstance(raw, bool):
+        return None
+    if isinstance(raw, (int, float)):
+        value = str(raw)
+    else:
+        value = str(raw).strip().replace('$', '').replace(' ', '')
+        if ',' in value and (('.' not in value) or value.rfind(',') > value.rfind('.')):
+            value = value.replace('.', '').replace(',', '.')
+        else:
+            value = value.replace(',', '')
+    try:
+        amount = Decimal(value)
+    except ArithmeticError:
+        return None
+    # NaN e Infinity son Decimal válidos pero no se pueden pasar a centavos
+    if not amount.is_finite():
+        return None
+    return _to_cents(amount)
+
+
+def _parse_payment_date(raw):
+    value = str(raw or '').strip()
+    if not value:
+        return date.today().isoformat()
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _iter_import_lines(stream):
+    """Lee el archivo de a una línea en UTF-8 (con o sin BOM).
+
+    Los bancos suelen exportar en Windows-1252/Latin-1: desde la primera línea que no es UTF-8
+    válido se decodifica el resto como cp1252 (los bytes sin asignar quedan como U+FFFD).
+    """
+    encoding = 'utf-8-sig'
+    for raw in iter(stream.readline, b''):
+        if encoding != 'cp1252':
+            try:
+                yield raw.decode(encoding)
+                encoding = 'utf-8'
+                continue
+            except UnicodeDecodeError:
+                encoding = 'cp1252'
+        yield raw.decode('cp1252', errors='replace')
+
+
+def _iter_payment_import_rows(stream, fmt: str):
+    """Lee el archivo de a una fila y devuelve (número de fila, dict con columnas normalizadas)."""
+    text_stream = _iter_import_lines(stream)
+    if fmt == 'ndjson':
+        for line_no, line in enumerate(text_stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                yield line_no, None
+                continue
+            # Solo objetos planos: un objeto o lista anidado no es el valor de una columna
+            if not isinstance(data, dict) or any(isinstance(v, (dict, list)) for v in data.values()):
+                data = None
+            yield line_no, data
+        return
+
+    header = next(text_stream, '')
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    fieldnames = next(csv.reader([header], delimiter=delimiter), [])
+    fieldnames = [PAYMENT_IMPORT_COLUMN_ALIASES.get(f.strip().lower(), f.strip().lower()) for f in fieldnames]
+    reader = csv.DictReader(text_stream, fieldnames=fieldnames, delimiter=delimiter)
+    # La fila 1 es el encabezado
+    for line_no, data in enumerate(reader, start=2):
+        if not any((v or '').strip() for k, v in data.items() if k is not None):
+            continue
+        yield line_no, data
+
+
+def _payment_student_matchers(rows):
+    """Mapas para identificar alumnos: ids existentes, DNI -> id y referencia de pagos previos -> ids."""
+    dnis = {_normalize_dni(r.get('dni')) for _n, r in rows if r.get('dni')}
+    references = {str(r.get('reference')).strip() for _n, r in rows if r.get('reference')}
+    raw_ids = set()
+    for _n, r in rows:
+        try:
+            raw_ids.add(int(r.get('student_id')))
+        except (TypeError, ValueError):
+            continue
+
+    known_ids = set()
+    if raw_ids:
+        known_ids = set(db.session.execute(select(Student.id).where(Student.id.in_(raw_ids))).scalars())
+    by_dni = {}
+    if dnis:
+        # El DNI se guarda con o sin puntos: se compara solo por dígitos
+        for sid, dni in db.session.execute(select(Student.id, Student.dni).where(Student.dni.isnot(None))):
+            key = _normalize_dni(dni)
+            if key in dnis:
+                by_dni.setdefault(key, set()).add(sid)
+    by_reference = {}
+    if references:
+        for sid, ref in db.session.execute(
+            select(FeePayment.student_id, FeePayment.reference).where(FeePayment.reference.in_(references)).distinct()
+        ):
+            by_reference.setdefault(ref, set()).add(sid)
+    return known_ids, by_dni, by_reference
+
+
+def _match_payment_student(row, known_ids, by_dni, by_reference):
+    """Devuelve (student_id, criterio) o (None, mensaje de error)."""
+    raw_id = row.get('student_id')
+    if raw_id not in (None, ''):
+        try:
+            sid = int(raw_id)
+        except (TypeError, ValueError):
+            return None, 'student_id inválido'
+        if sid not in known_ids:
+            return None, 'Alumno no encontrado'
+        return sid, 'id'
+    for key, mapping, label in (
+        (_normalize_dni(row.get('dni')), by_dni, 'dni'),
+        (str(row.get('reference') or '').strip(), by_reference, 'reference'),
+    ):
+        if not key:
+            continue
+        matches = mapping.get(key) or set()
+        if len(matches) == 1:
+            return next(iter(matches)), label
+        if len(matches) > 1:
+            return None, f'{label} coincide con más de un alumno'
+    return None, 'No se encontró el alumno (student_id, dni o reference)'
+
+
+def _validate_payment_import_rows(rows, results, pending):
+    """Valida un lote de filas leídas: agrega el resultado de cada una a results y los pagos válidos a pending."""
+    known_ids, by_dni, by_reference = _payment_student_matchers([r for r in rows if r[1] is not None])
+    for line_no, row in rows:
+        result = {'row': line_no, 'status': 'error', 'student_id': None}
+        results.append(result)
+        if row is None:
+            result['error'] = 'Fila inválida'
+            continue
+        student_id, matched = _match_payment_student(row, known_ids, by_dni, by_reference)
+        if student_id is None:
+            result['error'] = matched
+            continue
+        result['student_id'] = student_id
+        result['matched_by'] = matched
+        amount_cents = _parse_amount_cents(row.get('amount'))
+        if amount_cents is None or amount_cents <= 0:
+            result['error'] = 'Importe inválido'
+            continue
+        payment_date = _parse_payment_date(row.get('payment_date'))
+        if payment_date is None:
+            result['error'] = 'Fecha inválida'
+            continue
+        method = str(row.get('method') or 'transfer').strip().lower()
+        if method not in ('cash', 'transfer'):
+            method = 'transfer'
+        pending.append((result, {
+            'student_id': student_id,
+            'payment_date': payment_date,
+            'amount_cents': amount_cents,
+            'method': method,
+            'reference': str(row.get('reference') or '').strip() or None,
+            'notes': str(row.get('notes') or '').strip() or None,
+        }))
+
+
+# Casos de importes de la importación: (valor de la celda, centavos esperados o None si es inválido)
+PAYMENT_IMPORT_AMOUNT_CASES = [
+    ('1234.56', 123456), ('1234,56', 123456), ('1.234,56', 123456), ('$ 1,234.56', 123456),
+    (1500, 150000), (0.1, 10), ('abc', None), ('', None), (None, None),
+    ('NaN', None), ('-Infinity', None), (float('nan'), None), (float('inf'), None),
+]
+
+
+@app.cli.command('fees-import-check')
+def cli_fees_import_check():
+    """Verifica el parser de la importación de pagos con importes y archivos de ejemplo."""
+    problems = []
+    for raw, expected in PAYMENT_IMPORT_AMOUNT_CASES:
+        got = _parse_amount_cents(raw)
+        if got != expected:
+            problems.append(f'importe {raw!r}: esperado {expected}, obtenido {got}')
+
+    # Un NaN sin comillas en NDJSON (json.loads lo acepta) debe quedar como fila con importe inválido
+    rows = list(_iter_payment_import_rows(BytesIO(b'{"student_id": 1, "amount": NaN}\n'), 'ndjson'))
+    if len(rows) != 1 or rows[0][1] is None or _parse_amount_cents(rows[0][1].get('amount')) is not None:
+        problems.append(f'NDJSON con NaN: {rows!r}')
+
+    # Un valor anidado (p. ej. notes como objeto) invalida la fila en lugar de llegar al INSERT
+    rows = list(_iter_payment_import_rows(BytesIO(b'{"student_id": 1, "amount": 10, "notes": {"a": 1}}\n'), 'ndjson'))
+    if rows != [(1, None)]:
+        problems.append(f'NDJSON con valor anidado: {rows!r}')
+
+    # El mismo CSV exportado en UTF-8 con BOM y en Windows-1252 debe leerse igual
+    sample = 'DNI;Importe;Método;Notas\n30.111.222;1.234,56;transfer;Cuota de Núñez\n'
+    expected_rows = [(2, {'dni': '30.111.222', 'amount': '1.234,56', 'method': 'transfer', 'notes': 'Cuota de Núñez'})]
+    for encoding in ('utf-8-sig', 'cp1252'):
+        rows = list(_iter_payment_import_rows(BytesIO(sample.encode(encoding)), 'csv'))
+        if rows != expected_rows:
+            problems.append(f'CSV en {encoding}: {rows!r}')
+
+    for line in problems:
+        print(line)
+    print(f'{len(PAYMENT_IMPORT_AMOUNT_CASES) + 4} casos, {len(problems)} diferencias.')
+    if problems:
+        raise SystemExit(1)
+
+
+@app.route('/api/fees/payments/import', methods=['POST'])
+def api_fees_import_payments():
+    """Importa pagos desde un CSV o NDJSON y los imputa por vencimiento, todo en una transacción.
+
+    Acepta el archivo en el campo multipart 'file' o como cuerpo del pedido. ?format=csv|ndjson
+    (si no se indica, se deduce del nombre o del Content-Type) y ?dry_run=1 para ver el
+    resultado sin guardar nada. Las filas con errores o duplicadas se informan y se saltean.
+    """
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    filename = (upload.filename if upload else '') or ''
+    content_type = ((upload.mimetype if upload else request.mimetype) or '').lower()
+    fmt = (request.args.get('format') or '').strip().lower()
+    if not fmt:
+        is_ndjson = filename.lower().endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type
+        fmt = 'ndjson' if is_ndjson else 'csv'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Formato inválido (csv o ndjson)'}), 400
+    dry_run = str(request.args.get('dry_run', '')).strip().lower() in ('1', 'true', 'yes', 'y', 'on')
+
+    # El archivo se lee y valida por lotes: solo quedan en memoria el resultado de cada fila
+    # (va en la respuesta) y los pagos válidos, que se insertan juntos en una transacción.
+    results = []
+    pending = []  # (resultado, datos del pago)
+    batch = []
+    for row in _iter_payment_import_rows(stream, fmt):
+        if len(results) + len(batch) >= PAYMENT_IMPORT_MAX_ROWS:
+            return jsonify({'error': f'El archivo supera las {PAYMENT_IMPORT_MAX_ROWS} filas'}), 400
+        batch.append(row)
+        if len(batch) >= PAYMENT_IMPORT_BATCH_ROWS:
+            _validate_payment_import_rows(batch, results, pending)
+            batch = []
+    _validate_payment_import_rows(batch, results, pending)
+    if not results:
+        return jsonify({'error': 'El archivo no tiene filas'}), 400
+
+    student_ids = {p['student_id'] for _r, p in pending}
+    if not dry_run:
+        _lock_student_fees(student_ids)
+
+    # Pagos con referencia ya registrados (mismo alumno, fecha e importe) o repetidos en el archivo
+    seen = set()
+    referenced = {p['reference'] for _r, p in pending if p['reference']}
+    if referenced:
+        for sid, ref, pay_date, amount in db.session.execute(
+            select(FeePayment.student_id, FeePayment.reference, FeePayment.payment_date, FeePayment.amount)
+            .where(FeePayment.student_id.in_(student_ids), FeePayment.reference.in_(referenced))
+        ):
+            seen.add((sid, ref, pay_date, _to_cents(amount)))
+
+    open_by_student = _load_open_charges(student_ids) if student_ids else {}
+    to_insert = []
+    for result, payment in pending:
+        if payment['reference']:
+            key = (payment['student_id'], payment['reference'], payment['payment_date'], payment['amount_cents'])
+            if key in seen:
+                result['status'] = 'duplicado'
+                result['error'] = 'El pago ya estaba registrado'
+                continue
+            seen.add(key)
+        allocations, remaining = _fifo_allocate(open_by_student.get(payment['student_id'], []), payment['amount_cents'])
+        result.update({
+            'status': 'ok',
+            'amount': float(_from_cents(payment['amount_cents'])),
+            'payment_date': payment['payment_date'],
+            'allocations': [{'charge_id': cid, 'amount': float(_from_cents(cents))} for cid, cents in allocations],
+            'credit': float(_from_cents(remaining)),
+        })
+        to_insert.append((result, payment, allocations))
+
+    if not dry_run and to_insert:
+        try:
+            payment_ids = db.session.execute(
+                insert(FeePayment).returning(FeePayment.id, sort_by_parameter_order=True),
+                [
+                    {
+                        'student_id': p['student_id'],
+                        'payment_date': p['payment_date'],
+                        'amount': _from_cents(p['amount_cents']),
+                        'method': p['method'],
+                        'reference': p['reference'],
+                        'notes': p['notes'],
+                    }
+                    for _r, p, _a in to_insert
+                ],
+            ).scalars().all()
+            allocation_rows = []
+            for payment_id, (result, _p, allocations) in zip(payment_ids, to_insert):
+                result['payment_id'] = payment_id
+                allocation_rows.extend(
+                    {'payment_id': payment_id, 'charge_id': cid, 'amount': _from_cents(cents)}
+                    for cid, cents in allocations
+                )
+            if allocation_rows:
+                db.session.execute(FeeAllocation.__table__.insert(), allocation_rows)
+            _refresh_fee_balances({p['student_id'] for _r, p, _a in to_insert})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Falló la importación de pagos')
+            return jsonify({'error': 'No se pudieron importar los pagos'}), 400
+    else:
+        db.session.rollback()
+
+    return jsonify({
+        'dry_run': dry_run,
+        'total_rows': len(results),
+        'imported': len(to_insert),
+        'errors': sum(1 for r in results if r['status'] == 'error'),
+        'duplicates': sum(1 for r in results if r['status'] == 'duplicado'),
+        'amount_total': float(_from_cents(sum(p['amount_cents'] for _r, p, _a in to_insert))),
+        'rows': results,
+    })
+
+
 @app.route('/admin/clear-fees', methods=['GET'])
 def admin_clear_fees():
+    _record_tombstones('fee_charges', db.session.execute(select(FeeCharge.id, FeeCharge.student_id)).all())
+    _record_tombstones('fee_payments', db.session.execute(select(FeePayment.id, FeePayment.student_id)).all())
     FeeAllocation.query.delete()
     FeeCharge.query.delete()
     deleted = FeePayment.query.delete()
+    StudentFeeBalance.query.delete()
     db.session.commit()
     return jsonify({'deleted_payments': deleted}), 200
 
 
+# --- Plantilla PDF de examen (cache por proceso) ---
+
+EXAM_TEMPLATE_PATH = os.path.join(app.root_path, 'src', 'PDF TAEKWONDO - ultima edición.pdf')
+
+_exam_template_lock = threading.Lock()
+_exam_template_cache = {'entry': None, 'hits': 0, 'misses': 0, 'reloads': 0}
+
+
+def _resolve_pdf_object(obj, seen):
+    """Resuelve recursivamente los objetos indirectos para que el lector no vuelva a leer el archivo."""
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if hasattr(obj, 'get_object'):
+        obj = obj.get_object()
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key == '/Parent':
+                continue
+            _resolve_pdf_object(value, seen)
+        if hasattr(obj, 'get_data'):
+            obj.get_data()
+    elif isinstance(obj, list):
+        for value in obj:
+            _resolve_pdf_object(value, seen)
+
+
+def _load_exam_template(path: str, mtime: float, digest: str, data: bytes):
+    reader = PdfReader(BytesIO(data))
+    if not reader.pages:
+        return None
+    page = reader.pages[0]
+    _resolve_pdf_object(page, set())
+
+    fields = reader.get_fields() or {}
+    field_map = {}
+    for name, field in fields.items():
+        field_map[str(name)] = {
+            'name': str(name),
+            'type': str(field.get('/FT')) if isinstance(field, dict) else None,
+        }
+
+    return {
+        'path': path,
+        'mtime': mtime,
+        'sha256': digest,
+        'reader': reader,
+        'page': page,
+        'width': float(page.mediabox.width),
+        'height': float(page.mediabox.height),
+        'fields': field_map,
+    }
+
+
+def _get_exam_template():
+    """Devuelve (plantilla, error) con la primera página del PDF base ya parseada.
+
+    La plantilla se parsea una vez por proceso y se invalida si cambia el mtime del archivo
+    y además su contenido (sha256). La plantilla devuelta es compartida: no modificarla.
+    """
+    path = EXAM_TEMPLATE_PATH
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None, 'PDF base no encontrado en src'
+
+    with _exam_template_lock:
+        entry = _exam_template_cache['entry']
+        if entry is not None and entry['mtime'] == mtime:
+            _exam_template_cache['hits'] += 1
+            return entry, None
+
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is not None and entry['sha256'] == digest:
+            # Solo cambió el mtime (por ejemplo, un deploy que re-copia el archivo)
+            entry['mtime'] = mtime
+            _exam_template_cache['hits'] += 1
+            return entry, None
+
+        _exam_template_cache['misses'] += 1
+        if entry is not None:
+            _exam_template_cache['reloads'] += 1
+        entry = _load_exam_template(path, mtime, digest, data)
+        _exam_template_cache['entry'] = entry
+        if entry is None:
+            return None, 'PDF base sin páginas'
+        return entry, None
+
+
+def _exam_template_cache_stats():
+    with _exam_template_lock:
+        entry = _exam_template_cache['entry']
+        return {
+            'hits': _exam_template_cache['hits'],
+            'misses': _exam_template_cache['misses'],
+            'reloads': _exam_template_cache['reloads'],
+            'loaded': entry is not None,
+            'sha256': entry['sha256'] if entry else None,
+        }
+
+
+@app.route('/api/exams/template-cache', methods=['GET'])
+def exam_template_cache_stats():
+    """Contadores de la cache de la plantilla PDF de examen."""
+    return jsonify(_exam_template_cache_stats())
+
+
+# --- Render de PDFs por bloques (pool de procesos) ---
+# PDF_RENDER_WORKERS: procesos del pool (0 o 1 = render serial en el mismo proceso).
+# PDF_RENDER_CHUNK_SIZE: alumnos por bloque; el pool solo se usa si hay más de un bloque.
+# PDF_RENDER_TIMEOUT_SECONDS: espera máxima por bloque; si se vence, el pool se descarta y se sigue en serie.
+# Los procesos se crean con spawn: un fork desde el servidor multihilo podría copiar un lock tomado
+# (logos, plantilla) y colgar al hijo.
+
+EVENT_PDF_FIELDS = ['id', 'date', 'time', 'title', 'type', 'level', 'place', 'notes']
+
+
+PDF_RENDER_WORKERS = _env_int('PDF_RENDER_WORKERS', min(4, os.cpu_count() or 1))
+PDF_RENDER_CHUNK_SIZE = max(1, _env_int('PDF_RENDER_CHUNK_SIZE', 50))
+PDF_RENDER_TIMEOUT_SECONDS = max(1, _env_int('PDF_RENDER_TIMEOUT_SECONDS', 120))
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_RENDER_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pdf_pool
+
+
+def _reset_pdf_pool(terminate: bool = False):
+    """Descarta el pool; con terminate=True además mata sus procesos (un hijo colgado no termina solo)."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            processes = list((getattr(_pdf_pool, '_processes', None) or {}).values()) if terminate else []
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            for proc in processes:
+                proc.terminate()
+        _pdf_pool = None
+
+
+def _pdf_snapshot(obj, fields):
+    """Copia serializable (picklable) de una fila ORM con los atributos que usan los renderers."""
+    if obj is None:
+        return None
+    return SimpleNamespace(**{name: getattr(obj, name) for name in fields})
+
+
+def _event_pdf_snapshot(event):
+    """Snapshot del evento con fecha y hora como texto (AAAA-MM-DD y HH:MM), como las usan los PDFs."""
+    snapshot = _pdf_snapshot(event, EVENT_PDF_FIELDS)
+    if snapshot is not None:
+        snapshot.date = _format_event_date(event.date)
+        snapshot.time = _format_event_time(event.time)
+    return snapshot
+
+
+def _iter_pdf_chunks(render_fn, items, *args):
+    """Divide items en bloques y va devolviendo el PDF (bytes) de cada bloque, en orden.
+
+    Con más de un bloque y PDF_RENDER_WORKERS > 1 los bloques se renderizan en el pool;
+    si el pool falla o un bloque tarda más de PDF_RENDER_TIMEOUT_SECONDS, los bloques que faltan
+    se renderizan en serie. render_fn debe ser una función de módulo y recibir objetos
+    serializables (ver _pdf_snapshot).
+    """
+    chunks = [items[i:i + PDF_RENDER_CHUNK_SIZE] for i in range(0, len(items), PDF_RENDER_CHUNK_SIZE)] or [[]]
+    futures = None
+    if PDF_RENDER_WORKERS > 1 and len(chunks) > 1:
+        try:
+            pool = _get_pdf_pool()
+            futures = [pool.submit(render_fn, chunk, *args) for chunk in chunks]
+        except Exception:
+            app.logger.exception('No se pudo usar el pool de PDF; se usa el render serial')
+            _reset_pdf_pool()
+            futures = None
+
+    for i, chunk in enumerate(chunks):
+        if futures is not None:
+            try:
+                yield futures[i].result(timeout=PDF_RENDER_TIMEOUT_SECONDS)
+                continue
+            except FutureTimeoutError:
+                app.logger.error('El render de PDF en paralelo no respondió; se usa el render serial')
+                _reset_pdf_pool(terminate=True)
+                futures = None
+            except Exception:
+                app.logger.exception('Falló el render de PDF en paralelo; se usa el render serial')
+                _reset_pdf_pool()
+                futures = None
+        yield render_fn(chunk, *args)
+
+
+def _write_concat_pdfs(pdfs, fh):
+    """Escribe en fh la concatenación de PDFs completos respetando el orden de las páginas."""
+    pdfs = iter(pdfs)
+    first = next(pdfs, None)
+    second = next(pdfs, None)
+    if second is None:
+        fh.write(first or b'')
+        return
+    writer = PdfWriter()
+    for pdf_bytes in chain([first, second], pdfs):
+        writer.append(PdfReader(BytesIO(pdf_bytes)))
+    writer.write(fh)
+
+
+# PDFs de respuesta: hasta PDF_SPOOL_MAX_MEMORY bytes en memoria, el resto en un archivo temporal
+PDF_SPOOL_MAX_MEMORY = _env_int('PDF_SPOOL_MAX_MEMORY', 2 * 1024 * 1024)
+
+
+def _send_pdf(write_fn, filename: str):
+    """Genera el PDF con write_fn(fh) en un archivo temporal y lo envía en bloques con Content-Length."""
+    spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_MEMORY)
+    try:
+        write_fn(spool)
+        size = spool.tell()
+        spool.seek(0)
+    except Exception:
+        spool.close()
+        raise
+    # send_file envuelve el archivo en un iterador por bloques y lo cierra al terminar la respuesta
+    response = send_file(spool, as_attachment=True, download_name=filename, mimetype='application/pdf')
+    response.content_length = size
+    return response
+
+
+# --- Cache de PDFs generados ---
+# Cada PDF se guarda en disco con el hash de todo lo que influye en su contenido; el mismo hash
+# es el ETag. PDF_CACHE_MAX_BYTES = 0 desactiva la cache en disco (el ETag se sigue enviando).
+# Subir PDF_RENDERER_VERSION cada vez que cambie el dibujo de alguna hoja.
+PDF_RENDERER_VERSION = 1
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR') or os.path.join(app.instance_path, 'pdf_cache')
+PDF_CACHE_MAX_BYTES = _env_int('PDF_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+
+_pdf_cache_lock = threading.Lock()
+
+
+def _pdf_cache_key(kind: str, parts: dict) -> str:
+    """Hash estable del tipo de PDF, la versión del renderer y los datos de entrada."""
+    payload = {'kind': kind, 'renderer': PDF_RENDERER_VERSION, **parts}
+    raw = json.dumps(
+        payload, sort_keys=True, ensure_ascii=False,
+        default=lambda obj: vars(obj) if isinstance(obj, SimpleNamespace) else str(obj),
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _pdf_cache_evict():
+    """Borra los PDFs usados hace más tiempo hasta quedar dentro de PDF_CACHE_MAX_BYTES."""
+    entries = []
+    total = 0
+    for entry in os.scandir(PDF_CACHE_DIR):
+        if not entry.name.endswith('.pdf'):
+            continue
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, entry.path))
+        total += st.st_size
+    entries.sort()
+    for _mtime, size, path in entries:
+        if total <= PDF_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _pdf_cache_store(key: str, write_fn):
+    """Renderiza el PDF dentro de la cache y lo devuelve abierto (o None si no se pudo usar el disco)."""
+    path = os.path.join(PDF_CACHE_DIR, f'{key}.pdf')
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        tmp = tempfile.NamedTemporaryFile(dir=PDF_CACHE_DIR, suffix='.tmp', delete=False)
+    except OSError:
+        app.logger.exception('No se pudo usar la cache de PDFs en %s', PDF_CACHE_DIR)
+        return None
+    try:
+        with tmp:
+            write_fn(tmp)
+        os.replace(tmp.name, path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    # Se abre antes de desalojar: el archivo sigue legible aunque otro proceso lo borre
+    fh = open(path, 'rb')
+    with _pdf_cache_lock:
+        _pdf_cache_evict()
+    return fh
+
+
+def _pdf_cache_path(key: str):
+    """Ruta del PDF cacheado con esa clave, o None si no está en disco (o la cache está desactivada)."""
+    if PDF_CACHE_MAX_BYTES <= 0:
+        return None
+    path = os.path.join(PDF_CACHE_DIR, f'{key}.pdf')
+    return path if os.path.exists(path) else None
+
+
+def _send_cached_pdf(kind: str, parts: dict, write_fn, filename: str, key: str = None):
+    """Responde un PDF desde la cache en disco (o lo genera y guarda), con ETag e If-None-Match."""
+    key = key or _pdf_cache_key(kind, parts)
+    if request.if_none_match.contains(key):
+        response = app.response_class(status=304)
+        response.set_etag(key)
+        return response
+
+    fh = None
+    if PDF_CACHE_MAX_BYTES > 0:
+        path = os.path.join(PDF_CACHE_DIR, f'{key}.pdf')
+        try:
+            fh = open(path, 'rb')
+        except OSError:
+            fh = _pdf_cache_store(key, write_fn)
+        else:
+            try:
+                # Marcar como usado recién (el LRU ordena por mtime)
+                os.utime(path)
+            except OSError:
+                pass
+
+    if fh is None:
+        response = _send_pdf(write_fn, filename)
+    else:
+        response = send_file(fh, as_attachment=True, download_name=filename, mimetype='application/pdf')
+        response.content_length = os.fstat(fh.fileno()).st_size
+    response.set_etag(key)
+    return response
+
+
+# --- Arte estático de las hojas PDF ---
+# Logos leídos y decodificados una vez por proceso: ruta -> (mtime, ImageReader o None)
+_pdf_logo_cache = {}
+# ReportLab relee el JPEG desde el buffer compartido del ImageReader: se dibuja con el lock tomado
+_pdf_logo_lock = threading.Lock()
+
+
+def _get_pdf_logo(filename: str):
+    """Devuelve el ImageReader cacheado de static/img/<filename>, o None si no existe o no se puede leer."""
+    path = os.path.join(app.static_folder, 'img', filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _pdf_logo_lock:
+        cached = _pdf_logo_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            logo = ImageReader(path)
+            # Los JPEG se incrustan tal cual; el resto se decodifica ahora y queda en memoria
+            if logo.jpeg_fh() is None:
+                logo.getRGBData()
+        except Exception:
+            app.logger.warning('No se pudo leer el logo %s', path)
+            logo = None
+        _pdf_logo_cache[path] = (mtime, logo)
+        return logo
+
+
+def _draw_pdf_logo(p, filename: str, x: float, y: float, size: float):
+    """Dibuja un logo cacheado; si no existe o falla, se omite silenciosamente."""
+    logo = _get_pdf_logo(filename)
+    if logo is None:
+        return
+    try:
+        with _pdf_logo_lock:
+            p.drawImage(logo, x, y, width=size, height=size, mask='auto')
+    except Exception:
+        pass
+
+
+def _define_pdf_form(p, name: str, draw_fn):
+    """Compila draw_fn(p) como form XObject del documento (una sola vez por canvas)."""
+    p.beginForm(name)
+    draw_fn(p)
+    p.endForm()
+
+
 # --- PDF generation for exam inscription ---
 @app.route('/api/exams/<int:event_id>/inscription-pdf', methods=['POST'])
-def generate_exam_fields_debug():
+def generate_exam_fields_debug(event_id: int):
     """Genera un PDF de inscripción para un examen almacenado en la BD."""
     # Buscar el evento en la base de datos
     event = Event.query.get(event_id)
@@ -1349,8 +3975,18 @@ def generate_exam_fields_debug():
     if student_id is not None:
         student = Student.query.get(student_id)
 
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
+    filename = f"inscripcion_examen_{event_id}.pdf"
+    event_snapshot = _event_pdf_snapshot(event)
+    return _send_pdf(lambda fh: _draw_inscription_pdf(fh, event_snapshot, student), filename)
+
+
+# Forms de la ficha de inscripción: fondo (antes del texto del alumno) y frente (después)
+INSCRIPTION_BACK_FORM = 'InscriptionBack'
+INSCRIPTION_FRONT_FORM = 'InscriptionFront'
+
+
+def _draw_inscription_back(p):
+    """Parte fija de la ficha que va debajo de los datos: fondo, marco y títulos."""
     width, height = A4
 
     # Fondo simple tipo "marcial"
@@ -1362,16 +3998,40 @@ def generate_exam_fields_debug():
     p.setFillColorRGB(1, 1, 1)
     p.rect(margin, margin, width - 2 * margin, height - 2 * margin, fill=0, stroke=1)
 
-    # Título
-    p.setFillColorRGB(1, 1, 1)
-    p.setFont('Helvetica-Bold', 24)
-    p.drawCentredString(width / 2, height - 80, 'ESCUELA DE TAEKWONDO - ARABIA TKD')
+    # Título
+    p.setFillColorRGB(1, 1, 1)
+    p.setFont('Helvetica-Bold', 24)
+    p.drawCentredString(width / 2, height - 80, 'ESCUELA DE TAEKWONDO - ARABIA TKD')
+
+    p.setFont('Helvetica', 14)
+    p.drawCentredString(width / 2, height - 110, 'Ficha de Inscripción a Examen')
+
+
+def _draw_inscription_front(p):
+    """Parte fija de la ficha que va encima de los datos: frase central y logo."""
+    width, height = A4
+
+    p.setFillColorRGB(1, 1, 1)
+    p.setFont('Helvetica-BoldOblique', 14)
+    p.drawCentredString(width / 2, height / 2, '\"No falten y no lleguen tarde...\" — Master VII DAN Fernando A. Monteros')
+
+    # Logo Arabia TKD (si existe el archivo en static/img/logo.jpg)
+    logo_size = 120
+    _draw_pdf_logo(p, 'logo.jpg', width / 2 - logo_size / 2, height - 320, logo_size)
+
 
-    p.setFont('Helvetica', 14)
-    p.drawCentredString(width / 2, height - 110, 'Ficha de Inscripción a Examen')
+def _draw_inscription_pdf(fh, event, student):
+    """Dibuja la ficha de inscripción en fh; solo los datos del examen y del alumno se escriben por pedido."""
+    p = canvas.Canvas(fh, pagesize=A4)
+    _define_pdf_form(p, INSCRIPTION_BACK_FORM, _draw_inscription_back)
+    _define_pdf_form(p, INSCRIPTION_FRONT_FORM, _draw_inscription_front)
+
+    width, height = A4
+    margin = 40
+    p.doForm(INSCRIPTION_BACK_FORM)
 
     y = height - 160
-    p.setFont('Helvetica', 11)
+    p.setFillColorRGB(1, 1, 1)
 
     label_font = 'Helvetica-Bold'
     value_font = 'Helvetica'
@@ -1412,49 +4072,29 @@ def generate_exam_fields_debug():
         for line in notes.split('\n'):
             p.drawString(margin + 40, y, line[:90])
             y -= 14
-        p.setFont(value_font, 11)
-
-    # Frase central
-    p.setFont('Helvetica-BoldOblique', 14)
-    p.drawCentredString(width / 2, height / 2, '\"No falten y no lleguen tarde...\" — Master VII DAN Fernando A. Monteros')
-
-    # Logo Arabia TKD (si existe el archivo en static/img/logo.jpg)
-    logo_path = os.path.join(app.static_folder, 'img', 'logo.jpg')
-    if os.path.exists(logo_path):
-      try:
-        logo = ImageReader(logo_path)
-        logo_width = 120
-        logo_height = 120
-        p.drawImage(logo, width / 2 - logo_width / 2, height - 320, width=logo_width, height=logo_height, mask='auto')
-      except Exception:
-        # Si no se puede leer el logo, se omite silenciosamente
-        pass
 
+    p.doForm(INSCRIPTION_FRONT_FORM)
     p.showPage()
     p.save()
 
-    buffer.seek(0)
-    filename = f"inscripcion_examen_{event_id}.pdf"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
-
-
-@app.route('/api/exams/<int:event_id>/evaluation-pdf', methods=['POST'])
-def generate_exam_evaluation_pdf(event_id: int):
-    """Genera un PDF de evaluación (solicitud de graduación) para un examen."""
 
-    event = Event.query.get(event_id)
-    if not event or event.type != 'exam':
-        return jsonify({'error': 'Examen no encontrado'}), 404
+# Forms de la hoja de evaluación: fondo (antes de los datos del alumno) y frente (logos)
+EVALUATION_BACK_FORM = 'EvaluationBack'
+EVALUATION_FRONT_FORM = 'EvaluationFront'
+# Geometría compartida entre la parte fija y los datos de cada alumno
+EVALUATION_MARGIN = 40
+EVALUATION_LABEL_X = EVALUATION_MARGIN + 10
+EVALUATION_VALUE_X = EVALUATION_MARGIN + 110
+EVALUATION_DATE_Y = A4[1] - 130
+EVALUATION_FIRST_ROW_Y = EVALUATION_DATE_Y - 25
+EVALUATION_ROW_SPACING = 18
 
-    data = request.json or {}
-    student_id = data.get('student_id')
-    student = Student.query.get(student_id) if student_id is not None else None
 
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
+def _draw_evaluation_back(p):
+    """Parte fija de la hoja de evaluación: marco, encabezados, rótulos, instructores y grilla."""
     width, height = A4
 
-    margin = 40
+    margin = EVALUATION_MARGIN
 
     # Fondo blanco
     p.setFillColorRGB(1, 1, 1)
@@ -1478,70 +4118,30 @@ def generate_exam_evaluation_pdf(event_id: int):
 
     p.setFont('Helvetica-Bold', 14)
     p.drawCentredString(width / 2, y, 'Solicitud de graduación')
-    y -= 25
 
-    # Fecha (ligeramente más hacia la izquierda)
+    # Rótulos de los datos del alumno (los valores se escriben por página)
+    x1 = EVALUATION_LABEL_X
+    x2 = EVALUATION_VALUE_X
+    y = EVALUATION_FIRST_ROW_Y
     p.setFont('Helvetica', 10)
-    p.drawRightString(width - margin - 20, y, f"Fecha: {event.date or ''}")
-    y -= 25
-
-    def draw_label_value(label, value, x_label, x_value):
-        p.setFont('Helvetica', 10)
-        p.drawString(x_label, y, label)
-        p.drawString(x_value, y, value or '')
-
-    # Datos del alumno
-    full_name = ''
-    birth_str = ''
-    age_str = ''
-    gender = ''
-    address = ''
-    phone = ''
-    nationality = ''
-    dni = ''
-
-    if student:
-        full_name = student.full_name or ''
-        gender = student.gender or ''
-        dni = student.dni or ''
-        nationality = student.nationality or ''
-        address_parts = [student.address, student.city, student.province, student.country]
-        address = ' - '.join([p_ for p_ in address_parts if p_])
-        phone = student.father_phone or student.mother_phone or ''
-
-        if student.birthdate:
-            birth_str = student.birthdate.strftime('%d/%m/%Y')
-            today = date.today()
-            age = today.year - student.birthdate.year - (
-                (today.month, today.day) < (student.birthdate.month, student.birthdate.day)
-            )
-            age_str = str(age)
-
-    x1 = margin + 10
-    # Columna principal de valores (ligeramente más a la izquierda)
-    x2 = margin + 110
-
-    draw_label_value('Apellido y Nombre:', full_name, x1, x2)
-    y -= 18
-    draw_label_value('Fecha de Nacimiento:', birth_str, x1, x2)
-    # Bloque derecho más hacia adentro para evitar desfasaje
-    p.drawString(x2 + 80, y, 'Edad: ' + (age_str or ''))
-    p.drawString(x2 + 160, y, 'Sexo: ' + (gender or ''))
-    y -= 18
-
-    draw_label_value('Domicilio:', address, x1, x2)
-    y -= 18
-    draw_label_value('Teléfono:', phone, x1, x2)
-    p.drawString(x2 + 130, y, 'Nacionalidad: ' + (nationality or ''))
-    p.drawString(x2 + 250, y, 'D.N.I: ' + (dni or ''))
-    y -= 18
-
-    draw_label_value('Ocupación:', '', x1, x2)
+    p.drawString(x1, y, 'Apellido y Nombre:')
+    y -= EVALUATION_ROW_SPACING
+    p.drawString(x1, y, 'Fecha de Nacimiento:')
+    p.drawString(x2 + 80, y, 'Edad: ')
+    p.drawString(x2 + 160, y, 'Sexo: ')
+    y -= EVALUATION_ROW_SPACING
+    p.drawString(x1, y, 'Domicilio:')
+    y -= EVALUATION_ROW_SPACING
+    p.drawString(x1, y, 'Teléfono:')
+    p.drawString(x2 + 130, y, 'Nacionalidad: ')
+    p.drawString(x2 + 250, y, 'D.N.I: ')
+    y -= EVALUATION_ROW_SPACING
+
+    p.drawString(x1, y, 'Ocupación:')
     p.drawString(x2 + 250, y, 'Estado civil:')
     y -= 22
 
     # Datos de graduación (fila más compacta para que entren las tres etiquetas)
-    p.setFont('Helvetica', 10)
     p.drawString(x1, y, 'Solicita Grad.:')
     # Pequeña línea para completar
     p.drawString(x1 + 90, y, '________________')
@@ -1549,7 +4149,8 @@ def generate_exam_evaluation_pdf(event_id: int):
     p.drawString(x1 + 360, y, 'Tiempo de práctica:')
     y -= 18
 
-    draw_label_value('Escuela base:', 'INSTITUTO MONTEROS DE TAEKWONDO', x1, x2)
+    p.drawString(x1, y, 'Escuela base:')
+    p.drawString(x2, y, 'INSTITUTO MONTEROS DE TAEKWONDO')
     y -= 28
 
     # Instructores
@@ -1613,258 +4214,454 @@ def generate_exam_evaluation_pdf(event_id: int):
     p.setFont('Helvetica-Oblique', 10)
     p.drawCentredString(width / 2, margin + 20, '"No falten y no lleguen tarde…" - Master VII DAN Fernando A. Monteros')
 
-    # Logos (si existen)
-    logo_arabia_path = os.path.join(app.static_folder, 'img', 'logo.jpg')
-    if os.path.exists(logo_arabia_path):
-        try:
-            logo = ImageReader(logo_arabia_path)
-            # Esquina superior derecha dentro del marco
-            logo_width = 80
-            logo_height = 80
-            p.drawImage(logo, width - margin - logo_width, height - margin - logo_height, width=logo_width, height=logo_height, mask='auto')
-        except Exception:
-            pass
-    logo_monteros_path = os.path.join(app.static_folder, 'img', 'logo_monteros.png')
-    if os.path.exists(logo_monteros_path):
-        try:
-            logo2 = ImageReader(logo_monteros_path)
-            p.drawImage(logo2, width - margin - 90, height - 170, width=80, height=80, mask='auto')
-        except Exception:
-            pass
 
+def _draw_evaluation_front(p):
+    """Logos de la hoja de evaluación (si existen), por encima de los datos."""
+    width, height = A4
+    margin = EVALUATION_MARGIN
+    # Esquina superior derecha dentro del marco
+    _draw_pdf_logo(p, 'logo.jpg', width - margin - 80, height - margin - 80, 80)
+    _draw_pdf_logo(p, 'logo_monteros.png', width - margin - 90, height - 170, 80)
+
+
+def _define_evaluation_forms(p):
+    """Compila las partes fijas de la hoja de evaluación en el documento de p."""
+    _define_pdf_form(p, EVALUATION_BACK_FORM, _draw_evaluation_back)
+    _define_pdf_form(p, EVALUATION_FRONT_FORM, _draw_evaluation_front)
+
+
+def _draw_evaluation_page(p, student, event):
+    """Dibuja la hoja de evaluación de un alumno (o en blanco si student es None) y cierra la página.
+
+    Requiere que las forms de _define_evaluation_forms ya estén definidas en el canvas.
+    """
+    width, height = A4
+    p.doForm(EVALUATION_BACK_FORM)
+
+    p.setFillColorRGB(0.1, 0.1, 0.1)
+    p.setFont('Helvetica', 10)
+    # Fecha (ligeramente más hacia la izquierda)
+    p.drawRightString(width - EVALUATION_MARGIN - 20, EVALUATION_DATE_Y, f"Fecha: {event.date or ''}")
+
+    if student:
+        birth_str = ''
+        age_str = ''
+        address_parts = [student.address, student.city, student.province, student.country]
+        address = ' - '.join([p_ for p_ in address_parts if p_])
+        phone = student.father_phone or student.mother_phone or ''
+
+        if student.birthdate:
+            birth_str = student.birthdate.strftime('%d/%m/%Y')
+            today = date.today()
+            age = today.year - student.birthdate.year - (
+                (today.month, today.day) < (student.birthdate.month, student.birthdate.day)
+            )
+            age_str = str(age)
+
+        def draw_after(label, x, value):
+            # El rótulo ya está en la form; el valor va justo a continuación
+            if value:
+                p.drawString(x + p.stringWidth(label, 'Helvetica', 10), y, value)
+
+        x2 = EVALUATION_VALUE_X
+        y = EVALUATION_FIRST_ROW_Y
+        p.drawString(x2, y, student.full_name or '')
+        y -= EVALUATION_ROW_SPACING
+        p.drawString(x2, y, birth_str)
+        draw_after('Edad: ', x2 + 80, age_str)
+        draw_after('Sexo: ', x2 + 160, student.gender or '')
+        y -= EVALUATION_ROW_SPACING
+        p.drawString(x2, y, address)
+        y -= EVALUATION_ROW_SPACING
+        p.drawString(x2, y, phone)
+        draw_after('Nacionalidad: ', x2 + 130, student.nationality or '')
+        draw_after('D.N.I: ', x2 + 250, student.dni or '')
+
+    p.doForm(EVALUATION_FRONT_FORM)
     p.showPage()
+
+
+def _render_evaluation_pdf(students, event):
+    """Genera un PDF con una hoja de evaluación por alumno, en el orden recibido."""
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    _define_evaluation_forms(p)
+    for student in students:
+        _draw_evaluation_page(p, student, event)
     p.save()
+    return buffer.getvalue()
 
-    buffer.seek(0)
-    filename = f"evaluacion_examen_{event_id}.pdf"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
 
+def _pdf_logo_stamp():
+    """mtime de los logos usados en las hojas, para invalidar la cache de PDFs si cambian."""
+    stamp = {}
+    for filename in ('logo.jpg', 'logo_monteros.png'):
+        try:
+            stamp[filename] = os.path.getmtime(os.path.join(app.static_folder, 'img', filename))
+        except OSError:
+            stamp[filename] = None
+    return stamp
+
+
+def _send_evaluation_pdf(students, event, filename: str):
+    """Responde (desde la cache si es posible) el PDF de evaluación de los snapshots dados."""
+    parts = {
+        'event': event,
+        'students': students,
+        'artwork': _pdf_logo_stamp(),
+        # La edad del alumno se calcula con la fecha del día
+        'today': date.today().isoformat(),
+    }
+
+    def write(fh):
+        chunks = _iter_pdf_chunks(_render_evaluation_pdf, students, event)
+        _write_concat_pdfs(chunks, fh)
 
-@app.route('/api/exams/<int:event_id>/rinde-pdf', methods=['POST'])
-def generate_exam_rinde_pdf(event_id: int):
-    """Genera un PDF de rendida multi-hoja usando el PDF base de Taekwondo.
+    return _send_cached_pdf('evaluation', parts, write, filename)
 
-    Cada alumno va en una página distinta, partiendo de la primera página del
-    archivo 'src/PDF TAEKWONDO - ultima edición.pdf'.
-    """
+
+@app.route('/api/exams/<int:event_id>/evaluation-pdf', methods=['POST'])
+def generate_exam_evaluation_pdf(event_id: int):
+    """Genera un PDF de evaluación (solicitud de graduación) para un examen."""
 
     event = Event.query.get(event_id)
     if not event or event.type != 'exam':
         return jsonify({'error': 'Examen no encontrado'}), 404
 
     data = request.json or {}
-    raw_ids = data.get('student_ids') or []
+    student_id = data.get('student_id')
+    student = Student.query.get(student_id) if student_id is not None else None
+
+    students = [_pdf_snapshot(student, STUDENT_FIELDS)] if student else [None]
+    filename = f"evaluacion_examen_{event_id}.pdf"
+    return _send_evaluation_pdf(students, _event_pdf_snapshot(event), filename)
+
+
+@app.route('/api/exams/<int:event_id>/evaluation-batch-pdf', methods=['POST'])
+def generate_exam_evaluation_batch_pdf(event_id: int):
+    """Genera un único PDF con la hoja de evaluación de cada alumno del examen.
+
+    Usa los student_ids recibidos o, si no se envían, los alumnos inscriptos al examen.
+    Las hojas salen en el mismo orden que el PDF de rendida (Apellido, Nombre).
+    """
+    event = Event.query.get(event_id)
+    if not event or event.type != 'exam':
+        return jsonify({'error': 'Examen no encontrado'}), 404
+
+    data = request.get_json(silent=True) or {}
+    if data.get('student_ids') is not None:
+        student_ids = _parse_student_ids(data.get('student_ids'))
+        if not student_ids:
+            return jsonify({'error': 'No se recibieron alumnos para el examen'}), 400
+        query = Student.query.filter(Student.id.in_(student_ids))
+    else:
+        roster = select(ExamInscription.student_id).where(ExamInscription.event_id == event_id)
+        query = Student.query.filter(Student.id.in_(roster))
+
+    students = query.all()
+    if not students:
+        return jsonify({'error': 'Alumnos no encontrados'}), 404
+    students.sort(key=_student_sort_key)
 
-    # Normalizar a enteros válidos
+    snapshots = [_pdf_snapshot(st, STUDENT_FIELDS) for st in students]
+    filename = f"evaluaciones_examen_{event_id}.pdf"
+    return _send_evaluation_pdf(snapshots, _event_pdf_snapshot(event), filename)
+
+
+# Progresión de cinturones, Gup y Graduación (igual que en el frontend)
+BELT_PROGRESS = [
+    {"belt": "Blanco", "gup": "10º Gup", "graduation": "Primera"},
+    {"belt": "Blanco Punta Amarilla", "gup": "9º Gup", "graduation": "Segunda"},
+    {"belt": "Amarillo", "gup": "8º Gup", "graduation": "Tercera"},
+    {"belt": "Amarillo Punta Verde", "gup": "7º Gup", "graduation": "Cuarta"},
+    {"belt": "Verde", "gup": "6º Gup", "graduation": "Quinta"},
+    {"belt": "Verde Punta Azul", "gup": "5º Gup", "graduation": "Sexta"},
+    {"belt": "Azul", "gup": "4º Gup", "graduation": "Séptima"},
+    {"belt": "Azul Punta Roja", "gup": "3º Gup", "graduation": "Octava"},
+    {"belt": "Rojo", "gup": "2º Gup", "graduation": "Novena"},
+    {"belt": "Rojo Punta Negra", "gup": "1º Gup", "graduation": "Décima"},
+    {"belt": "Negro Primer Dan", "gup": "", "graduation": "Primer Dan"},
+    {"belt": "Segundo Dan", "gup": "", "graduation": "Segundo Dan"},
+]
+
+# Nombre del recurso con el que cada página dibuja la plantilla compartida
+EXAM_TEMPLATE_XOBJECT = '/ArabiaTemplate'
+
+
+def _get_belt_infos(current_belt: str):
+    """Devuelve (info_actual, info_siguiente) según la progresión de cinturones."""
+    if not current_belt:
+        return None, None
+    current = current_belt.strip().lower()
+    idx = next((i for i, b in enumerate(BELT_PROGRESS) if b["belt"].lower() == current), -1)
+    if idx == -1:
+        return None, None
+    current_info = BELT_PROGRESS[idx]
+    next_info = BELT_PROGRESS[idx + 1] if idx < len(BELT_PROGRESS) - 1 else None
+    return current_info, next_info
+
+
+def _student_sort_key(st):
+    """Orden alfabético por Apellido, Nombre (o full_name como fallback)."""
+    ln = (st.last_name or '').strip().lower()
+    fn = (st.first_name or '').strip().lower()
+    full = (st.full_name or '').strip().lower()
+    # Si no hay last/first, usamos full_name
+    if ln or fn:
+        return (ln, fn)
+    return (full or '', '')
+
+
+def _parse_student_ids(raw_ids):
+    """Normaliza una lista de ids de alumnos a enteros válidos, descartando el resto."""
     student_ids = []
-    for raw in raw_ids:
+    for raw in raw_ids or []:
         try:
             student_ids.append(int(raw))
         except (TypeError, ValueError):
             continue
+    return student_ids
+
+
+def _flate_stream(data: bytes, entries=None):
+    """Crea un stream comprimido con las claves indicadas (flate_encode no conserva el diccionario)."""
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    encoded = stream.flate_encode()
+    if entries:
+        encoded.update(entries)
+    return encoded
+
+
+def _add_template_xobject(writer, template):
+    """Agrega al writer la página de la plantilla como Form XObject (una sola vez por documento)."""
+    page = template['page']
+    contents = page.get_contents()
+    entries = {
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/FormType'): NumberObject(1),
+        NameObject('/BBox'): ArrayObject(list(page.mediabox)),
+        NameObject('/Resources'): page['/Resources'].get_object().clone(writer),
+    }
+    if '/Group' in page:
+        entries[NameObject('/Group')] = page['/Group'].get_object().clone(writer)
+    form = _flate_stream(contents.get_data() if contents is not None else b'', entries)
+    return writer._add_object(form)
 
-    if not student_ids:
-        return jsonify({'error': 'No se recibieron alumnos para el examen'}), 400
 
-    students = Student.query.filter(Student.id.in_(student_ids)).all()
-    if not students:
-        return jsonify({'error': 'Alumnos no encontrados'}), 404
+def _stamp_template_pages(writer, template, overlay_pdf: bytes, template_ref=None):
+    """Agrega una página por cada página del overlay, dibujando la plantilla compartida debajo.
 
-    # Ordenar alumnos alfabéticamente por Apellido, Nombre (o full_name como fallback)
-    def _student_sort_key(st: Student):
-        ln = (st.last_name or '').strip().lower()
-        fn = (st.first_name or '').strip().lower()
-        full = (st.full_name or '').strip().lower()
-        # Si no hay last/first, usamos full_name
-        if ln or fn:
-            return (ln, fn)
-        return (full or '', '')
+    El overlay se parsea una sola vez y todas las páginas referencian el mismo XObject de la
+    plantilla, así su contenido e imágenes se escriben una única vez en el PDF final.
+    Devuelve la referencia del XObject para reutilizarla en llamadas siguientes.
+    """
+    if template_ref is None:
+        template_ref = _add_template_xobject(writer, template)
+    overlay_reader = PdfReader(BytesIO(overlay_pdf))
+    for overlay_page in overlay_reader.pages:
+        overlay_contents = overlay_page.get_contents()
+        overlay_data = overlay_contents.get_data() if overlay_contents is not None else b''
+
+        resources = DictionaryObject()
+        if '/Resources' in overlay_page:
+            resources = overlay_page['/Resources'].get_object().clone(writer)
+        xobjects = resources.get('/XObject')
+        xobjects = xobjects.get_object() if xobjects is not None else DictionaryObject()
+        xobjects[NameObject(EXAM_TEMPLATE_XOBJECT)] = template_ref
+        resources[NameObject('/XObject')] = xobjects
+
+        content = _flate_stream(b'q ' + EXAM_TEMPLATE_XOBJECT.encode('ascii') + b' Do Q\n' + overlay_data)
+
+        page = PageObject.create_blank_page(width=template['width'], height=template['height'])
+        page[NameObject('/Resources')] = resources
+        page[NameObject('/Contents')] = writer._add_object(content)
+        writer.add_page(page)
+    return template_ref
+
+
+def _draw_rinde_page(c, student, event, page_width: float, page_height: float):
+    """Dibuja en el canvas los datos variables de un alumno y cierra la página."""
+    # Datos del alumno
+    if student.last_name or student.first_name:
+        # Formato "Apellido, Nombre" cuando hay ambos
+        if student.last_name and student.first_name:
+            full_name = f"{student.last_name}, {student.first_name}"
+        else:
+            full_name = (student.last_name or student.first_name) or ''
+    else:
+        full_name = student.full_name or ''
+    dni = student.dni or ''
+    gender = (student.gender or '').upper()
+    belt_current = (student.belt or '').strip()
+    current_info, next_info = _get_belt_infos(belt_current)
+    belt_next = next_info["belt"] if next_info else ''
+    gup_current = current_info["gup"] if current_info else ''
+    gup_next = next_info["gup"] if next_info else ''
+
+    # Fecha de nacimiento y edad (en años y meses)
+    birth_str = ''
+    age_str = ''
+    if student.birthdate:
+        birth_str = student.birthdate.strftime('%d/%m/%Y')
+        try:
+            exam_date = datetime.strptime(event.date, '%Y-%m-%d').date() if event.date else date.today()
+        except ValueError:
+            exam_date = date.today()
 
-    students.sort(key=_student_sort_key)
+        years = exam_date.year - student.birthdate.year
+        months = exam_date.month - student.birthdate.month
+        days = exam_date.day - student.birthdate.day
 
-    # Progresión de cinturones, Gup y Graduación (igual que en el frontend)
-    belt_progress = [
-        {"belt": "Blanco", "gup": "10º Gup", "graduation": "Primera"},
-        {"belt": "Blanco Punta Amarilla", "gup": "9º Gup", "graduation": "Segunda"},
-        {"belt": "Amarillo", "gup": "8º Gup", "graduation": "Tercera"},
-        {"belt": "Amarillo Punta Verde", "gup": "7º Gup", "graduation": "Cuarta"},
-        {"belt": "Verde", "gup": "6º Gup", "graduation": "Quinta"},
-        {"belt": "Verde Punta Azul", "gup": "5º Gup", "graduation": "Sexta"},
-        {"belt": "Azul", "gup": "4º Gup", "graduation": "Séptima"},
-        {"belt": "Azul Punta Roja", "gup": "3º Gup", "graduation": "Octava"},
-        {"belt": "Rojo", "gup": "2º Gup", "graduation": "Novena"},
-        {"belt": "Rojo Punta Negra", "gup": "1º Gup", "graduation": "Décima"},
-        {"belt": "Negro Primer Dan", "gup": "", "graduation": "Primer Dan"},
-        {"belt": "Segundo Dan", "gup": "", "graduation": "Segundo Dan"},
-    ]
+        # Ajuste por días: si los días son negativos, restamos un mes
+        if days < 0:
+            months -= 1
 
-    def get_belt_infos(current_belt: str):
-        """Devuelve (info_actual, info_siguiente) según la progresión de cinturones."""
-        if not current_belt:
-            return None, None
-        current = current_belt.strip().lower()
-        idx = next((i for i, b in enumerate(belt_progress) if b["belt"].lower() == current), -1)
-        if idx == -1:
-            return None, None
-        current_info = belt_progress[idx]
-        next_info = belt_progress[idx + 1] if idx < len(belt_progress) - 1 else None
-        return current_info, next_info
-
-    # Cargar PDF base
-    template_path = os.path.join('src', 'PDF TAEKWONDO - ultima edición.pdf')
-    if not os.path.exists(template_path):
-        return jsonify({'error': 'PDF base no encontrado en src'}), 500
-
-    reader = PdfReader(template_path)
-    if not reader.pages:
-        return jsonify({'error': 'PDF base sin páginas'}), 500
+        # Ajuste por meses negativos
+        if months < 0:
+            years -= 1
+            months += 12
 
-    template_page = reader.pages[0]
-    page_width = float(template_page.mediabox.width)
-    page_height = float(template_page.mediabox.height)
+        if years < 0:
+            years = 0
+        if months < 0:
+            months = 0
 
-    writer = PdfWriter()
+        age_str = f"{years} años y {months} meses"
 
+    # Fecha de examen en formato DD/MM/AAAA si es posible
+    fecha_examen = ''
+    if event.date:
+        try:
+            _exam_dt = datetime.strptime(event.date, '%Y-%m-%d').date()
+            fecha_examen = _exam_dt.strftime('%d/%m/%Y')
+        except ValueError:
+            fecha_examen = event.date
+
+    # Coordinadas base (similares a las del PDF de debug)
+    # x_left ligeramente más a la derecha para ajustar el nombre
+    x_left = page_width * 0.265
+    # Columna derecha superior (Fecha/DNI/Edad) más a la derecha
+    x_right_top = page_width * 0.78
+    # Columna derecha media en una posición fija razonable
+    x_right_mid = page_width * 0.52
+
+    # y_start_left un poco más arriba para terminar de ajustar la altura del nombre
+    y_start_left = page_height - 146
+    # Columna derecha superior aún más arriba para la Fecha de examen
+    y_start_right_top = page_height - 160
+    # Columna derecha media más arriba
+    y_start_right_mid = page_height - 200
+    step = 14
+
+    # Solo datos variables, sin modificar el título original del formulario
+    c.setFont('Helvetica', 9)
+
+    # Columna izquierda (Nombre, Sexo, Cinturón actual, GUP actual)
+    y = y_start_left
+    c.drawString(x_left, y, full_name or '')         # Apellido y Nombre
+    y -= step
+    # Sexo un poquito más a la izquierda y apenas más arriba
+    c.drawString(x_left - 65, y - 1, gender or '')   # Sexo
+    y -= step
+    # Cinturón actual un poquito más a la izquierda y un poquito más abajo
+    c.drawString(x_left - 14, y - 1, belt_current or '')  # Cinturón actual
+    y -= step
+    # GUP actual un poquito más a la izquierda y un poquito más abajo
+    c.drawString(x_left - 34, y - 2, gup_current or '')  # GUP actual
+
+    # Columna derecha superior (Fecha examen, DNI, Edad)
+    y_rt = y_start_right_top
+    # Fecha de examen un poquito más arriba y un poco más a la izquierda
+    c.drawString(x_right_top - 15, y_rt + 44, fecha_examen or '')  # Fecha examen
+    y_rt -= step
+    # DNI alineado en X con la Fecha de examen, apenas más arriba y un poco más a la izquierda
+    c.drawString(x_right_top - 17, y_rt + 27, dni or '')           # DNI
+    y_rt -= step
+    # Edad alineada en X con DNI, un poquito más abajo y un poquito más a la izquierda
+    c.drawString(x_right_top - 18, y_rt + 27, age_str or '')       # Edad
+
+    # Columna derecha media (Fecha nacimiento, Cinturón que rinde, GUP que rinde)
+    y_rm = y_start_right_mid
+    # Subimos Fecha de nacimiento para que esté a la altura aproximada de Sexo
+    # y la movemos muy ligeramente más hacia la izquierda (ajuste muy fino)
+    c.drawString(x_right_mid + 31, y_rm + 39, birth_str or '')     # Fecha nacimiento
+    y_rm -= step
+    # Cinturón que rinde (Solicita cinturón) bastante más a la izquierda dentro de la columna
+    c.drawString(x_right_mid + 10, y_rm + 38, belt_next or '')     # Cinturón que rinde
+    y_rm -= step
+    # GUP que rinde (Solicita GUP) medio punto más arriba y un poquito a la izquierda
+    c.drawString(x_right_mid - 5, y_rm + 38, gup_next or '') # GUP que rinde
+
+    c.showPage()
+
+
+def _render_rinde_overlay(students, event, page_width: float, page_height: float):
+    """Dibuja todos los alumnos en un único documento ReportLab (una página por alumno)."""
+    overlay_buf = BytesIO()
+    c = canvas.Canvas(overlay_buf, pagesize=(page_width, page_height))
     for student in students:
-        # Datos del alumno
-        if student.last_name or student.first_name:
-            # Formato "Apellido, Nombre" cuando hay ambos
-            if student.last_name and student.first_name:
-                full_name = f"{student.last_name}, {student.first_name}"
-            else:
-                full_name = (student.last_name or student.first_name) or ''
-        else:
-            full_name = student.full_name or ''
-        dni = student.dni or ''
-        gender = (student.gender or '').upper()
-        belt_current = (student.belt or '').strip()
-        current_info, next_info = get_belt_infos(belt_current)
-        belt_next = next_info["belt"] if next_info else ''
-        gup_current = current_info["gup"] if current_info else ''
-        gup_next = next_info["gup"] if next_info else ''
-
-        # Fecha de nacimiento y edad (en años y meses)
-        birth_str = ''
-        age_str = ''
-        if student.birthdate:
-            birth_str = student.birthdate.strftime('%d/%m/%Y')
-            try:
-                exam_date = datetime.strptime(event.date, '%Y-%m-%d').date() if event.date else date.today()
-            except ValueError:
-                exam_date = date.today()
+        _draw_rinde_page(c, student, event, page_width, page_height)
+    c.save()
+    return overlay_buf.getvalue()
+
+
+@app.route('/api/exams/<int:event_id>/rinde-pdf', methods=['POST'])
+def generate_exam_rinde_pdf(event_id: int):
+    """Genera un PDF de rendida multi-hoja usando el PDF base de Taekwondo.
+
+    Cada alumno va en una página distinta, partiendo de la primera página del
+    archivo 'src/PDF TAEKWONDO - ultima edición.pdf'.
+    """
+
+    event = Event.query.get(event_id)
+    if not event or event.type != 'exam':
+        return jsonify({'error': 'Examen no encontrado'}), 404
+
+    data = request.json or {}
+    student_ids = _parse_student_ids(data.get('student_ids'))
 
-            years = exam_date.year - student.birthdate.year
-            months = exam_date.month - student.birthdate.month
-            days = exam_date.day - student.birthdate.day
+    if not student_ids:
+        return jsonify({'error': 'No se recibieron alumnos para el examen'}), 400
 
-            # Ajuste por días: si los días son negativos, restamos un mes
-            if days < 0:
-                months -= 1
+    students = Student.query.filter(Student.id.in_(student_ids)).all()
+    if not students:
+        return jsonify({'error': 'Alumnos no encontrados'}), 404
 
-            # Ajuste por meses negativos
-            if months < 0:
-                years -= 1
-                months += 12
+    # Ordenar alumnos alfabéticamente por Apellido, Nombre (o full_name como fallback)
+    students.sort(key=_student_sort_key)
 
-            if years < 0:
-                years = 0
-            if months < 0:
-                months = 0
+    # Cargar PDF base (cacheado por proceso)
+    template, template_error = _get_exam_template()
+    if template is None:
+        return jsonify({'error': template_error}), 500
 
-            age_str = f"{years} años y {months} meses"
+    snapshots = [_pdf_snapshot(st, STUDENT_FIELDS) for st in students]
+    event_snapshot = _event_pdf_snapshot(event)
 
-        # Fecha de examen en formato DD/MM/AAAA si es posible
-        fecha_examen = ''
-        if event.date:
-            try:
-                _exam_dt = datetime.strptime(event.date, '%Y-%m-%d').date()
-                fecha_examen = _exam_dt.strftime('%d/%m/%Y')
-            except ValueError:
-                fecha_examen = event.date
-
-        # Coordinadas base (similares a las del PDF de debug)
-        # x_left ligeramente más a la derecha para ajustar el nombre
-        x_left = page_width * 0.265
-        # Columna derecha superior (Fecha/DNI/Edad) más a la derecha
-        x_right_top = page_width * 0.78
-        # Columna derecha media en una posición fija razonable
-        x_right_mid = page_width * 0.52
-
-        # y_start_left un poco más arriba para terminar de ajustar la altura del nombre
-        y_start_left = page_height - 146
-        # Columna derecha superior aún más arriba para la Fecha de examen
-        y_start_right_top = page_height - 160
-        # Columna derecha media más arriba
-        y_start_right_mid = page_height - 200
-        step = 14
-
-        # Crear overlay con ReportLab (solo datos variables, sin modificar el título original del formulario)
-        overlay_buf = BytesIO()
-        c = canvas.Canvas(overlay_buf, pagesize=(page_width, page_height))
-        c.setFont('Helvetica', 9)
-
-        # Columna izquierda (Nombre, Sexo, Cinturón actual, GUP actual)
-        y = y_start_left
-        c.drawString(x_left, y, full_name or '')         # Apellido y Nombre
-        y -= step
-        # Sexo un poquito más a la izquierda y apenas más arriba
-        c.drawString(x_left - 65, y - 1, gender or '')   # Sexo
-        y -= step
-        # Cinturón actual un poquito más a la izquierda y un poquito más abajo
-        c.drawString(x_left - 14, y - 1, belt_current or '')  # Cinturón actual
-        y -= step
-        # GUP actual un poquito más a la izquierda y un poquito más abajo
-        c.drawString(x_left - 34, y - 2, gup_current or '')  # GUP actual
-
-        # Columna derecha superior (Fecha examen, DNI, Edad)
-        y_rt = y_start_right_top
-        # Fecha de examen un poquito más arriba y un poco más a la izquierda
-        c.drawString(x_right_top - 15, y_rt + 44, fecha_examen or '')  # Fecha examen
-        y_rt -= step
-        # DNI alineado en X con la Fecha de examen, apenas más arriba y un poco más a la izquierda
-        c.drawString(x_right_top - 17, y_rt + 27, dni or '')           # DNI
-        y_rt -= step
-        # Edad alineada en X con DNI, un poquito más abajo y un poquito más a la izquierda
-        c.drawString(x_right_top - 18, y_rt + 27, age_str or '')       # Edad
-
-        # Columna derecha media (Fecha nacimiento, Cinturón que rinde, GUP que rinde)
-        y_rm = y_start_right_mid
-        # Subimos Fecha de nacimiento para que esté a la altura aproximada de Sexo
-        # y la movemos muy ligeramente más hacia la izquierda (ajuste muy fino)
-        c.drawString(x_right_mid + 31, y_rm + 39, birth_str or '')     # Fecha nacimiento
-        y_rm -= step
-        # Cinturón que rinde (Solicita cinturón) bastante más a la izquierda dentro de la columna
-        c.drawString(x_right_mid + 10, y_rm + 38, belt_next or '')     # Cinturón que rinde
-        y_rm -= step
-        # GUP que rinde (Solicita GUP) medio punto más arriba y un poquito a la izquierda
-        c.drawString(x_right_mid - 5, y_rm + 38, gup_next or '') # GUP que rinde
-
-        c.showPage()
-        c.save()
-
-        overlay_buf.seek(0)
-        overlay_reader = PdfReader(overlay_buf)
-        overlay_page = overlay_reader.pages[0]
-
-        merged_page = PageObject.create_blank_page(
-            width=template_page.mediabox.width,
-            height=template_page.mediabox.height,
+    def write(fh, progress=None):
+        # Overlays multi-página (uno por bloque de alumnos), estampados en orden sobre la plantilla compartida
+        # (cada bloque se estampa y se descarta antes de recibir el siguiente)
+        overlays = _iter_pdf_chunks(
+            _render_rinde_overlay, snapshots, event_snapshot, template['width'], template['height'],
         )
-        merged_page.merge_page(template_page)
-        merged_page.merge_page(overlay_page)
-        writer.add_page(merged_page)
-
-    out_buffer = BytesIO()
-    writer.write(out_buffer)
-    out_buffer.seek(0)
+        total_chunks = -(-len(snapshots) // PDF_RENDER_CHUNK_SIZE)
+        writer = PdfWriter()
+        template_ref = None
+        for done, overlay_pdf in enumerate(overlays, start=1):
+            template_ref = _stamp_template_pages(writer, template, overlay_pdf, template_ref)
+            if progress is not None:
+                progress(done / total_chunks)
+        writer.write(fh)
 
     # Usar la fecha del examen en el nombre del archivo como DD-MM-AAAA (sin barras, para que sea válido)
-    if event.date:
+    if event_snapshot.date:
         try:
-            _exam_dt = datetime.strptime(event.date, '%Y-%m-%d').date()
+            _exam_dt = datetime.strptime(event_snapshot.date, '%Y-%m-%d').date()
             date_for_name = _exam_dt.strftime('%d-%m-%Y')
         except ValueError:
-            date_for_name = event.date.replace('/', '-').replace(' ', '_')
+            date_for_name = event_snapshot.date.replace('/', '-').replace(' ', '_')
     else:
         date_for_name = 'sin_fecha'
 
@@ -1877,7 +4674,19 @@ def generate_exam_rinde_pdf(event_id: int):
     filename = f"Examen_{place_slug}_{date_for_name}.pdf"
     # Debug: ver en consola qué nombre de archivo está usando realmente el backend
     print(f"[generate_exam_rinde_pdf] filename= {filename}")
-    return send_file(out_buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
+    # La edad se calcula a la fecha del examen (o del día, si el examen no tiene fecha válida)
+    parts = {
+        'event': event_snapshot,
+        'students': snapshots,
+        'template': template['sha256'],
+        'today': date.today().isoformat(),
+    }
+    key = _pdf_cache_key('rinde', parts)
+    # Con async=1 solo se encola si el PDF no está ya en la cache (o el cliente ya lo tiene)
+    if _wants_async() and not request.if_none_match.contains(key) and _pdf_cache_path(key) is None:
+        params = {'event_id': event_id, 'student_ids': [st.id for st in snapshots]}
+        return _submit_job('rinde_pdf', params, lambda job_id: _job_write_cached_pdf(job_id, key, write, filename))
+    return _send_cached_pdf('rinde', parts, write, filename, key=key)
 
 
 @app.route('/api/exams/template-debug-pdf', methods=['GET'])
@@ -1888,20 +4697,14 @@ def exam_template_debug_pdf():
   del formulario y así ajustar con precisión las coordenadas.
   """
 
-  template_path = os.path.join('src', 'PDF TAEKWONDO - ultima edición.pdf')
-  if not os.path.exists(template_path):
-      return jsonify({'error': 'PDF base no encontrado en src'}), 500
-
-  reader = PdfReader(template_path)
-  if not reader.pages:
-      return jsonify({'error': 'PDF base sin páginas'}), 500
-  template_page = reader.pages[0]
-
+  template, template_error = _get_exam_template()
+  if template is None:
+      return jsonify({'error': template_error}), 500
   writer = PdfWriter()
 
   # Usamos el tamaño real de la página de la plantilla para que overlay y base coincidan 1:1
-  overlay_width = float(template_page.mediabox.width)
-  overlay_height = float(template_page.mediabox.height)
+  overlay_width = template['width']
+  overlay_height = template['height']
   x_left = overlay_width * 0.30
   x_right_top = overlay_width * 0.72
   x_right_mid = overlay_width * 0.63
@@ -1931,24 +4734,10 @@ def exam_template_debug_pdf():
       c.drawString(x_right_mid, y, f'RM{i + 1}')
 
   c.save()
-  buf_overlay.seek(0)
 
-  overlay_reader = PdfReader(buf_overlay)
-  overlay_page = overlay_reader.pages[0]
+  _stamp_template_pages(writer, template, buf_overlay.getvalue())
 
-  merged_page = PageObject.create_blank_page(
-      width=template_page.mediabox.width,
-      height=template_page.mediabox.height,
-  )
-  merged_page.merge_page(template_page)
-  merged_page.merge_page(overlay_page)
-  writer.add_page(merged_page)
-
-  out_buffer = BytesIO()
-  writer.write(out_buffer)
-  out_buffer.seek(0)
-
-  return send_file(out_buffer, as_attachment=True, download_name='debug_examen_template.pdf', mimetype='application/pdf')
+  return _send_pdf(writer.write, 'debug_examen_template.pdf')
 
 
 @app.route('/api/exams/template-fields', methods=['GET'])
@@ -1959,35 +4748,258 @@ def exam_template_fields():
     en la plantilla editable y poder mapearlos desde el backend.
     """
 
-    template_path = os.path.join('src', 'PDF TAEKWONDO - ultima edición.pdf')
-    if not os.path.exists(template_path):
-        return jsonify({'error': 'PDF base no encontrado en src'}), 500
+    template, template_error = _get_exam_template()
+    if template is None:
+        return jsonify({'error': template_error}), 500
 
-    reader = PdfReader(template_path)
-    if not reader.pages:
-        return jsonify({'error': 'PDF base sin páginas'}), 500
+    # El mapa de campos (nombre -> tipo) se arma una sola vez al cargar la plantilla
+    return jsonify(template['fields'])
 
-    fields = reader.get_fields() or {}
-    # Convertimos los objetos de PyPDF2 a strings simples
-    simple = {}
-    for name, data in fields.items():
-        simple[str(name)] = {
-            'name': str(name),
-            'type': str(data.get('/FT')) if isinstance(data, dict) else None,
-        }
 
-    return jsonify(simple)
+# --- Trabajos en segundo plano ---
+# Los pedidos largos (PDF de rendida, generación de cuotas) aceptan ?async=1: se registran en la
+# tabla jobs, corren en un pool de hilos del proceso y responden 202 con el id del trabajo.
+# Los resultados (archivo o JSON) se borran JOB_RESULT_TTL_SECONDS después de terminar. Un trabajo
+# que no termina en JOB_MAX_RUNTIME_SECONDS (el proceso murió o se reinició) se informa como vencido.
+JOB_WORKERS = max(1, _env_int('JOB_WORKERS', 2))
+JOB_RESULT_TTL_SECONDS = _env_int('JOB_RESULT_TTL_SECONDS', 3600)
+JOB_MAX_RUNTIME_SECONDS = _env_int('JOB_MAX_RUNTIME_SECONDS', 900)
+JOB_RESULTS_DIR = os.environ.get('JOB_RESULTS_DIR') or os.path.join(app.instance_path, 'job_results')
+
+_job_pool = None
+_job_pool_lock = threading.Lock()
+
+
+def _get_job_pool():
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            _job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+        return _job_pool
+
+
+def _wants_async() -> bool:
+    return str(request.args.get('async', '')).strip().lower() in ('1', 'true', 'yes', 'y', 'on')
+
+
+def _update_job(job_id: str, **values):
+    """Actualiza un trabajo en su propia transacción (no toca la sesión del pedido en curso)."""
+    with db.engine.begin() as conn:
+        conn.execute(Job.__table__.update().where(Job.__table__.c.id == job_id).values(**values))
+
+
+def _serialize_job(job: Job):
+    data = {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+        'status_url': f'/api/jobs/{job.id}',
+        'result_url': None,
+    }
+    if job.status == 'done':
+        data['result_url'] = f'/api/jobs/{job.id}/result'
+    return data
+
+
+def _run_job(job_id: str, fn):
+    """Ejecuta fn(job_id) en un hilo del pool y guarda el resultado o el error en la tabla jobs."""
+    with app.app_context():
+        started = datetime.utcnow()
+        _update_job(
+            job_id, status='running', started_at=started,
+            expires_at=started + timedelta(seconds=JOB_MAX_RUNTIME_SECONDS),
+        )
+        try:
+            result = fn(job_id) or {}
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Falló el trabajo %s', job_id)
+            now = datetime.utcnow()
+            _update_job(
+                job_id, status='error', message='No se pudo completar el trabajo',
+                finished_at=now, expires_at=now + timedelta(seconds=JOB_RESULT_TTL_SECONDS),
+            )
+            return
+        now = datetime.utcnow()
+        _update_job(
+            job_id, status='done', progress=100, finished_at=now,
+            expires_at=now + timedelta(seconds=JOB_RESULT_TTL_SECONDS), **result,
+        )
+
+
+def _submit_job(kind: str, params: dict, fn):
+    """Registra un trabajo, lo encola y responde 202 con su estado.
+
+    fn(job_id) corre en segundo plano con su propio app context y devuelve las columnas del
+    resultado: result_json, o result_path + result_filename.
+    """
+    _cleanup_expired_jobs()
+    job = Job(
+        id=uuid.uuid4().hex,
+        kind=kind,
+        status='queued',
+        progress=0,
+        params=json.dumps(params),
+        # Si el proceso muere antes de terminar, el trabajo vence igual
+        expires_at=datetime.utcnow() + timedelta(seconds=JOB_MAX_RUNTIME_SECONDS),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    _get_job_pool().submit(_run_job, job.id, fn)
+
+    response = jsonify(_serialize_job(job))
+    response.status_code = 202
+    response.headers['Location'] = f'/api/jobs/{job.id}'
+    return response
+
+
+def _job_write_pdf(job_id: str, write_fn, filename: str):
+    """Escribe un PDF de trabajo en JOB_RESULTS_DIR, informando el avance de write_fn."""
+    os.makedirs(JOB_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(JOB_RESULTS_DIR, f'{job_id}.pdf')
+    try:
+        with open(path, 'wb') as fh:
+            # El último tramo (escribir el archivo) queda fuera del avance informado
+            write_fn(fh, progress=lambda fraction: _update_job(job_id, progress=int(fraction * 95)))
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return {'result_path': path, 'result_filename': filename}
+
+
+def _job_write_cached_pdf(job_id: str, key: str, write_fn, filename: str):
+    """Como _job_write_pdf, pero además deja el PDF en la cache de PDFs con la clave del pedido sincrónico.
+
+    Así el siguiente pedido (sincrónico o async) sale de la cache. El resultado del trabajo es
+    siempre su propio archivo en JOB_RESULTS_DIR (ver _job_pin_cached_pdf).
+    """
+    if PDF_CACHE_MAX_BYTES > 0:
+        fh = _pdf_cache_store(
+            key, lambda out: write_fn(out, progress=lambda fraction: _update_job(job_id, progress=int(fraction * 95))),
+        )
+        if fh is not None:
+            with fh:
+                return {'result_path': _job_pin_cached_pdf(job_id, key, fh), 'result_filename': filename}
+    return _job_write_pdf(job_id, write_fn, filename)
+
+
+def _job_pin_cached_pdf(job_id: str, key: str, fh):
+    """Fija el PDF cacheado como resultado del trabajo, en JOB_RESULTS_DIR, hasta que venza.
+
+    Un hard link no copia datos y no cambia si la cache desaloja el archivo o lo reemplaza con
+    otro render (os.replace crea un inodo nuevo). Si no se puede (otro sistema de archivos o ya
+    desalojado) se copia desde fh, que sigue legible aunque el archivo se haya borrado.
+    """
+    os.makedirs(JOB_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(JOB_RESULTS_DIR, f'{job_id}.pdf')
+    try:
+        os.link(os.path.join(PDF_CACHE_DIR, f'{key}.pdf'), path)
+    except OSError:
+        with open(path, 'wb') as out:
+            shutil.copyfileobj(fh, out)
+    return path
+
+
+def _job_generate_month(periods):
+    counts = _generate_month_for_active_students(periods)
+    return {'result_json': json.dumps(counts)}
+
+
+def _cleanup_expired_jobs():
+    """Borra los trabajos vencidos y sus archivos; devuelve cuántos se borraron."""
+    now = datetime.utcnow()
+    expired = db.session.execute(
+        select(Job.id, Job.result_path).where(Job.expires_at < now)
+    ).all()
+    if not expired:
+        return 0
+    results_dir = os.path.abspath(JOB_RESULTS_DIR)
+    for _job_id, path in expired:
+        # Trabajos anteriores podían apuntar a la cache de PDFs: esos archivos los administra su desalojo
+        if path and os.path.dirname(os.path.abspath(path)) == results_dir:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    Job.query.filter(Job.id.in_([job_id for job_id, _path in expired])).delete(synchronize_session=False)
+    db.session.commit()
+    return len(expired)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id: str):
+    job = Job.query.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    now = datetime.utcnow()
+    if job.status in ('queued', 'running') and job.expires_at and job.expires_at < now:
+        # Nadie lo va a terminar: queda como error hasta que se borre con los demás vencidos
+        message = 'El trabajo no terminó a tiempo (el servidor pudo haberse reiniciado)'
+        _update_job(
+            job_id, status='error', message=message, finished_at=now,
+            expires_at=now + timedelta(seconds=JOB_RESULT_TTL_SECONDS),
+        )
+        db.session.expire(job)
+        return jsonify({**_serialize_job(job), 'error': message}), 410
+    return jsonify(_serialize_job(job))
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def api_job_result(job_id: str):
+    job = Job.query.get(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if job.expires_at and job.expires_at < datetime.utcnow():
+        return jsonify({'error': 'El resultado del trabajo ya venció'}), 410
+    if job.status == 'error':
+        return jsonify({'error': job.message or 'No se pudo completar el trabajo'}), 500
+    if job.status != 'done':
+        return jsonify({'error': 'El trabajo todavía no terminó', 'status': job.status}), 409
+
+    if job.result_path:
+        if not os.path.exists(job.result_path):
+            return jsonify({'error': 'El resultado del trabajo ya venció'}), 410
+        return send_file(job.result_path, as_attachment=True, download_name=job.result_filename, mimetype='application/pdf')
+    return app.response_class(job.result_json or 'null', mimetype='application/json')
+
+
+@app.cli.command('jobs-cleanup')
+def cli_jobs_cleanup():
+    """Borra los trabajos en segundo plano vencidos y sus resultados."""
+    removed = _cleanup_expired_jobs()
+    print(f'Trabajos vencidos borrados: {removed}')
+
+
+@app.cli.command('sync-cleanup')
+def cli_sync_cleanup():
+    """Borra los tombstones de sincronización más viejos que SYNC_TOMBSTONE_RETENTION_DAYS."""
+    removed = _prune_sync_tombstones()
+    print(f'Tombstones de sincronización borrados: {removed} (retención: {SYNC_TOMBSTONE_RETENTION_DAYS} días)')
 
 
 def _startup_init_db():
+    # AUTO_MIGRATE=0 permite desactivar la migración al arrancar y correrla aparte con `flask db-upgrade`.
+    auto = os.environ.get('AUTO_MIGRATE')
+    if auto is not None and str(auto).strip().lower() in ('0', 'false', 'no', 'n', 'off'):
+        return
     try:
         with app.app_context():
-            db.create_all()
+            _apply_migrations()
     except Exception:
-        pass
+        app.logger.exception('No se pudieron aplicar las migraciones de esquema')
 
 
-_startup_init_db()
+# Los procesos del pool de PDFs (spawn) importan este módulo: no deben correr las migraciones
+if multiprocessing.parent_process() is None:
+    _startup_init_db()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,184 @@
+"""Compara el motor de cuotas en centavos (_run_fee_engine) contra el cálculo original en floats.
+
+Uso, desde la raíz del repo y con la misma DATABASE_URL que la app:
+
+    python scripts/fee_engine_check.py              # cuotas y pagos de la base
+    python scripts/fee_engine_check.py --random 2000 --seed 1
+
+Sale con código 1 si encuentra diferencias.
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import (  # noqa: E402
+    _fee_status, _from_cents, _load_fee_engine_inputs, _run_fee_engine, _to_cents, app,
+)
+
+
+# Implementación original en floats (la que usaba el ledger antes del motor en centavos)
+def build_charge_financials(charges, allocated_map, student_credit=0.0, today_value=None):
+    today_value = today_value or date.today()
+    remaining_credit = round(float(student_credit or 0), 2)
+    charge_meta = {}
+
+    ordered = sorted(
+        charges,
+        key=lambda c: (
+            c.due_date or date.max,
+            c.period or '',
+            c.id or 0,
+        )
+    )
+
+    for c in ordered:
+        paid = round(float(allocated_map.get(c.id, 0.0)), 2)
+        total = round(float(c.final_amount or 0), 2)
+        raw_balance = round(total - paid, 2)
+        applied_credit = 0.0
+        if raw_balance > 0 and remaining_credit > 0:
+            applied_credit = min(raw_balance, remaining_credit)
+            remaining_credit = round(remaining_credit - applied_credit, 2)
+
+        effective_balance = round(raw_balance - applied_credit, 2)
+        outstanding_balance = effective_balance if effective_balance > 0 else 0.0
+        credit_amount = abs(effective_balance) if effective_balance < 0 else 0.0
+
+        if outstanding_balance <= 0 and total > 0:
+            status = 'paid'
+        elif paid > 0:
+            status = 'partial'
+        else:
+            status = 'pending'
+
+        is_overdue = (c.due_date is not None) and (today_value > c.due_date) and (status != 'paid')
+        charge_meta[c.id] = {
+            'paid': paid,
+            'total': total,
+            'applied_credit': round(applied_credit, 2),
+            'balance': round(effective_balance, 2),
+            'outstanding_balance': round(outstanding_balance, 2),
+            'credit_amount': round(credit_amount, 2),
+            'status': status,
+            'overdue': is_overdue,
+        }
+
+    overdue_total = 0.0
+    credit_total = round(remaining_credit, 2)
+    has_partial = False
+    balance_total = 0.0
+    positive_charges_count = 0
+    for c in charges:
+        meta = charge_meta.get(c.id, {})
+        total = float(meta.get('total', 0.0))
+        if total > 0:
+            positive_charges_count += 1
+        balance_total += float(meta.get('balance', 0.0))
+        if meta.get('overdue') and float(meta.get('outstanding_balance', 0.0)) > 0:
+            overdue_total += float(meta.get('outstanding_balance', 0.0))
+        credit_total += float(meta.get('credit_amount', 0.0))
+        if meta.get('status') == 'partial' and float(meta.get('outstanding_balance', 0.0)) > 0:
+            has_partial = True
+
+    return {
+        'by_charge_id': charge_meta,
+        'overdue_total': round(overdue_total, 2),
+        'credit_total': round(credit_total, 2),
+        'has_partial': has_partial,
+        'balance_total': round(balance_total - remaining_credit, 2),
+        'positive_charges_count': positive_charges_count,
+        'remaining_credit': round(remaining_credit, 2),
+    }
+
+
+def random_fee_engine_inputs(students: int, seed: int):
+    """Datos sintéticos para comparar motores: cuotas, imputaciones y créditos al azar."""
+    rng = random.Random(seed)
+    today = date.today()
+    charges, paid_cents, credit_cents = [], {}, {}
+    charge_id = 0
+    for sid in range(1, students + 1):
+        for _ in range(rng.randint(0, 12)):
+            charge_id += 1
+            total = rng.choice([0, rng.randint(1, 5000000)])
+            due = None if rng.random() < 0.05 else today + timedelta(days=rng.randint(-400, 60))
+            charges.append(SimpleNamespace(
+                id=charge_id, student_id=sid, period=f'{rng.randint(2023, 2026)}-{rng.randint(1, 12):02d}',
+                due_date=due, final_amount=_from_cents(total),
+            ))
+            if rng.random() < 0.6:
+                paid_cents[charge_id] = rng.choice([total, rng.randint(0, total), total + rng.randint(1, 10000)])
+        if rng.random() < 0.5:
+            credit_cents[sid] = rng.randint(-5000, 3000000)
+    return charges, paid_cents, credit_cents
+
+
+def compare_fee_engines(charges, paid_cents, credit_cents, today):
+    """Compara _run_fee_engine contra build_charge_financials y devuelve las diferencias."""
+    result = _run_fee_engine(charges, paid_cents, credit_cents, today)
+    by_student = {}
+    for c in charges:
+        by_student.setdefault(c.student_id, []).append(c)
+    allocated_map = {cid: cents / 100 for cid, cents in paid_cents.items()}
+
+    legacy_charges = {}
+    problems = []
+    for sid, st in result['students'].items():
+        st_charges = by_student.get(sid, [])
+        legacy = build_charge_financials(
+            st_charges, allocated_map, student_credit=credit_cents.get(sid, 0) / 100, today_value=today,
+        )
+        legacy_charges.update(legacy['by_charge_id'])
+        expected = (
+            _to_cents(legacy['balance_total']), _to_cents(legacy['credit_total']), _to_cents(legacy['overdue_total']),
+            legacy['has_partial'], legacy['positive_charges_count'], _fee_status(legacy, bool(st_charges)),
+        )
+        got = (
+            st['balance_total'], st['credit_total'], st['overdue_total'],
+            st['has_partial'], st['positive_charges_count'], _fee_status(st, bool(st_charges)),
+        )
+        if expected != got:
+            problems.append(f'alumno {sid}: floats {expected}, centavos {got}')
+
+    for i, c in enumerate(result['rows']):
+        meta = legacy_charges[c.id]
+        expected = (
+            _to_cents(meta['paid']), _to_cents(meta['applied_credit']), _to_cents(meta['balance']),
+            meta['status'], meta['overdue'],
+        )
+        got = (
+            result['paid'][i], result['applied_credit'][i], result['balance'][i],
+            result['status'][i], bool(result['overdue'][i]),
+        )
+        if expected != got:
+            problems.append(f'cuota {c.id} (alumno {c.student_id}): floats {expected}, centavos {got}')
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--random', dest='random_students', type=int, default=0,
+                        help='Usar N alumnos sintéticos en lugar de la base.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    today = date.today()
+    if args.random_students:
+        charges, paid_cents, credit_cents = random_fee_engine_inputs(args.random_students, args.seed)
+    else:
+        with app.app_context():
+            charges, paid_cents, credit_cents, _last = _load_fee_engine_inputs(None)
+    problems = compare_fee_engines(charges, paid_cents, credit_cents, today)
+    for line in problems[:50]:
+        print(line)
+    print(f'{len(charges)} cuotas comparadas, {len(problems)} diferencias.')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
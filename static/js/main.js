@@ -35,6 +35,43 @@ async function apiGet(url) {
   return res.json();
 }
 
+// Sincronización incremental (?since=): se guarda la colección por id junto con el cursor del
+// servidor y en cada carga solo se piden los cambios y los ids borrados.
+function createSyncedCollection(idKey, sortFn) {
+  return { url: null, cursor: null, byId: new Map(), idKey, sortFn };
+}
+
+async function syncCollection(collection, url) {
+  if (collection.url !== url) {
+    collection.url = url;
+    collection.cursor = null;
+  }
+  const sep = url.includes('?') ? '&' : '?';
+  const data = await apiGet(`${url}${sep}since=${encodeURIComponent(collection.cursor || '0')}`);
+  if (data.full) collection.byId.clear();
+  // Primero los borrados: un id reutilizado puede venir en ambas listas
+  (data.deleted || []).forEach((id) => collection.byId.delete(id));
+  (data.items || []).forEach((item) => collection.byId.set(item[collection.idKey], item));
+  collection.cursor = data.cursor;
+  const items = Array.from(collection.byId.values());
+  if (collection.sortFn) items.sort(collection.sortFn);
+  return items;
+}
+
+// Mismo orden que el servidor: sin apellido al final, luego apellido, nombre e id
+function compareByStudentName(idKey) {
+  const keys = (row) => [row.last_name == null ? 1 : 0, row.last_name || '', row.first_name || '', row[idKey]];
+  return (a, b) => {
+    const ka = keys(a);
+    const kb = keys(b);
+    for (let i = 0; i < ka.length; i++) {
+      if (ka[i] < kb[i]) return -1;
+      if (ka[i] > kb[i]) return 1;
+    }
+    return 0;
+  };
+}
+
 function renderGenericCalendar(targetCalendarEl, selectedDateRef, ymRef, onSelect) {
   if (!targetCalendarEl) return;
   const { year, month } = ymRef.value;
@@ -164,6 +201,7 @@ async function apiSend(url, method, body) {
 // --- Alumnos ---
 
 let studentsCache = [];
+const studentsSync = createSyncedCollection('id', compareByStudentName('id'));
 
 const studentsTbody = document.getElementById('students-tbody');
 const studentsEmptyState = document.getElementById('students-empty-state');
@@ -651,7 +689,7 @@ btnConfirmStudentPromote?.addEventListener('click', async () => {
 
 async function loadStudents() {
   try {
-    const list = await apiGet('/api/students');
+    const list = await syncCollection(studentsSync, '/api/students');
     studentsCache = list;
     if (!studentsTbody) return;
     studentsTbody.innerHTML = '';
@@ -927,7 +965,20 @@ let currentYearMonth = (() => {
   return { year: d.getFullYear(), month: d.getMonth() };
 })();
 
-let eventsCache = [];
+// Eventos del mes mostrado, agrupados por día: { 'AAAA-MM-DD': [eventos] }
+let calendarDaysCache = {};
+// Exámenes de hoy en adelante (lista de la sección Exámenes)
+let examsCache = [];
+const examsSync = createSyncedCollection('id', null);
+
+function toIsoDate(d) {
+  return `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}-${String(d.getDate()).padStart(2, '0')}`;
+}
+
+function calendarMonthKey() {
+  const { year, month } = currentYearMonth;
+  return `${year}-${String(month + 1).padStart(2, '0')}`;
+}
 
 function getFamilyBirthdayEntriesForDate(dateStr) {
   const [, mStr, dStr] = String(dateStr || '').split('-');
@@ -1035,8 +1086,9 @@ function renderCalendar() {
 
     const evDot = document.createElement('span');
     const dateStr = cellDate.toISOString().slice(0, 10);
-    const hasExam = eventsCache.some((e) => e.date === dateStr && e.type === 'exam');
-    const hasEvent = eventsCache.some((e) => e.date === dateStr);
+    const cellEvents = calendarDaysCache[dateStr] || [];
+    const hasExam = cellEvents.some((e) => e.type === 'exam');
+    const hasEvent = cellEvents.length > 0;
 
     // Cumpleaños: comparar solo mes/día en base a las cadenas 'YYYY-MM-DD'
     const [yStr, mStr, dStr] = dateStr.split('-');
@@ -1072,7 +1124,7 @@ function renderCalendar() {
 
 function showDayEvents(dateStr) {
   if (!calendarDetailsBody) return;
-  const dayEvents = eventsCache.filter((e) => e.date === dateStr);
+  const dayEvents = calendarDaysCache[dateStr] || [];
   const [, mStr, dStr] = dateStr.split('-');
   const cellMonth = Number(mStr);
   const cellDay = Number(dStr);
@@ -1131,7 +1183,7 @@ calendarPrev?.addEventListener('click', () => {
     currentYearMonth.month = 11;
     currentYearMonth.year -= 1;
   }
-  renderCalendar();
+  loadCalendarMonth();
 });
 
 calendarNext?.addEventListener('click', () => {
@@ -1140,13 +1192,27 @@ calendarNext?.addEventListener('click', () => {
     currentYearMonth.month = 0;
     currentYearMonth.year += 1;
   }
-  renderCalendar();
+  loadCalendarMonth();
 });
 
+async function loadCalendarMonth() {
+  const monthKey = calendarMonthKey();
+  try {
+    const data = await apiGet(`/api/calendar/${monthKey}`);
+    // Si se cambió de mes mientras se cargaba, descartar la respuesta vieja
+    if (monthKey !== calendarMonthKey()) return;
+    calendarDaysCache = data.days || {};
+  } catch (err) {
+    console.error(err);
+    calendarDaysCache = {};
+  }
+  renderCalendar();
+}
+
 async function loadEvents() {
+  loadCalendarMonth();
   try {
-    eventsCache = await apiGet('/api/events');
-    renderCalendar();
+    examsCache = await syncCollection(examsSync, `/api/events?type=exam&from=${toIsoDate(new Date())}`);
     renderExamsFromEvents();
   } catch (err) {
     console.error(err);
@@ -1165,6 +1231,7 @@ const examStudentIdInput = document.getElementById('exam-student-id');
 // Nuevo flujo: multi-alumno por examen
 const btnOpenExamStudents = document.getElementById('btn-open-exam-students');
 const btnGenerateExamRindePdf = document.getElementById('btn-generate-exam-rinde-pdf');
+const btnGenerateExamEvalBatchPdf = document.getElementById('btn-generate-exam-eval-batch-pdf');
 const examDateDisplay = document.getElementById('exam-date-display');
 const examDatePopover = document.getElementById('exam-date-popover');
 const examDateCalendar = document.getElementById('exam-date-calendar');
@@ -1428,7 +1495,7 @@ function renderExamsFromEvents() {
   examsList.innerHTML = '';
   const today = new Date();
 
-  const exams = eventsCache
+  const exams = examsCache
     .filter((e) => e.type === 'exam')
     .filter((e) => {
       // Filtrar sólo exámenes cuya fecha no haya pasado
@@ -1496,6 +1563,7 @@ async function selectExam(eventId, liElement) {
   // Habilitar botones del nuevo flujo si existen
   if (btnOpenExamStudents) btnOpenExamStudents.disabled = false;
   if (btnGenerateExamRindePdf) btnGenerateExamRindePdf.disabled = false;
+  if (btnGenerateExamEvalBatchPdf) btnGenerateExamEvalBatchPdf.disabled = false;
 
   // Cargar desde backend los alumnos ya inscriptos para este examen
   try {
@@ -1519,7 +1587,7 @@ async function openExamStudentsModal() {
   try {
     // Asegurar alumnos cargados
     if (!studentsCache || !studentsCache.length) {
-      studentsCache = await apiGet('/api/students');
+      studentsCache = await syncCollection(studentsSync, '/api/students');
     }
     // Alumnos ya inscriptos en este examen desde backend
     const inscriptos = await apiGet(`/api/exams/${eventId}/students`);
@@ -1617,6 +1685,31 @@ btnSaveExamStudents?.addEventListener('click', () => {
     });
 });
 
+// Trabajos largos: el backend responde 202 y se consulta el estado hasta que termina
+// (o hasta JOB_WAIT_MAX_MS; el backend responde 410 si el trabajo venció sin terminar)
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_WAIT_MAX_MS = 15 * 60 * 1000;
+
+async function waitForJob(statusUrl) {
+  const deadline = Date.now() + JOB_WAIT_MAX_MS;
+  while (Date.now() < deadline) {
+    const res = await fetch(statusUrl);
+    if (!res.ok) {
+      throw new Error('No se pudo consultar el trabajo (código ' + res.status + ').');
+    }
+    const job = await res.json();
+    if (job.status === 'done') return job;
+    if (job.status === 'error') {
+      throw new Error(job.message || 'No se pudo completar el trabajo.');
+    }
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+  throw new Error('El trabajo tardó demasiado en terminar.');
+}
+
+// A partir de esta cantidad de alumnos el PDF de rendida se pide como trabajo en segundo plano
+const EXAM_RINDE_ASYNC_MIN_STUDENTS = 40;
+
 btnGenerateExamRindePdf?.addEventListener('click', async () => {
   if (!examPdfBox) return;
   const eventId = Number(examPdfBox.getAttribute('data-event-id'));
@@ -1632,12 +1725,20 @@ btnGenerateExamRindePdf?.addEventListener('click', async () => {
   }
 
   try {
-    const res = await fetch(`/api/exams/${eventId}/rinde-pdf`, {
+    // Los exámenes chicos se generan en el mismo pedido; los grandes en segundo plano
+    const asyncQuery = ids.length >= EXAM_RINDE_ASYNC_MIN_STUDENTS ? '?async=1' : '';
+    let res = await fetch(`/api/exams/${eventId}/rinde-pdf${asyncQuery}`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ student_ids: ids }),
     });
 
+    // El PDF se genera en segundo plano; se descarga cuando el trabajo termina
+    if (res.status === 202) {
+      const job = await waitForJob((await res.json()).status_url);
+      res = await fetch(job.result_url);
+    }
+
     if (!res.ok) {
       throw new Error('No se pudo generar el PDF de rendida (código ' + res.status + ').');
     }
@@ -1664,6 +1765,44 @@ btnGenerateExamRindePdf?.addEventListener('click', async () => {
   }
 });
 
+btnGenerateExamEvalBatchPdf?.addEventListener('click', async () => {
+  if (!examPdfBox) return;
+  const eventId = Number(examPdfBox.getAttribute('data-event-id'));
+  if (!eventId) {
+    alert('Primero seleccioná un examen de la lista.');
+    return;
+  }
+
+  const ids = examStudentsSelection[eventId] || [];
+  if (!ids.length) {
+    alert('Configurá primero los alumnos que rinden para este examen.');
+    return;
+  }
+
+  try {
+    const res = await fetch(`/api/exams/${eventId}/evaluation-batch-pdf`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ student_ids: ids }),
+    });
+
+    if (!res.ok) {
+      throw new Error('No se pudieron generar las hojas de evaluación (código ' + res.status + ').');
+    }
+
+    const blob = await res.blob();
+    const link = document.createElement('a');
+    link.href = URL.createObjectURL(blob);
+    link.download = `evaluaciones_examen_${eventId}.pdf`;
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
+  } catch (err) {
+    console.error(err);
+    alert('No se pudieron generar las hojas de evaluación.');
+  }
+});
+
 btnGenerateExamPdf?.addEventListener('click', () => {
   if (!examPdfBox) return;
   const eventId = examPdfBox.getAttribute('data-event-id');
@@ -1794,6 +1933,7 @@ const feesFixedFeeEnabled = document.getElementById('fees-fixed-fee-enabled');
 const feesFixedFeeAmount = document.getElementById('fees-fixed-fee-amount');
 
 let feesOverviewCache = [];
+const feesOverviewSync = createSyncedCollection('student_id', compareByStudentName('student_id'));
 let feesSelectedStudentId = null;
 let feesSelectedStudentData = null;
 let pendingFeeChargeDelete = null;
@@ -2207,9 +2347,12 @@ function renderFeesOverview() {
 async function loadFeesOverview() {
   try {
     syncGeneralFeesPeriodFilter();
-    const periodQuery = feesCurrentPeriodFilter ? `?period=${encodeURIComponent(feesCurrentPeriodFilter)}` : '';
-    const data = await apiGet(`/api/fees/overview${periodQuery}`);
-    feesOverviewCache = Array.isArray(data) ? data : [];
+    if (feesCurrentPeriodFilter) {
+      const data = await apiGet(`/api/fees/overview?period=${encodeURIComponent(feesCurrentPeriodFilter)}`);
+      feesOverviewCache = Array.isArray(data) ? data : [];
+    } else {
+      feesOverviewCache = await syncCollection(feesOverviewSync, '/api/fees/overview');
+    }
     renderFeesOverview();
   } catch (err) {
     console.error(err);
@@ -2431,8 +2574,9 @@ btnFeesGenerateMonth?.addEventListener('click', async () => {
     });
     btnFeesGenerateMonth.textContent = 'Generando...';
     const res = await apiSend('/api/fees/generate-month', 'POST', payload);
-    if (res?.created > 0) {
-      showFeesFeedback(`Se generaron ${res.created} cuotas.`, 'info');
+    if (res?.created > 0 || res?.updated > 0) {
+      const updatedText = res.updated > 0 ? ` y se actualizaron ${res.updated}` : '';
+      showFeesFeedback(`Se generaron ${res.created || 0} cuotas${updatedText}.`, 'info');
     } else {
       showFeesFeedback('No se generó ninguna cuota. Revisá el período seleccionado o si esas cuotas ya existen.', 'error');
     }